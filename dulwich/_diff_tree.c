@@ -76,7 +76,7 @@ static void free_objects(PyObject **objs, Py_ssize_t n)
 static PyObject **tree_entries(char *path, Py_ssize_t path_len, PyObject *tree,
 		Py_ssize_t *n)
 {
-	PyObject *iteritems, *items, **result = NULL;
+	PyObject *iteritems, *iter_items, *items, **result = NULL;
 	PyObject *old_entry, *name, *sha;
 	Py_ssize_t i = 0, name_len, new_path_len;
 	char *new_path;
@@ -94,28 +94,26 @@ static PyObject **tree_entries(char *path, Py_ssize_t path_len, PyObject *tree,
 	iteritems = PyObject_GetAttrString(tree, "iteritems");
 	if (!iteritems)
 		return NULL;
-	items = PyObject_CallFunctionObjArgs(iteritems, Py_True, NULL);
+	iter_items = PyObject_CallFunctionObjArgs(iteritems, Py_True, NULL);
 	Py_DECREF(iteritems);
-	if (items == NULL) {
+	if (iter_items == NULL) {
 		return NULL;
 	}
-	/* The C implementation of iteritems returns a list, so depend on that. */
-	if (!PyList_Check(items)) {
-		PyErr_SetString(PyExc_TypeError,
-			"Tree.iteritems() did not return a list");
+	items = PySequence_Fast(iter_items,
+		"Tree.iteritems() did not return an iterable");
+	Py_DECREF(iter_items);
+	if (items == NULL) {
 		return NULL;
 	}
 
-	*n = PyList_Size(items);
+	*n = PySequence_Fast_GET_SIZE(items);
 	result = PyMem_New(PyObject*, *n);
 	if (!result) {
 		PyErr_NoMemory();
 		goto error;
 	}
 	for (i = 0; i < *n; i++) {
-		old_entry = PyList_GetItem(items, i);
-		if (!old_entry)
-			goto error;
+		old_entry = PySequence_Fast_GET_ITEM(items, i);
 		sha = PyTuple_GetItem(old_entry, 2);
 		if (!sha)
 			goto error;
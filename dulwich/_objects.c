@@ -17,6 +17,7 @@
  * MA  02110-1301, USA.
  */
 
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <stdlib.h>
 #include <sys/stat.h>
@@ -29,9 +30,15 @@ typedef int Py_ssize_t;
 #define PyInt_Check(obj) 0
 #define PyInt_CheckExact(obj) 0
 #define PyInt_AsLong PyLong_AsLong
+#define PyInt_FromLong PyLong_FromLong
+#define PyInt_FromSsize_t PyLong_FromSsize_t
+#define PyNumber_Int PyNumber_Long
 #define PyString_AS_STRING PyBytes_AS_STRING
 #define PyString_Check PyBytes_Check
 #define PyString_FromStringAndSize PyBytes_FromStringAndSize
+#define PyString_AsStringAndSize PyBytes_AsStringAndSize
+#define PyString_CheckExact PyBytes_CheckExact
+#define PyString_GET_SIZE PyBytes_GET_SIZE
 #endif
 
 #if defined(__MINGW32_VERSION) || defined(__APPLE__)
@@ -46,7 +53,7 @@ size_t rep_strnlen(char *text, size_t maxlen)
 
 #define bytehex(x) (((x)<0xa)?('0'+(x)):('a'-0xa+(x)))
 
-static PyObject *tree_entry_cls;
+static PyObject *tree_entry_cls, *tag_cls, *parse_timezone_func;
 static PyObject *object_format_exception_cls;
 
 static PyObject *sha_to_pyhex(const unsigned char *sha)
@@ -64,7 +71,8 @@ static PyObject *sha_to_pyhex(const unsigned char *sha)
 static PyObject *py_parse_tree(PyObject *self, PyObject *args, PyObject *kw)
 {
 	char *text, *start, *end;
-	int len, namelen, strict;
+	Py_ssize_t len;
+	int namelen, strict;
 	PyObject *ret, *item, *name, *sha, *py_strict = NULL;
 	static char *kwlist[] = {"text", "strict", NULL};
 
@@ -255,10 +263,748 @@ error:
 	return NULL;
 }
 
+/* An entry in a serialized tree, pointing into the tree text. */
+struct tree_entry_ref {
+	Py_ssize_t offset;
+	long mode;
+	const char *name;
+	Py_ssize_t name_len;
+	const unsigned char *sha;
+};
+
+#define TREE_ENTRY_TRUNCATED -1
+#define TREE_ENTRY_INVALID_MODE -2
+
+/*
+ * Parse the tree entry at an offset in a tree text.
+ *
+ * Returns the offset of the next entry, or TREE_ENTRY_TRUNCATED or
+ * TREE_ENTRY_INVALID_MODE without setting an exception.
+ */
+static Py_ssize_t tree_entry_at(const char *text, Py_ssize_t len,
+                                Py_ssize_t offset, struct tree_entry_ref *entry)
+{
+	const char *name_end, *mode_end, *p;
+	long mode = 0;
+
+	if (offset < 0 || offset >= len)
+		return TREE_ENTRY_TRUNCATED;
+	name_end = memchr(text + offset, '\0', len - offset);
+	if (name_end == NULL || name_end + 21 > text + len)
+		return TREE_ENTRY_TRUNCATED;
+	mode_end = memchr(text + offset, ' ', name_end - (text + offset));
+	if (mode_end == NULL || mode_end == text + offset)
+		return TREE_ENTRY_INVALID_MODE;
+	for (p = text + offset; p < mode_end; p++) {
+		if (*p < '0' || *p > '7' || mode > (LONG_MAX >> 3))
+			return TREE_ENTRY_INVALID_MODE;
+		mode = (mode << 3) + (*p - '0');
+	}
+	entry->offset = offset;
+	entry->mode = mode;
+	entry->name = mode_end + 1;
+	entry->name_len = name_end - entry->name;
+	entry->sha = (const unsigned char *)name_end + 1;
+	return name_end + 21 - text;
+}
+
+/* Like tree_entry_at, but for an offset object, setting an exception. */
+static int tree_entry_at_object(const char *text, Py_ssize_t len,
+                                PyObject *py_offset,
+                                struct tree_entry_ref *entry)
+{
+	Py_ssize_t offset, ret;
+
+	offset = PyNumber_AsSsize_t(py_offset, PyExc_OverflowError);
+	if (offset == -1 && PyErr_Occurred())
+		return -1;
+	ret = tree_entry_at(text, len, offset, entry);
+	if (ret == TREE_ENTRY_TRUNCATED) {
+		PyErr_SetString(object_format_exception_cls, "Truncated tree entry");
+		return -1;
+	}
+	if (ret == TREE_ENTRY_INVALID_MODE) {
+		PyErr_SetString(object_format_exception_cls, "Invalid mode");
+		return -1;
+	}
+	return 0;
+}
+
+/* Compare the tree order keys of two names, that is with '/' appended to
+ * the names of subtrees. */
+static int cmp_tree_key(const char *a, Py_ssize_t a_len, int a_dir,
+                        const char *b, Py_ssize_t b_len, int b_dir)
+{
+	Py_ssize_t a_key_len = a_len + (a_dir ? 1 : 0);
+	Py_ssize_t b_key_len = b_len + (b_dir ? 1 : 0);
+	Py_ssize_t i, common = a_len < b_len ? a_len : b_len;
+	int ret, ca, cb;
+
+	ret = memcmp(a, b, common);
+	if (ret != 0)
+		return ret;
+	for (i = common; i < a_key_len && i < b_key_len; i++) {
+		ca = i < a_len ? (unsigned char)a[i] : '/';
+		cb = i < b_len ? (unsigned char)b[i] : '/';
+		if (ca != cb)
+			return ca - cb;
+	}
+	return (a_key_len > b_key_len) - (a_key_len < b_key_len);
+}
+
+static PyObject *py_tree_entry_offsets(PyObject *self, PyObject *args)
+{
+	const char *text;
+	Py_ssize_t len, pos = 0, count = 0, alloc = 0, i;
+	struct tree_entry_ref *entries = NULL, *new_entries, entry, *prev;
+	PyObject *ret = NULL, *py_offset;
+
+#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "y#", &text, &len))
+#else
+	if (!PyArg_ParseTuple(args, "s#", &text, &len))
+#endif
+		return NULL;
+
+	while (pos < len) {
+		pos = tree_entry_at(text, len, pos, &entry);
+		if (pos == TREE_ENTRY_TRUNCATED) {
+			PyErr_SetString(object_format_exception_cls,
+			                "Truncated tree entry");
+			goto error;
+		}
+		if (pos == TREE_ENTRY_INVALID_MODE)
+			goto not_in_order;
+		if (count > 0) {
+			prev = &entries[count - 1];
+			if (cmp_tree_key(prev->name, prev->name_len, S_ISDIR(prev->mode),
+			                 entry.name, entry.name_len,
+			                 S_ISDIR(entry.mode)) >= 0)
+				goto not_in_order;
+		}
+		if (S_ISDIR(entry.mode)) {
+			/* A file with the same name as this subtree sorts before it,
+			 * separated only by entries that start with that name. */
+			for (i = count - 1; i >= 0; i--) {
+				prev = &entries[i];
+				if (prev->name_len < entry.name_len ||
+				    memcmp(prev->name, entry.name, entry.name_len) != 0)
+					break;
+				if (prev->name_len == entry.name_len)
+					goto not_in_order;
+			}
+		}
+		if (count == alloc) {
+			alloc = alloc ? alloc * 2 : 64;
+			new_entries = PyMem_Resize(entries, struct tree_entry_ref, alloc);
+			if (new_entries == NULL) {
+				PyErr_NoMemory();
+				goto error;
+			}
+			entries = new_entries;
+		}
+		entries[count++] = entry;
+	}
+
+	ret = PyList_New(count);
+	if (ret == NULL)
+		goto error;
+	for (i = 0; i < count; i++) {
+		py_offset = PyInt_FromSsize_t(entries[i].offset);
+		if (py_offset == NULL) {
+			Py_DECREF(ret);
+			ret = NULL;
+			goto error;
+		}
+		PyList_SET_ITEM(ret, i, py_offset);
+	}
+	PyMem_Free(entries);
+	return ret;
+
+not_in_order:
+	PyMem_Free(entries);
+	Py_RETURN_NONE;
+
+error:
+	PyMem_Free(entries);
+	return NULL;
+}
+
+static PyObject *py_tree_lookup(PyObject *self, PyObject *args)
+{
+	const char *text, *name;
+	Py_ssize_t len, name_len, lo, hi, mid, n;
+	PyObject *offsets;
+	struct tree_entry_ref entry;
+	int dir;
+
+#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "y#O!y#", &text, &len, &PyList_Type,
+	                      &offsets, &name, &name_len))
+#else
+	if (!PyArg_ParseTuple(args, "s#O!s#", &text, &len, &PyList_Type,
+	                      &offsets, &name, &name_len))
+#endif
+		return NULL;
+
+	n = PyList_GET_SIZE(offsets);
+	for (dir = 0; dir < 2; dir++) {
+		lo = 0;
+		hi = n;
+		while (lo < hi) {
+			mid = lo + (hi - lo) / 2;
+			if (tree_entry_at_object(text, len, PyList_GET_ITEM(offsets, mid),
+			                         &entry) < 0)
+				return NULL;
+			if (cmp_tree_key(entry.name, entry.name_len, S_ISDIR(entry.mode),
+			                 name, name_len, dir) < 0)
+				lo = mid + 1;
+			else
+				hi = mid;
+		}
+		if (lo < n) {
+			if (tree_entry_at_object(text, len, PyList_GET_ITEM(offsets, lo),
+			                         &entry) < 0)
+				return NULL;
+			if (entry.name_len == name_len &&
+			    memcmp(entry.name, name, name_len) == 0)
+				return Py_BuildValue("(lN)", entry.mode,
+				                     sha_to_pyhex(entry.sha));
+		}
+	}
+	Py_RETURN_NONE;
+}
+
+struct name_order_item {
+	const char *name;
+	Py_ssize_t name_len;
+	PyObject *offset;
+};
+
+static int cmp_name_order_item(const void *_a, const void *_b)
+{
+	const struct name_order_item *a = _a, *b = _b;
+	int ret;
+
+	ret = memcmp(a->name, b->name,
+	             a->name_len < b->name_len ? a->name_len : b->name_len);
+	if (ret != 0)
+		return ret;
+	return (a->name_len > b->name_len) - (a->name_len < b->name_len);
+}
+
+static PyObject *py_tree_name_order(PyObject *self, PyObject *args)
+{
+	const char *text;
+	Py_ssize_t len, n, i;
+	PyObject *offsets, *ret;
+	struct name_order_item *items;
+	struct tree_entry_ref entry;
+
+#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "y#O!", &text, &len, &PyList_Type, &offsets))
+#else
+	if (!PyArg_ParseTuple(args, "s#O!", &text, &len, &PyList_Type, &offsets))
+#endif
+		return NULL;
+
+	n = PyList_GET_SIZE(offsets);
+	items = PyMem_New(struct name_order_item, n);
+	if (items == NULL)
+		return PyErr_NoMemory();
+	for (i = 0; i < n; i++) {
+		items[i].offset = PyList_GET_ITEM(offsets, i);
+		if (tree_entry_at_object(text, len, items[i].offset, &entry) < 0) {
+			PyMem_Free(items);
+			return NULL;
+		}
+		items[i].name = entry.name;
+		items[i].name_len = entry.name_len;
+	}
+	qsort(items, n, sizeof(struct name_order_item), cmp_name_order_item);
+
+	ret = PyList_New(n);
+	if (ret != NULL) {
+		for (i = 0; i < n; i++) {
+			Py_INCREF(items[i].offset);
+			PyList_SET_ITEM(ret, i, items[i].offset);
+		}
+	}
+	PyMem_Free(items);
+	return ret;
+}
+
+static PyObject *py_tree_entry(PyObject *self, PyObject *args)
+{
+	const char *text;
+	Py_ssize_t len;
+	PyObject *py_offset, *name, *mode, *sha, *fields, *new_args, *ret;
+	struct tree_entry_ref entry;
+
+#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "y#O", &text, &len, &py_offset))
+#else
+	if (!PyArg_ParseTuple(args, "s#O", &text, &len, &py_offset))
+#endif
+		return NULL;
+
+	if (tree_entry_at_object(text, len, py_offset, &entry) < 0)
+		return NULL;
+	name = PyString_FromStringAndSize(entry.name, entry.name_len);
+	mode = PyInt_FromLong(entry.mode);
+	sha = sha_to_pyhex(entry.sha);
+	if (name == NULL || mode == NULL || sha == NULL) {
+		Py_XDECREF(name);
+		Py_XDECREF(mode);
+		Py_XDECREF(sha);
+		return NULL;
+	}
+	/* Like TreeEntry(name, mode, sha), without going through the
+	 * namedtuple's __new__ in Python. */
+	fields = PyTuple_New(3);
+	if (fields == NULL) {
+		Py_DECREF(name);
+		Py_DECREF(mode);
+		Py_DECREF(sha);
+		return NULL;
+	}
+	PyTuple_SET_ITEM(fields, 0, name);
+	PyTuple_SET_ITEM(fields, 1, mode);
+	PyTuple_SET_ITEM(fields, 2, sha);
+	new_args = PyTuple_Pack(1, fields);
+	Py_DECREF(fields);
+	if (new_args == NULL)
+		return NULL;
+	ret = PyTuple_Type.tp_new((PyTypeObject *)tree_entry_cls, new_args, NULL);
+	Py_DECREF(new_args);
+	return ret;
+}
+
+/* Growable buffer for header values that span continuation lines. */
+struct value_buf {
+	char *data;
+	Py_ssize_t len;
+	Py_ssize_t alloc;
+};
+
+static int value_buf_append(struct value_buf *buf, const char *data,
+                            Py_ssize_t len)
+{
+	if (len == 0)
+		return 0;
+	if (buf->len + len > buf->alloc) {
+		Py_ssize_t alloc = (buf->len + len) * 2;
+		char *new_data = PyMem_Realloc(buf->data, alloc);
+		if (new_data == NULL) {
+			PyErr_NoMemory();
+			return -1;
+		}
+		buf->data = new_data;
+		buf->alloc = alloc;
+	}
+	memcpy(buf->data + buf->len, data, len);
+	buf->len += len;
+	return 0;
+}
+
+static int append_field(PyObject *fields, const char *key, Py_ssize_t key_len,
+                        const char *value, Py_ssize_t value_len)
+{
+	PyObject *py_key, *py_value, *item;
+	int ret;
+
+	/* Like value.rstrip(b'\n') */
+	while (value_len > 0 && value[value_len - 1] == '\n')
+		value_len--;
+	py_key = PyString_FromStringAndSize(key, key_len);
+	if (py_key == NULL)
+		return -1;
+	py_value = PyString_FromStringAndSize(value, value_len);
+	if (py_value == NULL) {
+		Py_DECREF(py_key);
+		return -1;
+	}
+	item = PyTuple_Pack(2, py_key, py_value);
+	Py_DECREF(py_key);
+	Py_DECREF(py_value);
+	if (item == NULL)
+		return -1;
+	ret = PyList_Append(fields, item);
+	Py_DECREF(item);
+	return ret;
+}
+
+static int append_message(PyObject *fields, PyObject *message)
+{
+	PyObject *item;
+	int ret;
+
+	if (message == NULL)
+		return -1;
+	item = PyTuple_Pack(2, Py_None, message);
+	Py_DECREF(message);
+	if (item == NULL)
+		return -1;
+	ret = PyList_Append(fields, item);
+	Py_DECREF(item);
+	return ret;
+}
+
+/*
+ * Split the text of a commit or tag into its header fields and message.
+ * Returns a list of (field, value) tuples, as yielded by
+ * dulwich.objects._parse_message.
+ */
+static PyObject *split_message(const char *text, Py_ssize_t len)
+{
+	const char *pos = text, *end = text + len;
+	const char *line_end, *newline, *space, *key = NULL;
+	Py_ssize_t key_len = 0;
+	struct value_buf value = { NULL, 0, 0 };
+	int headers_done = 0;
+	PyObject *fields;
+
+	fields = PyList_New(0);
+	if (fields == NULL)
+		return NULL;
+
+	while (pos < end) {
+		newline = memchr(pos, '\n', end - pos);
+		line_end = newline ? newline + 1 : end;
+		if (*pos == ' ') {
+			/* Indented continuation of the previous line */
+			if (key == NULL) {
+				PyErr_SetString(PyExc_ValueError,
+				                "Continuation line without header");
+				goto error;
+			}
+			if (value_buf_append(&value, pos + 1, line_end - pos - 1) < 0)
+				goto error;
+			pos = line_end;
+			continue;
+		}
+		if (key != NULL &&
+		    append_field(fields, key, key_len, value.data, value.len) < 0)
+			goto error;
+		if (line_end - pos == 1 && *pos == '\n') {
+			/* Empty line indicates end of headers */
+			pos = line_end;
+			headers_done = 1;
+			break;
+		}
+		space = memchr(pos, ' ', line_end - pos);
+		if (space == NULL) {
+			PyErr_SetString(PyExc_ValueError,
+			                "Header line without value");
+			goto error;
+		}
+		key = pos;
+		key_len = space - pos;
+		value.len = 0;
+		if (value_buf_append(&value, space + 1, line_end - space - 1) < 0)
+			goto error;
+		pos = line_end;
+	}
+
+	if (headers_done) {
+		if (append_message(fields,
+		                   PyString_FromStringAndSize(pos, end - pos)) < 0)
+			goto error;
+	} else {
+		if (key != NULL &&
+		    append_field(fields, key, key_len, value.data, value.len) < 0)
+			goto error;
+		Py_INCREF(Py_None);
+		if (append_message(fields, Py_None) < 0)
+			goto error;
+	}
+	PyMem_Free(value.data);
+	return fields;
+
+error:
+	PyMem_Free(value.data);
+	Py_DECREF(fields);
+	return NULL;
+}
+
+static PyObject *join_chunks(PyObject *chunks)
+{
+	PyObject *empty, *ret;
+
+	if (PyList_Check(chunks) && PyList_GET_SIZE(chunks) == 1 &&
+	    PyString_CheckExact(PyList_GET_ITEM(chunks, 0))) {
+		ret = PyList_GET_ITEM(chunks, 0);
+		Py_INCREF(ret);
+		return ret;
+	}
+	empty = PyString_FromStringAndSize(NULL, 0);
+	if (empty == NULL)
+		return NULL;
+	ret = PyObject_CallMethod(empty, "join", "O", chunks);
+	Py_DECREF(empty);
+	return ret;
+}
+
+static PyObject *py_parse_message(PyObject *self, PyObject *args)
+{
+	PyObject *chunks, *text, *ret;
+	char *data;
+	Py_ssize_t len;
+
+	if (!PyArg_ParseTuple(args, "O", &chunks))
+		return NULL;
+	text = join_chunks(chunks);
+	if (text == NULL)
+		return NULL;
+	if (PyString_AsStringAndSize(text, &data, &len) < 0) {
+		Py_DECREF(text);
+		return NULL;
+	}
+	ret = split_message(data, len);
+	Py_DECREF(text);
+	return ret;
+}
+
+#define MAX_FAST_DIGITS 18
+
+/* Parse a run of decimal digits, or return -1 if it is not one. */
+static long long parse_digits(const char *text, Py_ssize_t len)
+{
+	long long ret = 0;
+	Py_ssize_t i;
+
+	if (len == 0 || len > MAX_FAST_DIGITS)
+		return -1;
+	for (i = 0; i < len; i++) {
+		if (text[i] < '0' || text[i] > '9')
+			return -1;
+		ret = ret * 10 + (text[i] - '0');
+	}
+	return ret;
+}
+
+/* Convert to the same integer type int() would give for the value. */
+static PyObject *py_from_long_long(long long value)
+{
+	if (value >= LONG_MIN && value <= LONG_MAX)
+		return PyInt_FromLong((long)value);
+	return PyLong_FromLongLong(value);
+}
+
+/* Like dulwich.objects.parse_timezone. */
+static PyObject *parse_timezone(const char *text, Py_ssize_t len)
+{
+	long long offset;
+	int negative_sign, negative_offset = 0, unnecessary_negative_timezone;
+	PyObject *py_text, *py_offset, *ret;
+
+	if (len >= 2 && (text[0] == '+' || text[0] == '-')) {
+		negative_sign = (text[0] == '-');
+		if (text[1] == '-') {
+			negative_offset = 1;
+			offset = parse_digits(text + 2, len - 2);
+		} else {
+			offset = parse_digits(text + 1, len - 1);
+		}
+		if (offset >= 0) {
+			/* The offset after the sign may itself be negative; a
+			 * negative sign then makes it positive again. */
+			if (negative_offset == negative_sign || offset == 0) {
+				unnecessary_negative_timezone = negative_sign;
+			} else {
+				unnecessary_negative_timezone = 0;
+				offset = -offset;
+			}
+			offset = (offset / 100) * 3600 + (offset % 100) * 60;
+			py_offset = py_from_long_long(offset);
+			if (py_offset == NULL)
+				return NULL;
+			return Py_BuildValue("(NN)", py_offset,
+			                     PyBool_FromLong(unnecessary_negative_timezone));
+		}
+	}
+
+	/* Leave anything unusual, including errors, to the Python version. */
+	py_text = PyString_FromStringAndSize(text, len);
+	if (py_text == NULL)
+		return NULL;
+	ret = PyObject_CallFunctionObjArgs(parse_timezone_func, py_text, NULL);
+	Py_DECREF(py_text);
+	return ret;
+}
+
+/*
+ * Parse an author or committer value into a tuple of
+ * (identity, time, (timezone, unnecessary_negative_timezone)).
+ */
+static PyObject *parse_identity_time(PyObject *value)
+{
+	char *text, *time_start, *tz_start;
+	Py_ssize_t len;
+	long long time;
+	PyObject *identity, *py_time, *timezone, *py_time_text;
+
+	if (PyString_AsStringAndSize(value, &text, &len) < 0)
+		return NULL;
+	/* Like value.rsplit(b' ', 2) */
+	for (tz_start = text + len; tz_start > text && tz_start[-1] != ' ';
+	     tz_start--);
+	if (tz_start == text) {
+		PyErr_SetString(PyExc_ValueError, "Missing time in header");
+		return NULL;
+	}
+	for (time_start = tz_start - 1; time_start > text && time_start[-1] != ' ';
+	     time_start--);
+	if (time_start == text) {
+		PyErr_SetString(PyExc_ValueError, "Missing time in header");
+		return NULL;
+	}
+
+	time = parse_digits(time_start, tz_start - 1 - time_start);
+	if (time >= 0) {
+		py_time = py_from_long_long(time);
+	} else {
+		py_time_text = PyString_FromStringAndSize(
+			time_start, tz_start - 1 - time_start);
+		if (py_time_text == NULL)
+			return NULL;
+		py_time = PyNumber_Int(py_time_text);
+		Py_DECREF(py_time_text);
+	}
+	if (py_time == NULL)
+		return NULL;
+	timezone = parse_timezone(tz_start, text + len - tz_start);
+	if (timezone == NULL) {
+		Py_DECREF(py_time);
+		return NULL;
+	}
+	identity = PyString_FromStringAndSize(text, time_start - 1 - text);
+	if (identity == NULL) {
+		Py_DECREF(py_time);
+		Py_DECREF(timezone);
+		return NULL;
+	}
+	return Py_BuildValue("(NNN)", identity, py_time, timezone);
+}
+
+static int field_is(PyObject *field, const char *name)
+{
+	Py_ssize_t len = strlen(name);
+	return (PyString_GET_SIZE(field) == len &&
+	        memcmp(PyString_AS_STRING(field), name, len) == 0);
+}
+
+static PyObject *py_parse_commit(PyObject *self, PyObject *args)
+{
+	PyObject *chunks, *text, *fields = NULL, *parents = NULL, *extra = NULL;
+	PyObject *mergetag = NULL, *tree = Py_None, *encoding = Py_None;
+	PyObject *gpgsig = Py_None, *message = Py_None;
+	PyObject *author_info = NULL, *commit_info = NULL;
+	PyObject *field, *value, *item, *ret = NULL;
+	char *data;
+	Py_ssize_t len, i;
+
+	if (!PyArg_ParseTuple(args, "O", &chunks))
+		return NULL;
+	text = join_chunks(chunks);
+	if (text == NULL)
+		return NULL;
+	if (PyString_AsStringAndSize(text, &data, &len) < 0) {
+		Py_DECREF(text);
+		return NULL;
+	}
+	fields = split_message(data, len);
+	Py_DECREF(text);
+	if (fields == NULL)
+		return NULL;
+
+	parents = PyList_New(0);
+	extra = PyList_New(0);
+	mergetag = PyList_New(0);
+	if (parents == NULL || extra == NULL || mergetag == NULL)
+		goto done;
+
+	for (i = 0; i < PyList_GET_SIZE(fields); i++) {
+		field = PyTuple_GET_ITEM(PyList_GET_ITEM(fields, i), 0);
+		value = PyTuple_GET_ITEM(PyList_GET_ITEM(fields, i), 1);
+		if (field == Py_None) {
+			message = value;
+		} else if (field_is(field, "tree")) {
+			tree = value;
+		} else if (field_is(field, "parent")) {
+			if (PyList_Append(parents, value) < 0)
+				goto done;
+		} else if (field_is(field, "author")) {
+			Py_XDECREF(author_info);
+			author_info = parse_identity_time(value);
+			if (author_info == NULL)
+				goto done;
+		} else if (field_is(field, "committer")) {
+			Py_XDECREF(commit_info);
+			commit_info = parse_identity_time(value);
+			if (commit_info == NULL)
+				goto done;
+		} else if (field_is(field, "encoding")) {
+			encoding = value;
+		} else if (field_is(field, "mergetag")) {
+			PyObject *tag_text = PyString_FromStringAndSize(
+				NULL, PyString_GET_SIZE(value) + 1);
+			if (tag_text == NULL)
+				goto done;
+			memcpy(PyString_AS_STRING(tag_text),
+			       PyString_AS_STRING(value), PyString_GET_SIZE(value));
+			PyString_AS_STRING(tag_text)[PyString_GET_SIZE(value)] = '\n';
+			item = PyObject_CallMethod(tag_cls, "from_string", "O",
+			                           tag_text);
+			Py_DECREF(tag_text);
+			if (item == NULL)
+				goto done;
+			if (PyList_Append(mergetag, item) < 0) {
+				Py_DECREF(item);
+				goto done;
+			}
+			Py_DECREF(item);
+		} else if (field_is(field, "gpgsig")) {
+			gpgsig = value;
+		} else {
+			if (PyList_Append(extra, PyList_GET_ITEM(fields, i)) < 0)
+				goto done;
+		}
+	}
+
+	if (author_info == NULL)
+		author_info = Py_BuildValue("(OO(OO))", Py_None, Py_None,
+		                            Py_None, Py_None);
+	if (commit_info == NULL)
+		commit_info = Py_BuildValue("(OO(OO))", Py_None, Py_None,
+		                            Py_None, Py_None);
+	if (author_info == NULL || commit_info == NULL)
+		goto done;
+
+	ret = Py_BuildValue("(OOOOOOOOO)", tree, parents, author_info,
+	                    commit_info, encoding, mergetag, gpgsig, message,
+	                    extra);
+
+done:
+	Py_XDECREF(author_info);
+	Py_XDECREF(commit_info);
+	Py_XDECREF(parents);
+	Py_XDECREF(extra);
+	Py_XDECREF(mergetag);
+	Py_DECREF(fields);
+	return ret;
+}
+
 static PyMethodDef py_objects_methods[] = {
 	{ "parse_tree", (PyCFunction)py_parse_tree, METH_VARARGS | METH_KEYWORDS,
 	  NULL },
 	{ "sorted_tree_items", py_sorted_tree_items, METH_VARARGS, NULL },
+	{ "_tree_entry_offsets", py_tree_entry_offsets, METH_VARARGS, NULL },
+	{ "_tree_lookup", py_tree_lookup, METH_VARARGS, NULL },
+	{ "_tree_name_order", py_tree_name_order, METH_VARARGS, NULL },
+	{ "_tree_entry", py_tree_entry, METH_VARARGS, NULL },
+	{ "parse_commit", py_parse_commit, METH_VARARGS, NULL },
+	{ "_parse_message", py_parse_message, METH_VARARGS, NULL },
 	{ NULL, NULL, 0, NULL }
 };
 
@@ -307,8 +1053,12 @@ moduleinit(void)
 	}
 
 	tree_entry_cls = PyObject_GetAttrString(objects_mod, "TreeEntry");
+	tag_cls = PyObject_GetAttrString(objects_mod, "Tag");
+	parse_timezone_func = PyObject_GetAttrString(objects_mod,
+	                                             "parse_timezone");
 	Py_DECREF(objects_mod);
-	if (tree_entry_cls == NULL) {
+	if (tree_entry_cls == NULL || tag_cls == NULL ||
+	    parse_timezone_func == NULL) {
 		return NULL;
 	}
 
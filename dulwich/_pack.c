@@ -17,8 +17,11 @@
  * MA  02110-1301, USA.
  */
 
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <structmember.h>
 #include <stdint.h>
+#include <zlib.h>
 
 #if PY_MAJOR_VERSION >= 3
 #define PyInt_FromLong PyLong_FromLong
@@ -31,9 +34,31 @@
 #define PyString_GET_SIZE PyBytes_GET_SIZE
 #define PyString_Size PyBytes_Size
 #define _PyString_Join _PyBytes_Join
+#define _PyString_Resize _PyBytes_Resize
 #endif
 
 static PyObject *PyExc_ApplyDeltaError = NULL;
+static PyObject *PyExc_ZlibError = NULL;
+static PyObject *unpacked_object_cls = NULL;
+
+#define OFS_DELTA 6
+#define REF_DELTA 7
+#define ZLIB_BUFSIZE 4096
+/* Most bytes allocated for inflated data before any of it is produced, so
+ * that a corrupt object header cannot make read_zlib_chunks allocate
+ * much more than the stream inflates to. */
+#define ZLIB_OUT_INITIAL_MAX (1 << 20)
+
+/* Create an integer object of the type the Python implementation would
+ * give: a plain int rather than a long for small values on Python 2. */
+static PyObject *py_from_unsigned(unsigned PY_LONG_LONG value)
+{
+#if PY_MAJOR_VERSION < 3
+	if (value <= LONG_MAX)
+		return PyInt_FromLong((long)value);
+#endif
+	return PyLong_FromUnsignedLongLong(value);
+}
 
 static int py_is_sha(PyObject *sha)
 {
@@ -204,7 +229,7 @@ static PyObject *py_bisect_find_sha(PyObject *self, PyObject *args)
 {
 	PyObject *unpack_name;
 	char *sha;
-	int sha_len;
+	Py_ssize_t sha_len;
 	int start, end;
 #if PY_MAJOR_VERSION >= 3
 	if (!PyArg_ParseTuple(args, "iiy#O", &start, &end,
@@ -251,9 +276,778 @@ static PyObject *py_bisect_find_sha(PyObject *self, PyObject *args)
 }
 
 
+/*
+ * Call read(size) and check that it returned a byte string.
+ */
+static PyObject *call_read(PyObject *read, Py_ssize_t size)
+{
+	PyObject *data = PyObject_CallFunction(read, "n", size);
+	if (data == NULL)
+		return NULL;
+	if (!PyString_Check(data)) {
+		PyErr_SetString(PyExc_TypeError, "read did not return bytes");
+		Py_DECREF(data);
+		return NULL;
+	}
+	return data;
+}
+
+/*
+ * Inflate a zlib stream read through read_some into unpacked.
+ *
+ * This mirrors the pure-Python read_zlib_chunks in dulwich.pack, but since
+ * the decompressed length is known up front the output is inflated into a
+ * single chunk. It is allocated for that length, up to
+ * ZLIB_OUT_INITIAL_MAX bytes, and doubled as it fills.
+ *
+ * Returns the leftover unused data, or NULL on error.
+ */
+static PyObject *read_zlib_chunks(PyObject *read_some, PyObject *unpacked,
+				  int include_comp, Py_ssize_t buffer_size)
+{
+	PyObject *py_decomp_len, *py_crc32, *decomp_chunks = NULL;
+	PyObject *comp_chunks = NULL, *out = NULL, *unused = NULL;
+	PyObject *add = NULL, *chunk;
+	Py_ssize_t decomp_len, add_len, used, out_size, out_len = 0;
+	Py_ssize_t in_left, avail_in, avail_out;
+	Bytef *in;
+	unsigned long crc = 0;
+	int compute_crc32, ret = Z_OK, finished = 0;
+	z_stream strm;
+
+	py_decomp_len = PyObject_GetAttrString(unpacked, "decomp_len");
+	if (py_decomp_len == NULL)
+		return NULL;
+	decomp_len = PyNumber_AsSsize_t(py_decomp_len, PyExc_OverflowError);
+	Py_DECREF(py_decomp_len);
+	if (decomp_len == -1 && PyErr_Occurred())
+		return NULL;
+	if (decomp_len <= -1) {
+		PyErr_SetString(PyExc_ValueError,
+				"non-negative zlib data stream size expected");
+		return NULL;
+	}
+
+	py_crc32 = PyObject_GetAttrString(unpacked, "crc32");
+	if (py_crc32 == NULL)
+		return NULL;
+	compute_crc32 = (py_crc32 != Py_None);
+	if (compute_crc32) {
+		crc = PyLong_AsUnsignedLongMask(py_crc32);
+		if (PyErr_Occurred()) {
+			Py_DECREF(py_crc32);
+			return NULL;
+		}
+	}
+	Py_DECREF(py_crc32);
+
+	decomp_chunks = PyObject_GetAttrString(unpacked, "decomp_chunks");
+	if (decomp_chunks == NULL)
+		return NULL;
+	if (!PyList_Check(decomp_chunks)) {
+		PyErr_SetString(PyExc_TypeError, "decomp_chunks is not a list");
+		goto error;
+	}
+
+	if (include_comp) {
+		comp_chunks = PyList_New(0);
+		if (comp_chunks == NULL)
+			goto error;
+	}
+
+	/* One spare byte so that overlong streams can be detected. */
+	if (decomp_len < ZLIB_OUT_INITIAL_MAX)
+		out_size = decomp_len + 1;
+	else
+		out_size = ZLIB_OUT_INITIAL_MAX;
+	out = PyString_FromStringAndSize(NULL, out_size);
+	if (out == NULL)
+		goto error;
+
+	memset(&strm, 0, sizeof(strm));
+	if (inflateInit(&strm) != Z_OK) {
+		PyErr_SetString(PyExc_ZlibError, "failed to initialize zlib");
+		goto error;
+	}
+
+	while (1) {
+		add = call_read(read_some, buffer_size);
+		if (add == NULL)
+			goto error_inflate;
+		add_len = PyString_GET_SIZE(add);
+		if (add_len == 0) {
+			PyErr_SetString(PyExc_ZlibError,
+					"EOF before end of zlib stream");
+			goto error_inflate;
+		}
+		if (finished) {
+			/* The stream ended exactly at the end of the previous
+			 * read; everything read now is leftover data. */
+			if (include_comp) {
+				chunk = PyString_FromStringAndSize(NULL, 0);
+				if (chunk == NULL || PyList_Append(comp_chunks, chunk) == -1) {
+					Py_XDECREF(chunk);
+					goto error_inflate;
+				}
+				Py_DECREF(chunk);
+			}
+			unused = add;
+			add = NULL;
+			break;
+		}
+		in = (Bytef *)PyString_AS_STRING(add);
+		in_left = add_len;
+		/* zlib takes at most UINT_MAX bytes of input and output per
+		 * call, so both are fed to it in pieces. */
+		do {
+			if (out_len == out_size) {
+				if (decomp_len - out_size < out_size)
+					out_size = decomp_len + 1;
+				else
+					out_size *= 2;
+				if (_PyString_Resize(&out, out_size) == -1)
+					goto error_inflate;
+			}
+			avail_in = in_left < UINT_MAX ? in_left : UINT_MAX;
+			avail_out = out_size - out_len;
+			if (avail_out > UINT_MAX)
+				avail_out = UINT_MAX;
+			strm.next_in = in;
+			strm.avail_in = (uInt)avail_in;
+			strm.next_out = (Bytef *)PyString_AS_STRING(out) + out_len;
+			strm.avail_out = (uInt)avail_out;
+			ret = inflate(&strm, Z_SYNC_FLUSH);
+			if (ret != Z_OK && ret != Z_STREAM_END &&
+			    !(ret == Z_BUF_ERROR && strm.avail_out > 0)) {
+				PyErr_Format(PyExc_ZlibError,
+					     "Error %d while decompressing data: %s",
+					     ret, strm.msg ? strm.msg : "");
+				goto error_inflate;
+			}
+			used = avail_in - strm.avail_in;
+			if (compute_crc32)
+				crc = crc32(crc, in, (uInt)used);
+			in += used;
+			in_left -= used;
+			out_len += avail_out - strm.avail_out;
+			if (out_len > decomp_len) {
+				PyErr_SetString(PyExc_ZlibError,
+						"decompressed data does not match expected size");
+				goto error_inflate;
+			}
+			/* With no room left, zlib may still hold output for
+			 * the input it has taken. */
+		} while (ret != Z_STREAM_END &&
+			 (in_left > 0 || strm.avail_out == 0));
+		used = add_len - in_left;
+		if (include_comp) {
+			if (used == add_len) {
+				chunk = add;
+				Py_INCREF(chunk);
+			} else {
+				chunk = PyString_FromStringAndSize(
+					PyString_AS_STRING(add), used);
+				if (chunk == NULL)
+					goto error_inflate;
+			}
+			if (PyList_Append(comp_chunks, chunk) == -1) {
+				Py_DECREF(chunk);
+				goto error_inflate;
+			}
+			Py_DECREF(chunk);
+		}
+		if (ret == Z_STREAM_END) {
+			if (in_left == 0) {
+				finished = 1;
+				Py_CLEAR(add);
+				continue;
+			}
+			unused = PyString_FromStringAndSize(
+				(char *)in, in_left);
+			if (unused == NULL)
+				goto error_inflate;
+			Py_CLEAR(add);
+			break;
+		}
+		Py_CLEAR(add);
+	}
+	inflateEnd(&strm);
+
+	if (out_len != decomp_len) {
+		PyErr_SetString(PyExc_ZlibError,
+				"decompressed data does not match expected size");
+		goto error;
+	}
+	if (_PyString_Resize(&out, decomp_len) == -1)
+		goto error;
+	if (PyList_Append(decomp_chunks, out) == -1)
+		goto error;
+	Py_CLEAR(out);
+	Py_CLEAR(decomp_chunks);
+
+	if (compute_crc32) {
+		py_crc32 = py_from_unsigned(crc & 0xffffffff);
+		if (py_crc32 == NULL)
+			goto error;
+		ret = PyObject_SetAttrString(unpacked, "crc32", py_crc32);
+		Py_DECREF(py_crc32);
+		if (ret == -1)
+			goto error;
+	}
+	if (include_comp) {
+		ret = PyObject_SetAttrString(unpacked, "comp_chunks", comp_chunks);
+		Py_CLEAR(comp_chunks);
+		if (ret == -1)
+			goto error;
+	}
+	return unused;
+
+error_inflate:
+	inflateEnd(&strm);
+error:
+	Py_XDECREF(add);
+	Py_XDECREF(out);
+	Py_XDECREF(unused);
+	Py_XDECREF(comp_chunks);
+	Py_XDECREF(decomp_chunks);
+	return NULL;
+}
+
+static PyObject *py_read_zlib_chunks(PyObject *self, PyObject *args,
+				     PyObject *kwargs)
+{
+	PyObject *read_some, *unpacked, *py_include_comp = NULL;
+	Py_ssize_t buffer_size = ZLIB_BUFSIZE;
+	int include_comp;
+	static char *kwlist[] = {"read_some", "unpacked", "include_comp",
+				 "buffer_size", NULL};
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO|On", kwlist,
+					 &read_some, &unpacked,
+					 &py_include_comp, &buffer_size))
+		return NULL;
+
+	include_comp = py_include_comp ? PyObject_IsTrue(py_include_comp) : 0;
+	if (include_comp == -1)
+		return NULL;
+
+	return read_zlib_chunks(read_some, unpacked, include_comp, buffer_size);
+}
+
+/*
+ * Read a variable-length size or offset one byte at a time, the way
+ * take_msb_bytes in dulwich.pack does. Returns the number of bytes read
+ * into buf, or -1 on error.
+ */
+static int take_msb_bytes(PyObject *read, uint8_t *buf, int maxlen,
+			  int compute_crc32, unsigned long *crc)
+{
+	int n = 0;
+	PyObject *b;
+	do {
+		if (n == maxlen) {
+			PyErr_SetString(PyExc_ValueError,
+					"variable-length integer too long");
+			return -1;
+		}
+		b = call_read(read, 1);
+		if (b == NULL)
+			return -1;
+		if (PyString_GET_SIZE(b) != 1) {
+			PyErr_SetString(PyExc_ZlibError,
+					"EOF while reading object header");
+			Py_DECREF(b);
+			return -1;
+		}
+		buf[n] = (uint8_t)PyString_AS_STRING(b)[0];
+		Py_DECREF(b);
+		if (compute_crc32)
+			*crc = crc32(*crc, buf + n, 1);
+	} while (buf[n++] & 0x80);
+	return n;
+}
+
+static PyObject *py_unpack_object(PyObject *self, PyObject *args,
+				  PyObject *kwargs)
+{
+	PyObject *read_all, *read_some = Py_None;
+	PyObject *py_compute_crc32 = NULL, *py_include_comp = NULL;
+	PyObject *delta_base = NULL, *unpacked = NULL, *unused, *py_crc32;
+	Py_ssize_t zlib_bufsize = ZLIB_BUFSIZE;
+	int compute_crc32, include_comp, n, i, type_num;
+	unsigned long crc = 0;
+	uint64_t size, delta_base_offset;
+	uint8_t buf[10];
+	static char *kwlist[] = {"read_all", "read_some", "compute_crc32",
+				 "include_comp", "zlib_bufsize", NULL};
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|OOOn", kwlist,
+					 &read_all, &read_some,
+					 &py_compute_crc32, &py_include_comp,
+					 &zlib_bufsize))
+		return NULL;
+
+	if (read_some == Py_None)
+		read_some = read_all;
+	compute_crc32 = py_compute_crc32 ? PyObject_IsTrue(py_compute_crc32) : 0;
+	if (compute_crc32 == -1)
+		return NULL;
+	include_comp = py_include_comp ? PyObject_IsTrue(py_include_comp) : 0;
+	if (include_comp == -1)
+		return NULL;
+
+	n = take_msb_bytes(read_all, buf, sizeof(buf), compute_crc32, &crc);
+	if (n == -1)
+		return NULL;
+	type_num = (buf[0] >> 4) & 0x07;
+	size = buf[0] & 0x0f;
+	for (i = 1; i < n; i++)
+		size += (uint64_t)(buf[i] & 0x7f) << ((i - 1) * 7 + 4);
+
+	if (type_num == OFS_DELTA) {
+		n = take_msb_bytes(read_all, buf, sizeof(buf), compute_crc32,
+				   &crc);
+		if (n == -1)
+			return NULL;
+		delta_base_offset = buf[0] & 0x7f;
+		for (i = 1; i < n; i++) {
+			delta_base_offset += 1;
+			delta_base_offset <<= 7;
+			delta_base_offset += buf[i] & 0x7f;
+		}
+		delta_base = py_from_unsigned(delta_base_offset);
+		if (delta_base == NULL)
+			return NULL;
+	} else if (type_num == REF_DELTA) {
+		delta_base = call_read(read_all, 20);
+		if (delta_base == NULL)
+			return NULL;
+		if (compute_crc32)
+			crc = crc32(crc,
+				(Bytef *)PyString_AS_STRING(delta_base),
+				PyString_GET_SIZE(delta_base));
+	} else {
+		delta_base = Py_None;
+		Py_INCREF(delta_base);
+	}
+
+	if (compute_crc32) {
+		py_crc32 = py_from_unsigned(crc & 0xffffffff);
+	} else {
+		py_crc32 = Py_None;
+		Py_INCREF(py_crc32);
+	}
+	if (py_crc32 == NULL) {
+		Py_DECREF(delta_base);
+		return NULL;
+	}
+
+	unpacked = PyObject_CallFunction(unpacked_object_cls, "iOKO", type_num,
+					 delta_base, (unsigned long long)size,
+					 py_crc32);
+	Py_DECREF(delta_base);
+	Py_DECREF(py_crc32);
+	if (unpacked == NULL)
+		return NULL;
+
+	unused = read_zlib_chunks(read_some, unpacked, include_comp,
+				  zlib_bufsize);
+	if (unused == NULL) {
+		Py_DECREF(unpacked);
+		return NULL;
+	}
+
+	return Py_BuildValue("(NN)", unpacked, unused);
+}
+
+/*
+ * Delta index: the source of a delta, split up into DELTA_BLOCK_SIZE byte
+ * blocks that are looked up by a rolling hash of the target.
+ *
+ * This mirrors the pure-Python DeltaIndex in dulwich.pack: for each distinct
+ * block content, the first DELTA_BLOCK_LIMIT blocks with that content are
+ * kept, in source order. The hash buckets list the first block of each
+ * distinct content (through next_content); the other blocks with the same
+ * content are chained from there (through next_same).
+ */
+
+#define DELTA_BLOCK_SIZE 16
+#define DELTA_BLOCK_LIMIT 64
+#define DELTA_HASH_MULT 0x01000193U
+#define MAX_COPY_LEN 0xffff
+
+typedef struct {
+	PyObject_HEAD
+	PyObject *base;
+	Py_ssize_t num_blocks;
+	uint32_t hash_mask;
+	Py_ssize_t *buckets;
+	Py_ssize_t *next_content;
+	Py_ssize_t *next_same;
+	uint32_t *hashes;
+} DeltaIndexObject;
+
+static uint32_t delta_hash_mult_top;
+
+static uint32_t delta_hash(const uint8_t *data)
+{
+	uint32_t h = 0;
+	int i;
+	for (i = 0; i < DELTA_BLOCK_SIZE; i++)
+		h = h * DELTA_HASH_MULT + data[i];
+	return h;
+}
+
+static void delta_index_dealloc(DeltaIndexObject *self)
+{
+	Py_XDECREF(self->base);
+	PyMem_Free(self->buckets);
+	PyMem_Free(self->next_content);
+	PyMem_Free(self->next_same);
+	PyMem_Free(self->hashes);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *delta_index_new(PyTypeObject *type, PyObject *args,
+				 PyObject *kwargs)
+{
+	DeltaIndexObject *self;
+	PyObject *base;
+	const uint8_t *data;
+	Py_ssize_t i, size;
+	uint32_t hash_size = 1;
+	Py_ssize_t *last;
+	uint8_t *count;
+	static char *kwlist[] = {"base_buf", NULL};
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "S", kwlist, &base))
+		return NULL;
+
+	self = (DeltaIndexObject *)type->tp_alloc(type, 0);
+	if (self == NULL)
+		return NULL;
+	Py_INCREF(base);
+	self->base = base;
+
+	size = PyString_GET_SIZE(base);
+	data = (const uint8_t *)PyString_AS_STRING(base);
+	self->num_blocks = size / DELTA_BLOCK_SIZE;
+	while (hash_size < self->num_blocks && hash_size < (1U << 31))
+		hash_size <<= 1;
+	self->hash_mask = hash_size - 1;
+	self->buckets = PyMem_New(Py_ssize_t, hash_size);
+	self->next_content = PyMem_New(Py_ssize_t, self->num_blocks + 1);
+	self->next_same = PyMem_New(Py_ssize_t, self->num_blocks + 1);
+	self->hashes = PyMem_New(uint32_t, self->num_blocks + 1);
+	/* For the first block of each content: the last block kept with that
+	 * content, and the number of blocks kept. */
+	last = PyMem_New(Py_ssize_t, self->num_blocks + 1);
+	count = PyMem_Malloc(self->num_blocks + 1);
+	if (self->buckets == NULL || self->next_content == NULL ||
+	    self->next_same == NULL || self->hashes == NULL ||
+	    last == NULL || count == NULL) {
+		PyMem_Free(last);
+		PyMem_Free(count);
+		Py_DECREF(self);
+		return PyErr_NoMemory();
+	}
+	for (i = 0; i < hash_size; i++)
+		self->buckets[i] = -1;
+	for (i = 0; i < self->num_blocks; i++) {
+		const uint8_t *block = data + i * DELTA_BLOCK_SIZE;
+		uint32_t h = delta_hash(block);
+		Py_ssize_t *link = &self->buckets[h & self->hash_mask];
+		Py_ssize_t first;
+		self->hashes[i] = h;
+		self->next_same[i] = -1;
+		for (first = *link; first != -1;
+		     first = self->next_content[first]) {
+			if (self->hashes[first] == h &&
+			    !memcmp(data + first * DELTA_BLOCK_SIZE, block,
+				    DELTA_BLOCK_SIZE))
+				break;
+			link = &self->next_content[first];
+		}
+		if (first == -1) {
+			/* The first block with this content. */
+			self->next_content[i] = -1;
+			*link = i;
+			last[i] = i;
+			count[i] = 1;
+		} else if (count[first] < DELTA_BLOCK_LIMIT) {
+			self->next_same[last[first]] = i;
+			last[first] = i;
+			count[first]++;
+		}
+	}
+	PyMem_Free(last);
+	PyMem_Free(count);
+
+	return (PyObject *)self;
+}
+
+static Py_ssize_t delta_index_len(DeltaIndexObject *self)
+{
+	return PyString_GET_SIZE(self->base);
+}
+
+struct delta_buf {
+	uint8_t *data;
+	Py_ssize_t len, alloc;
+};
+
+static int delta_buf_reserve(struct delta_buf *buf, Py_ssize_t extra)
+{
+	uint8_t *data;
+	Py_ssize_t alloc = buf->alloc;
+	if (buf->len + extra <= alloc)
+		return 0;
+	while (alloc < buf->len + extra)
+		alloc = alloc * 2 + 64;
+	data = PyMem_Realloc(buf->data, alloc);
+	if (data == NULL) {
+		PyErr_NoMemory();
+		return -1;
+	}
+	buf->data = data;
+	buf->alloc = alloc;
+	return 0;
+}
+
+static int delta_encode_size(struct delta_buf *buf, Py_ssize_t size)
+{
+	if (delta_buf_reserve(buf, 10) < 0)
+		return -1;
+	while (size >= 0x80) {
+		buf->data[buf->len++] = (size & 0x7f) | 0x80;
+		size >>= 7;
+	}
+	buf->data[buf->len++] = size;
+	return 0;
+}
+
+static int delta_encode_insert(struct delta_buf *buf, const uint8_t *data,
+			       Py_ssize_t len)
+{
+	if (delta_buf_reserve(buf, len + len / 127 + 1) < 0)
+		return -1;
+	while (len > 0) {
+		Py_ssize_t n = len > 127 ? 127 : len;
+		buf->data[buf->len++] = n;
+		memcpy(buf->data + buf->len, data, n);
+		buf->len += n;
+		data += n;
+		len -= n;
+	}
+	return 0;
+}
+
+static int delta_encode_copy(struct delta_buf *buf, Py_ssize_t start,
+			     Py_ssize_t len)
+{
+	while (len > 0) {
+		Py_ssize_t n = len > MAX_COPY_LEN ? MAX_COPY_LEN : len;
+		Py_ssize_t op_index;
+		uint8_t op = 0x80;
+		int i;
+		if (delta_buf_reserve(buf, 7) < 0)
+			return -1;
+		op_index = buf->len++;
+		for (i = 0; i < 4; i++) {
+			if ((start >> (i * 8)) & 0xff) {
+				buf->data[buf->len++] = (start >> (i * 8)) & 0xff;
+				op |= 1 << i;
+			}
+		}
+		for (i = 0; i < 2; i++) {
+			if ((n >> (i * 8)) & 0xff) {
+				buf->data[buf->len++] = (n >> (i * 8)) & 0xff;
+				op |= 1 << (4 + i);
+			}
+		}
+		buf->data[op_index] = op;
+		start += n;
+		len -= n;
+	}
+	return 0;
+}
+
+static PyObject *delta_index_create_delta(DeltaIndexObject *self,
+					  PyObject *args)
+{
+	PyObject *target, *ret;
+	const uint8_t *src, *trg;
+	Py_ssize_t src_size, trg_size, i = 0, insert_start = 0;
+	struct delta_buf buf = { NULL, 0, 0 };
+	uint32_t h = 0;
+
+	if (!PyArg_ParseTuple(args, "S", &target))
+		return NULL;
+
+	src = (const uint8_t *)PyString_AS_STRING(self->base);
+	src_size = PyString_GET_SIZE(self->base);
+	trg = (const uint8_t *)PyString_AS_STRING(target);
+	trg_size = PyString_GET_SIZE(target);
+
+	if (delta_encode_size(&buf, src_size) < 0 ||
+	    delta_encode_size(&buf, trg_size) < 0)
+		goto error;
+
+	if (trg_size >= DELTA_BLOCK_SIZE && self->num_blocks > 0)
+		h = delta_hash(trg);
+	while (self->num_blocks > 0 && i + DELTA_BLOCK_SIZE <= trg_size) {
+		Py_ssize_t block, best_offset = 0, best_len = 0;
+		for (block = self->buckets[h & self->hash_mask]; block != -1;
+		     block = self->next_content[block]) {
+			if (self->hashes[block] == h &&
+			    !memcmp(src + block * DELTA_BLOCK_SIZE, trg + i,
+				    DELTA_BLOCK_SIZE))
+				break;
+		}
+		for (; block != -1; block = self->next_same[block]) {
+			Py_ssize_t offset = block * DELTA_BLOCK_SIZE, len;
+			len = DELTA_BLOCK_SIZE;
+			while (offset + len < src_size && i + len < trg_size &&
+			       src[offset + len] == trg[i + len])
+				len++;
+			if (len > best_len) {
+				best_offset = offset;
+				best_len = len;
+			}
+		}
+		if (best_len == 0) {
+			if (i + DELTA_BLOCK_SIZE < trg_size)
+				h = (h - trg[i] * delta_hash_mult_top) *
+					DELTA_HASH_MULT + trg[i + DELTA_BLOCK_SIZE];
+			i++;
+			continue;
+		}
+		/* Take any preceding data that also matches from the source,
+		 * rather than inserting it. */
+		while (i > insert_start && best_offset > 0 &&
+		       src[best_offset - 1] == trg[i - 1]) {
+			i--;
+			best_offset--;
+			best_len++;
+		}
+		if (delta_encode_insert(&buf, trg + insert_start,
+					i - insert_start) < 0 ||
+		    delta_encode_copy(&buf, best_offset, best_len) < 0)
+			goto error;
+		i += best_len;
+		insert_start = i;
+		if (i + DELTA_BLOCK_SIZE <= trg_size)
+			h = delta_hash(trg + i);
+	}
+	if (delta_encode_insert(&buf, trg + insert_start,
+				trg_size - insert_start) < 0)
+		goto error;
+
+	ret = PyString_FromStringAndSize((char *)buf.data, buf.len);
+	PyMem_Free(buf.data);
+	return ret;
+
+error:
+	PyMem_Free(buf.data);
+	return NULL;
+}
+
+static PyMethodDef delta_index_methods[] = {
+	{ "create_delta", (PyCFunction)delta_index_create_delta, METH_VARARGS,
+	  "Create a delta that transforms the source into target_buf." },
+	{ NULL, NULL, 0, NULL }
+};
+
+static PyMemberDef delta_index_members[] = {
+	{ "base", T_OBJECT, offsetof(DeltaIndexObject, base), READONLY,
+	  "Source buffer" },
+	{ NULL }
+};
+
+static PySequenceMethods delta_index_as_sequence = {
+	(lenfunc)delta_index_len, /* sq_length */
+};
+
+static PyTypeObject DeltaIndexType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"dulwich._pack.DeltaIndex",       /* tp_name */
+	sizeof(DeltaIndexObject),         /* tp_basicsize */
+	0,                                /* tp_itemsize */
+	(destructor)delta_index_dealloc,  /* tp_dealloc */
+};
+
+static int cmp_name_ptr(const void *a, const void *b)
+{
+	return memcmp(*(const unsigned char * const *)a,
+	              *(const unsigned char * const *)b, 20);
+}
+
+static PyObject *py_sort_names(PyObject *self, PyObject *args)
+{
+	Py_buffer names;
+	const unsigned char *base, **sorted;
+	unsigned int *order;
+	char *out;
+	Py_ssize_t n, i;
+	PyObject *py_names, *py_order;
+
+#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "y*", &names))
+#else
+	if (!PyArg_ParseTuple(args, "s*", &names))
+#endif
+		return NULL;
+
+	if (names.len % 20 != 0) {
+		PyBuffer_Release(&names);
+		PyErr_SetString(PyExc_ValueError,
+		                "Names are not a multiple of 20 bytes long");
+		return NULL;
+	}
+	n = names.len / 20;
+	if ((size_t)n > UINT_MAX) {
+		PyBuffer_Release(&names);
+		PyErr_SetString(PyExc_OverflowError, "Too many names");
+		return NULL;
+	}
+	base = names.buf;
+	sorted = PyMem_New(const unsigned char *, n);
+	if (sorted == NULL) {
+		PyBuffer_Release(&names);
+		return PyErr_NoMemory();
+	}
+	for (i = 0; i < n; i++)
+		sorted[i] = base + i * 20;
+	qsort(sorted, n, sizeof(const unsigned char *), cmp_name_ptr);
+
+	py_names = PyString_FromStringAndSize(NULL, names.len);
+	py_order = PyString_FromStringAndSize(NULL, n * sizeof(unsigned int));
+	if (py_names == NULL || py_order == NULL) {
+		Py_XDECREF(py_names);
+		Py_XDECREF(py_order);
+		PyMem_Free(sorted);
+		PyBuffer_Release(&names);
+		return NULL;
+	}
+	out = PyString_AS_STRING(py_names);
+	order = (unsigned int *)PyString_AS_STRING(py_order);
+	for (i = 0; i < n; i++) {
+		memcpy(out + i * 20, sorted[i], 20);
+		order[i] = (unsigned int)((sorted[i] - base) / 20);
+	}
+	PyMem_Free(sorted);
+	PyBuffer_Release(&names);
+	return Py_BuildValue("(NN)", py_names, py_order);
+}
+
 static PyMethodDef py_pack_methods[] = {
 	{ "apply_delta", (PyCFunction)py_apply_delta, METH_VARARGS, NULL },
 	{ "bisect_find_sha", (PyCFunction)py_bisect_find_sha, METH_VARARGS, NULL },
+	{ "sort_names", (PyCFunction)py_sort_names, METH_VARARGS, NULL },
+	{ "read_zlib_chunks", (PyCFunction)py_read_zlib_chunks,
+	  METH_VARARGS | METH_KEYWORDS, NULL },
+	{ "unpack_object", (PyCFunction)py_unpack_object,
+	  METH_VARARGS | METH_KEYWORDS, NULL },
 	{ NULL, NULL, 0, NULL }
 };
 
@@ -261,7 +1055,8 @@ static PyObject *
 moduleinit(void)
 {
 	PyObject *m;
-	PyObject *errors_module;
+	PyObject *errors_module, *zlib_module, *pack_module;
+	int i;
 
 	errors_module = PyImport_ImportModule("dulwich.errors");
 	if (errors_module == NULL)
@@ -272,6 +1067,40 @@ moduleinit(void)
 	if (PyExc_ApplyDeltaError == NULL)
 		return NULL;
 
+	zlib_module = PyImport_ImportModule("zlib");
+	if (zlib_module == NULL)
+		return NULL;
+
+	PyExc_ZlibError = PyObject_GetAttrString(zlib_module, "error");
+	Py_DECREF(zlib_module);
+	if (PyExc_ZlibError == NULL)
+		return NULL;
+
+	/* This is a circular import but should be safe since this module is
+	 * imported at the very bottom of pack.py. */
+	pack_module = PyImport_ImportModule("dulwich.pack");
+	if (pack_module == NULL)
+		return NULL;
+
+	unpacked_object_cls = PyObject_GetAttrString(pack_module, "UnpackedObject");
+	Py_DECREF(pack_module);
+	if (unpacked_object_cls == NULL)
+		return NULL;
+
+	delta_hash_mult_top = 1;
+	for (i = 0; i < DELTA_BLOCK_SIZE - 1; i++)
+		delta_hash_mult_top *= DELTA_HASH_MULT;
+
+	DeltaIndexType.tp_flags = Py_TPFLAGS_DEFAULT;
+	DeltaIndexType.tp_doc = "Index of a delta source, for creating deltas "
+		"against it.";
+	DeltaIndexType.tp_new = delta_index_new;
+	DeltaIndexType.tp_methods = delta_index_methods;
+	DeltaIndexType.tp_members = delta_index_members;
+	DeltaIndexType.tp_as_sequence = &delta_index_as_sequence;
+	if (PyType_Ready(&DeltaIndexType) < 0)
+		return NULL;
+
 #if PY_MAJOR_VERSION >= 3
 	static struct PyModuleDef moduledef = {
 	  PyModuleDef_HEAD_INIT,
@@ -291,6 +1120,13 @@ moduleinit(void)
 	if (m == NULL)
 		return NULL;
 
+	Py_INCREF(&DeltaIndexType);
+	if (PyModule_AddObject(m, "DeltaIndex",
+			       (PyObject *)&DeltaIndexType) < 0) {
+		Py_DECREF(&DeltaIndexType);
+		return NULL;
+	}
+
 	return m;
 }
 
@@ -26,6 +26,16 @@ import stat
 import tarfile
 from io import BytesIO
 from contextlib import closing
+from itertools import islice
+
+from dulwich.objects import (
+    S_ISGITLINK,
+    ShaFile,
+    )
+
+
+# Number of blobs to retrieve from the object store at once
+_BLOB_BATCH_SIZE = 100
 
 
 class ChunkedBytesIO(object):
@@ -78,24 +88,34 @@ def tar_stream(store, tree, mtime, format=''):
     """
     buf = BytesIO()
     with closing(tarfile.open(None, "w:%s" % format, buf)) as tar:
-        for entry_abspath, entry in _walk_tree(store, tree):
-            try:
-                blob = store[entry.sha]
-            except KeyError:
-                # Entry probably refers to a submodule, which we don't yet support.
-                continue
-            data = ChunkedBytesIO(blob.chunked)
-
-            info = tarfile.TarInfo()
-            info.name = entry_abspath.decode('ascii') # tarfile only works with ascii.
-            info.size = blob.raw_length()
-            info.mode = entry.mode
-            info.mtime = mtime
-
-            tar.addfile(info, data)
-            yield buf.getvalue()
-            buf.truncate(0)
-            buf.seek(0)
+        # Submodules are not yet supported.
+        entries = ((entry_abspath, entry)
+                   for (entry_abspath, entry) in _walk_tree(store, tree)
+                   if not S_ISGITLINK(entry.mode))
+        while True:
+            batch = list(islice(entries, _BLOB_BATCH_SIZE))
+            if not batch:
+                break
+            # Let the store pick the cheapest order to retrieve the blobs in,
+            # but add them to the archive in tree order.
+            blobs = {}
+            for sha, type_num, raw in store.get_raw_many(
+                    set(entry.sha for (entry_abspath, entry) in batch)):
+                blobs[sha] = ShaFile.from_raw_string(type_num, raw, sha=sha)
+            for entry_abspath, entry in batch:
+                blob = blobs[entry.sha]
+                data = ChunkedBytesIO(blob.chunked)
+
+                info = tarfile.TarInfo()
+                info.name = entry_abspath.decode('ascii') # tarfile only works with ascii.
+                info.size = blob.raw_length()
+                info.mode = entry.mode
+                info.mtime = mtime
+
+                tar.addfile(info, data)
+                yield buf.getvalue()
+                buf.truncate(0)
+                buf.seek(0)
     yield buf.getvalue()
 
 
@@ -0,0 +1,648 @@
+# bitmap.py -- Reading and writing pack bitmap indexes
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) a later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Reading and writing pack bitmap indexes.
+
+A bitmap index (the .bitmap file next to a pack) stores, for a selection of
+commits in the pack, the set of all objects reachable from that commit, as
+a bitmap in which bit i stands for the i'th object in pack order. With it
+the objects to send for a fetch can be found with a few bitwise operations
+rather than by walking every commit and tree.
+
+Bitmaps are represented as Python integers, so they can be combined with
+the usual bitwise operators. On disk they are EWAH compressed.
+"""
+
+import binascii
+from hashlib import sha1
+import stat
+import struct
+from struct import unpack_from
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.file import GitFile
+from dulwich.objects import (
+    Commit,
+    ShaFile,
+    Tag,
+    Tree,
+    S_ISGITLINK,
+    hex_to_sha,
+    sha_to_hex,
+    )
+from dulwich.pack import (
+    SHA1Writer,
+    DeltaChainIterator,
+    _load_file_contents,
+    )
+
+
+BITMAP_SIGNATURE = b'BITM'
+BITMAP_VERSION = 1
+
+BITMAP_OPT_FULL_DAG = 0x1
+BITMAP_OPT_HASH_CACHE = 0x4
+BITMAP_OPT_LOOKUP_TABLE = 0x10
+
+# Number of commits between the commits that are given a bitmap when no
+# explicit selection is made, besides the tips of the history.
+DEFAULT_BITMAP_INTERVAL = 100
+
+_HEADER_SIZE = 32
+
+_RLW_RUNNING_BITS = 32
+_RLW_LARGEST_RUNNING_COUNT = (1 << _RLW_RUNNING_BITS) - 1
+_RLW_LARGEST_LITERAL_COUNT = (1 << 31) - 1
+_WORD_ONES = (1 << 64) - 1
+
+
+def _bytes_to_int(data):
+    """Convert little-endian bytes to an integer."""
+    if not data:
+        return 0
+    return int(binascii.hexlify(data[::-1]), 16)
+
+
+def _int_to_bytes(value, length):
+    """Convert an integer to length little-endian bytes."""
+    if not length:
+        return b''
+    value &= (1 << (length * 8)) - 1
+    return binascii.unhexlify(('%x' % value).rjust(length * 2, '0'))[::-1]
+
+
+def iter_bits(bitmap):
+    """Iterate over the positions of the bits that are set in a bitmap."""
+    data = bytearray(_int_to_bytes(bitmap, (bitmap.bit_length() + 7) // 8))
+    for i, byte in enumerate(data):
+        if not byte:
+            continue
+        for j in range(8):
+            if byte & (1 << j):
+                yield i * 8 + j
+
+
+class _BitSet(object):
+    """Mutable bitmap, for building a bitmap one bit at a time.
+
+    Single bits are set in a bytearray, while whole bitmaps are ORed into an
+    integer, so that merging a bitmap doesn't convert between the two.
+    """
+
+    __slots__ = ['_bytes', '_bitmap', '_bitmap_bytes']
+
+    def __init__(self, size):
+        self._bytes = bytearray((size + 7) // 8)
+        self._bitmap = 0
+        # Bytes of _bitmap, for membership tests; None if out of date
+        self._bitmap_bytes = None
+
+    def __contains__(self, i):
+        if self._bytes[i >> 3] & (1 << (i & 7)):
+            return True
+        if not self._bitmap:
+            return False
+        if self._bitmap_bytes is None:
+            self._bitmap_bytes = bytearray(
+                _int_to_bytes(self._bitmap, len(self._bytes)))
+        return bool(self._bitmap_bytes[i >> 3] & (1 << (i & 7)))
+
+    def add(self, i):
+        self._bytes[i >> 3] |= 1 << (i & 7)
+
+    def update(self, bitmap):
+        """Set all bits that are set in an integer bitmap."""
+        self._bitmap |= bitmap
+        self._bitmap_bytes = None
+
+    def to_int(self):
+        return _bytes_to_int(bytes(self._bytes)) | self._bitmap
+
+
+def read_ewah(contents, offset):
+    """Read an EWAH compressed bitmap.
+
+    :param contents: Buffer to read from
+    :param offset: Offset of the bitmap in contents
+    :return: Tuple with the bitmap, its size in bits and the offset just
+        past it
+    """
+    bit_size, num_words = unpack_from('>LL', contents, offset)
+    offset += 8
+    words = unpack_from('>%dQ' % num_words, contents, offset)
+    # The words are followed by the position of the last marker word.
+    offset += num_words * 8 + 4
+    chunks = []
+    i = 0
+    while i < num_words:
+        marker = words[i]
+        running_len = (marker >> 1) & _RLW_LARGEST_RUNNING_COUNT
+        num_literals = marker >> (1 + _RLW_RUNNING_BITS)
+        if running_len:
+            chunks.append((b'\xff' if marker & 1 else b'\0') * (running_len * 8))
+        if num_literals:
+            chunks.append(struct.pack(
+                '<%dQ' % num_literals, *words[i+1:i+1+num_literals]))
+        i += 1 + num_literals
+    bitmap = _bytes_to_int(b''.join(chunks)) & ((1 << bit_size) - 1)
+    return bitmap, bit_size, offset
+
+
+def _ewah_length(contents, offset):
+    """Return the length of the EWAH compressed bitmap at offset."""
+    num_words = unpack_from('>L', contents, offset + 4)[0]
+    return 12 + num_words * 8
+
+
+def write_ewah(bitmap, bit_size):
+    """EWAH compress a bitmap.
+
+    :param bitmap: Bitmap to compress
+    :param bit_size: Number of bits in the bitmap
+    :return: The compressed bitmap, as bytes
+    """
+    num_words = (bit_size + 63) // 64
+    words = struct.unpack(
+        '<%dQ' % num_words, _int_to_bytes(bitmap, num_words * 8))
+    out = []
+    last_marker = 0
+    i = 0
+    while i < num_words or not out:
+        running_bit = 0
+        running_len = 0
+        if i < num_words and words[i] in (0, _WORD_ONES):
+            running_bit = words[i] & 1
+            while (i < num_words and words[i] == words[i - running_len] and
+                   running_len < _RLW_LARGEST_RUNNING_COUNT):
+                running_len += 1
+                i += 1
+        start = i
+        while (i < num_words and words[i] not in (0, _WORD_ONES) and
+               i - start < _RLW_LARGEST_LITERAL_COUNT):
+            i += 1
+        last_marker = len(out)
+        out.append(running_bit | (running_len << 1) |
+                   ((i - start) << (1 + _RLW_RUNNING_BITS)))
+        out.extend(words[start:i])
+    return (struct.pack('>LL', bit_size, len(out)) +
+            struct.pack('>%dQ' % len(out), *out) +
+            struct.pack('>L', last_marker))
+
+
+class PackBitmap(object):
+    """A bitmap index for a pack."""
+
+    def __init__(self, filename, index, file=None, contents=None, size=None):
+        """Create a PackBitmap object.
+
+        :param filename: Path to the .bitmap file
+        :param index: The PackIndex of the pack
+        :param file: Optional file object to read from
+        :param contents: Optional contents of the file
+        :param size: Size of the file, if known
+        """
+        self._filename = filename
+        self._index = index
+        if file is None:
+            self._file = GitFile(filename, 'rb')
+        else:
+            self._file = file
+        if contents is None:
+            self._contents, self._size = _load_file_contents(self._file, size)
+        else:
+            self._contents, self._size = (contents, size)
+        (signature, version, self.options, num_entries,
+         self._pack_checksum) = unpack_from('>4sHHL20s', self._contents, 0)
+        if signature != BITMAP_SIGNATURE:
+            raise AssertionError('Not a bitmap index file')
+        if version != BITMAP_VERSION:
+            raise AssertionError('Version was %d' % version)
+        if not self.options & BITMAP_OPT_FULL_DAG:
+            raise AssertionError('Bitmap index does not cover the full DAG')
+        offset = _HEADER_SIZE
+        type_bitmaps = []
+        for i in range(4):
+            bitmap, bit_size, offset = read_ewah(self._contents, offset)
+            type_bitmaps.append(bitmap)
+        self.commits, self.trees, self.blobs, self.tags = type_bitmaps
+        # Entries in file order, as (binary sha, xor offset, offset of the
+        # compressed bitmap) tuples.
+        self._entries = []
+        self._by_sha = {}
+        for i in range(num_entries):
+            index_pos, xor_offset, flags = unpack_from(
+                '>LBB', self._contents, offset)
+            offset += 6
+            sha = bytes(index._unpack_name(index_pos))
+            self._by_sha[sha] = len(self._entries)
+            self._entries.append((sha, xor_offset, offset))
+            offset += _ewah_length(self._contents, offset)
+        self._bitmaps = {}
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._filename)
+
+    def close(self):
+        self._file.close()
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
+
+    def __len__(self):
+        """Return the number of commits with a bitmap."""
+        return len(self._entries)
+
+    def __iter__(self):
+        """Iterate over the binary SHAs of the commits with a bitmap."""
+        return (sha for (sha, xor_offset, offset) in self._entries)
+
+    def __contains__(self, sha):
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        return sha in self._by_sha
+
+    def get(self, sha):
+        """Return the bitmap of the objects reachable from a commit.
+
+        :param sha: SHA1 of the commit, binary or hex
+        :return: Bitmap over the positions of the objects in the pack
+        :raise KeyError: if the commit has no bitmap
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        return self._get_entry(self._by_sha[sha])
+
+    def _get_entry(self, i):
+        try:
+            return self._bitmaps[i]
+        except KeyError:
+            pass
+        # Bitmaps may be stored XORed with an earlier one. Resolve the chain
+        # iteratively, starting from the earliest entry in it.
+        chain = []
+        while i not in self._bitmaps:
+            sha, xor_offset, offset = self._entries[i]
+            chain.append(i)
+            if not xor_offset:
+                break
+            i -= xor_offset
+        bitmap = self._bitmaps.get(i, 0)
+        for i in reversed(chain):
+            bitmap ^= read_ewah(self._contents, self._entries[i][2])[0]
+            self._bitmaps[i] = bitmap
+        return bitmap
+
+    def get_pack_checksum(self):
+        """Return the checksum of the pack this bitmap index is for.
+
+        :return: 20-byte binary digest
+        """
+        return self._pack_checksum
+
+    def calculate_checksum(self):
+        """Calculate the SHA1 checksum over this bitmap index.
+
+        :return: 20-byte binary digest
+        """
+        return sha1(self._contents[:-20]).digest()
+
+    def get_stored_checksum(self):
+        """Return the SHA1 checksum stored for this bitmap index.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-20:])
+
+    def check(self):
+        """Check that the stored checksum matches the actual checksum."""
+        actual = self.calculate_checksum()
+        stored = self.get_stored_checksum()
+        if actual != stored:
+            raise ChecksumMismatch(stored, actual)
+
+
+def load_pack_bitmap(path, index):
+    """Load a bitmap index file by path.
+
+    :param path: Path to the .bitmap file
+    :param index: The PackIndex of the pack
+    :return: A PackBitmap
+    """
+    with GitFile(path, 'rb') as f:
+        contents, size = _load_file_contents(f)
+        return PackBitmap(path, index, file=f, contents=contents, size=size)
+
+
+def write_pack_bitmap(f, pack_checksum, num_objects, type_bitmaps, entries):
+    """Write a bitmap index file.
+
+    :param f: File-like object to write to
+    :param pack_checksum: Checksum of the pack
+    :param num_objects: Number of objects in the pack
+    :param type_bitmaps: Tuple with the bitmaps of the commits, trees, blobs
+        and tags in the pack
+    :param entries: List of (position in the pack index, bitmap) tuples for
+        the commits that have a bitmap
+    :return: The SHA of the written bitmap index
+    """
+    f = SHA1Writer(f)
+    f.write(struct.pack('>4sHHL20s', BITMAP_SIGNATURE, BITMAP_VERSION,
+                        BITMAP_OPT_FULL_DAG, len(entries), pack_checksum))
+    for bitmap in type_bitmaps:
+        f.write(write_ewah(bitmap, num_objects))
+    for index_pos, bitmap in sorted(entries):
+        f.write(struct.pack('>LBB', index_pos, 0, 0))
+        f.write(write_ewah(bitmap, num_objects))
+    return f.write_sha()
+
+
+class _ClosureWalker(object):
+    """Finds the objects reachable from a set of objects.
+
+    Objects in the pack are recorded in a _BitSet, by their position in the
+    pack; other objects in a set of binary SHAs.
+
+    :ivar commit_trees: Dict mapping the binary SHAs of the commits read
+        by the walks to the hex SHAs of their trees
+    """
+
+    def __init__(self, pack, lookup, known):
+        """Create a _ClosureWalker.
+
+        :param pack: The Pack the bitmap positions refer to
+        :param lookup: Function that returns the object for a hex SHA
+        :param known: Function that returns the bitmap of the objects
+            reachable from an object with a binary SHA, or None
+        """
+        self._index = pack.index
+        self._rev_index = pack.rev_index
+        self._lookup = lookup
+        self._known = known
+        self.commit_trees = {}
+
+    def position(self, sha):
+        """Return the position in the pack of an object, or None."""
+        try:
+            offset = self._index.object_index(sha)
+        except KeyError:
+            return None
+        return self._rev_index.pack_position(offset)
+
+    def fill(self, bitset, extra, roots):
+        """Add the objects reachable from roots.
+
+        :param bitset: _BitSet with the objects in the pack found so far.
+            Every object in it must have its reachable objects in it (or in
+            extra) too, or be reached by this walk.
+        :param extra: Set with the binary SHAs of the objects outside the
+            pack found so far
+        :param roots: List of (binary sha, is_leaf) tuples; is_leaf is True
+            for objects that are known to be blobs
+        """
+        todo = list(roots)
+        while todo:
+            sha, leaf = todo.pop()
+            pos = self.position(sha)
+            if pos is None:
+                if sha in extra:
+                    continue
+                extra.add(sha)
+            else:
+                if pos in bitset:
+                    continue
+                known = self._known(sha)
+                if known is not None:
+                    bitset.update(known)
+                    continue
+                bitset.add(pos)
+            if leaf:
+                continue
+            obj = self._lookup(sha_to_hex(sha))
+            if isinstance(obj, Commit):
+                self.commit_trees[sha] = obj.tree
+                todo.append((hex_to_sha(obj.tree), False))
+                todo.extend((hex_to_sha(p), False) for p in obj.parents)
+            elif isinstance(obj, Tree):
+                for name, mode, entry_sha in obj.iteritems():
+                    if S_ISGITLINK(mode):
+                        continue
+                    todo.append(
+                        (hex_to_sha(entry_sha), not stat.S_ISDIR(mode)))
+            elif isinstance(obj, Tag):
+                todo.append((hex_to_sha(obj.object[1]), False))
+
+
+def build_pack_bitmaps(pack, commits=None, interval=DEFAULT_BITMAP_INTERVAL):
+    """Compute the bitmaps for a bitmap index of a pack.
+
+    All objects reachable from the commits in the pack must be in the pack
+    as well.
+
+    :param pack: The Pack to compute the bitmaps for
+    :param commits: Binary SHAs of the commits to compute bitmaps for; by
+        default the commits that no other commit in the pack has as parent,
+        and every interval'th other commit, which bounds the number of
+        commits that have to be walked to reach one with a bitmap
+    :param interval: Interval between the commits that get a bitmap, if
+        commits is not specified
+    :return: Tuple with a tuple of the bitmaps of the commits, trees, blobs
+        and tags in the pack, and a list with (binary sha, bitmap) tuples
+    :raise ValueError: if an object reachable from a commit in the pack is
+        not in the pack
+    """
+    num_objects = len(pack)
+    objects = []
+    parents = {}
+    for unpacked in DeltaChainIterator.for_pack_data(
+            pack.data, resolve_ext_ref=pack.resolve_ext_ref):
+        sha = unpacked.sha()
+        objects.append((unpacked.offset, unpacked.obj_type_num, sha))
+        if unpacked.obj_type_num == Commit.type_num:
+            commit = ShaFile.from_raw_chunks(
+                unpacked.obj_type_num, unpacked.obj_chunks)
+            parents[sha] = [hex_to_sha(p) for p in commit.parents]
+    objects.sort()
+    type_nums = (Commit.type_num, Tree.type_num, 3, Tag.type_num)
+    type_sets = dict((type_num, _BitSet(num_objects))
+                     for type_num in type_nums)
+    for pos, (offset, type_num, sha) in enumerate(objects):
+        type_sets[type_num].add(pos)
+    type_bitmaps = tuple([type_sets[type_num].to_int()
+                          for type_num in type_nums])
+    del objects, type_sets
+
+    # Order the commits so that parents come before their children.
+    num_children = dict((sha, 0) for sha in parents)
+    for sha, commit_parents in parents.items():
+        for parent in set(commit_parents):
+            if parent not in parents:
+                raise ValueError('Parent %s of %s is not in the pack' %
+                                 (sha_to_hex(parent), sha_to_hex(sha)))
+            num_children[parent] += 1
+    pending = dict((sha, len(set(p))) for (sha, p) in parents.items())
+    children = dict((sha, []) for sha in parents)
+    for sha, commit_parents in parents.items():
+        for parent in set(commit_parents):
+            children[parent].append(sha)
+    order = []
+    todo = sorted(sha for (sha, n) in pending.items() if n == 0)
+    while todo:
+        sha = todo.pop()
+        order.append(sha)
+        for child in children[sha]:
+            pending[child] -= 1
+            if pending[child] == 0:
+                todo.append(child)
+    del children, pending
+
+    if commits is None:
+        selected = set(sha for (sha, n) in num_children.items() if n == 0)
+        selected.update(order[interval-1::interval])
+    else:
+        selected = set(commits)
+
+    # Bitmaps of the commits that still have to be used for their children,
+    # or that were selected.
+    bitmaps = {}
+    walker = _ClosureWalker(pack, pack.__getitem__, bitmaps.get)
+    for sha in order:
+        bitset = _BitSet(num_objects)
+        extra = set()
+        walker.fill(bitset, extra, [(sha, False)])
+        if extra:
+            raise ValueError('Object %s reachable from %s is not in the pack'
+                             % (sha_to_hex(extra.pop()), sha_to_hex(sha)))
+        bitmaps[sha] = bitset.to_int()
+        for parent in set(parents[sha]):
+            num_children[parent] -= 1
+            if num_children[parent] == 0 and parent not in selected:
+                del bitmaps[parent]
+    return type_bitmaps, [(sha, bitmaps[sha]) for sha in order
+                          if sha in selected]
+
+
+def _missing_tree_paths(object_store, roots, missing):
+    """Find the names of the missing trees and blobs.
+
+    Only missing trees are descended into; everything reachable from a tree
+    the other side has is present there too.
+
+    :param object_store: Object store to read the trees from
+    :param roots: Hex SHAs of the trees of the missing commits
+    :param missing: Set with the hex SHAs of the missing objects
+    :return: Dict mapping the hex SHAs of the missing trees and blobs that
+        were found to the name of the tree entry they were first found
+        through, or b'' for the trees of commits
+    """
+    paths = {}
+    todo = []
+    for sha in roots:
+        if sha in missing and sha not in paths:
+            paths[sha] = b''
+            todo.append(sha)
+    while todo:
+        subtrees = []
+        for tree_sha, type_num, raw in object_store.get_raw_many(todo):
+            tree = ShaFile.from_raw_string(type_num, raw, sha=tree_sha)
+            for name, mode, sha in tree.iteritems():
+                if S_ISGITLINK(mode) or sha not in missing or sha in paths:
+                    continue
+                paths[sha] = name
+                if stat.S_ISDIR(mode):
+                    subtrees.append(sha)
+        todo = subtrees
+    return paths
+
+
+def find_missing_objects_by_bitmap(object_store, pack, haves, wants,
+                                   get_tagged=None, progress=None):
+    """Find the objects missing from another object store using bitmaps.
+
+    This finds the objects reachable from wants but not from haves. Walks
+    stop at commits in pack that have a bitmap, so only the history between
+    the wants or haves and the nearest commits with a bitmap is walked.
+
+    :param object_store: Object store containing at least all objects to be
+        sent
+    :param pack: Pack in object_store that has a bitmap index
+    :param haves: SHA1s of objects not to send (already present in target)
+    :param wants: SHA1s of objects to send
+    :param get_tagged: Function that returns a dict of pointed-to sha -> tag
+        sha for including tags.
+    :param progress: Optional function to report progress to.
+    :return: List of (sha, path) tuples, in pack order for the objects in
+        pack. As with MissingObjectFinder, the path of a tree or blob is the
+        name it has in the first missing tree it was found in, or b'' for
+        the trees of commits; it is None for other objects and for trees
+        and blobs that are only reachable from tags or wants.
+    """
+    bitmap = pack.bitmap
+
+    def known(sha):
+        try:
+            return bitmap.get(sha)
+        except KeyError:
+            return None
+
+    walker = _ClosureWalker(pack, object_store.__getitem__, known)
+    num_objects = len(pack)
+    have_bits = _BitSet(num_objects)
+    have_extra = set()
+    walker.fill(have_bits, have_extra, [
+        (hex_to_sha(sha), False) for sha in haves if sha in object_store])
+    want_bits = _BitSet(num_objects)
+    want_extra = set()
+    walker.fill(want_bits, want_extra,
+                [(hex_to_sha(sha), False) for sha in wants])
+    have_bitmap = have_bits.to_int()
+    missing = want_bits.to_int() & ~have_bitmap
+    rev_index = pack.rev_index
+    ret = [sha_to_hex(bytes(rev_index.name(pos))) for pos in iter_bits(missing)]
+    extra = want_extra.difference(have_extra)
+    ret.extend(sha_to_hex(sha) for sha in extra)
+
+    # Give the trees and blobs the names deltify_pack_objects groups them by.
+    roots = []
+    commit_trees = walker.commit_trees
+    for pos in iter_bits(missing & bitmap.commits):
+        sha = bytes(rev_index.name(pos))
+        tree = commit_trees.get(sha)
+        if tree is None:
+            tree = object_store[sha_to_hex(sha)].tree
+        roots.append(tree)
+    roots.extend(commit_trees[sha] for sha in extra if sha in commit_trees)
+    paths = _missing_tree_paths(object_store, roots, set(ret))
+    ret = [(sha, paths.get(sha)) for sha in ret]
+    if get_tagged:
+        sent = set(sha for (sha, path) in ret)
+        for pointed, tag in get_tagged().items():
+            if pointed not in sent or tag in sent:
+                continue
+            tag_sha = hex_to_sha(tag)
+            pos = walker.position(tag_sha)
+            if pos is None:
+                if tag_sha in have_extra:
+                    continue
+            elif have_bitmap & (1 << pos):
+                continue
+            sent.add(tag)
+            ret.append((tag, None))
+    if progress is not None:
+        progress(("counting objects: %d, done.\n" % len(ret)).encode('ascii'))
+    return ret
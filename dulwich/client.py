@@ -90,6 +90,7 @@ from dulwich.protocol import (
     extract_capabilities,
     )
 from dulwich.pack import (
+    write_pack_data,
     write_pack_objects,
     )
 from dulwich.refs import (
@@ -866,7 +867,14 @@ class LocalGitClient(GitClient):
             # that the client still expects a 0-object pack in most cases.
             if objects_iter is None:
                 return
-            write_pack_objects(ProtocolFile(None, pack_data), objects_iter)
+            if getattr(objects_iter, 'iterrecords', None) is not None:
+                # Copy packed objects as they are, rather than inflating
+                # and deflating them again.
+                write_pack_data(ProtocolFile(None, pack_data),
+                                len(objects_iter), objects_iter.iterrecords())
+            else:
+                write_pack_objects(ProtocolFile(None, pack_data),
+                                   objects_iter)
 
     def get_refs(self, path):
         """Retrieve the current refs from a git smart server."""
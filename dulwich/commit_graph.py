@@ -0,0 +1,366 @@
+# commit_graph.py -- Reading and writing commit-graph files
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) a later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Reading and writing commit-graph files.
+
+A commit-graph stores the tree, parents and commit time of commits in a
+table sorted by SHA, so that history can be walked without inflating and
+parsing commit objects. It also stores a generation number for each commit:
+one more than the largest generation number of its parents. It lives in
+objects/info/commit-graph.
+"""
+
+from hashlib import sha1
+import struct
+from struct import unpack_from
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.file import GitFile
+from dulwich.objects import (
+    hex_to_sha,
+    sha_to_hex,
+    )
+from dulwich.pack import (
+    SHA1Writer,
+    _load_file_contents,
+    bisect_find_sha,
+    )
+
+
+COMMIT_GRAPH_FILENAME = 'commit-graph'
+
+COMMIT_GRAPH_SIGNATURE = b'CGPH'
+COMMIT_GRAPH_VERSION = 1
+COMMIT_GRAPH_HASH_VERSION_SHA1 = 1
+
+CHUNK_OIDFANOUT = b'OIDF'
+CHUNK_OIDLOOKUP = b'OIDL'
+CHUNK_COMMITDATA = b'CDAT'
+CHUNK_EXTRAEDGES = b'EDGE'
+
+GRAPH_PARENT_NONE = 0x70000000
+GRAPH_EXTRA_EDGES_NEEDED = 0x80000000
+GRAPH_LAST_EDGE = 0x80000000
+
+GENERATION_NUMBER_MAX = 0x3FFFFFFF
+
+_HEADER_SIZE = 8
+_CHUNK_ENTRY_SIZE = 12
+_COMMIT_DATA_SIZE = 36
+
+
+class CommitGraph(object):
+    """A commit-graph file."""
+
+    def __init__(self, filename, file=None, contents=None, size=None):
+        """Create a CommitGraph object.
+
+        :param filename: Path to the commit-graph file
+        :param file: Optional file object to read from
+        :param contents: Optional contents of the file
+        :param size: Size of the file, if known
+        """
+        self._filename = filename
+        if file is None:
+            self._file = GitFile(filename, 'rb')
+        else:
+            self._file = file
+        if contents is None:
+            self._contents, self._size = _load_file_contents(self._file, size)
+        else:
+            self._contents, self._size = (contents, size)
+        (signature, version, hash_version, num_chunks,
+         num_base_graphs) = unpack_from('>4sBBBB', self._contents, 0)
+        if signature != COMMIT_GRAPH_SIGNATURE:
+            raise AssertionError('Not a commit-graph file')
+        if version != COMMIT_GRAPH_VERSION:
+            raise AssertionError('Version was %d' % version)
+        if hash_version != COMMIT_GRAPH_HASH_VERSION_SHA1:
+            raise AssertionError('Unsupported hash version %d' % hash_version)
+        if num_base_graphs != 0:
+            raise AssertionError('Split commit-graph files are not supported')
+        self._chunks = {}
+        for i in range(num_chunks):
+            chunk_id, offset = unpack_from(
+                '>4sQ', self._contents, _HEADER_SIZE + i * _CHUNK_ENTRY_SIZE)
+            self._chunks[chunk_id] = offset
+        for chunk_id in (CHUNK_OIDFANOUT, CHUNK_OIDLOOKUP, CHUNK_COMMITDATA):
+            if chunk_id not in self._chunks:
+                raise AssertionError('Missing %r chunk' % chunk_id)
+        self._fan_out_table = list(unpack_from(
+            '>256L', self._contents, self._chunks[CHUNK_OIDFANOUT]))
+        self._name_table_offset = self._chunks[CHUNK_OIDLOOKUP]
+        self._commit_data_offset = self._chunks[CHUNK_COMMITDATA]
+        self._extra_edges_offset = self._chunks.get(CHUNK_EXTRAEDGES)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._filename)
+
+    def close(self):
+        self._file.close()
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
+
+    def __len__(self):
+        """Return the number of commits in this commit-graph."""
+        return self._fan_out_table[-1]
+
+    def _unpack_name(self, i):
+        offset = self._name_table_offset + i * 20
+        return self._contents[offset:offset+20]
+
+    def _unpack_commit(self, i):
+        """Unpack the commit data for a position in the commit-graph.
+
+        :return: Tuple with binary tree SHA, list of parent positions,
+            generation number and commit time
+        """
+        offset = self._commit_data_offset + i * _COMMIT_DATA_SIZE
+        tree = self._contents[offset:offset+20]
+        parent1, parent2, generation, commit_time = unpack_from(
+            '>LLLL', self._contents, offset + 20)
+        parents = []
+        if parent1 != GRAPH_PARENT_NONE:
+            parents.append(parent1)
+        if parent2 & GRAPH_EXTRA_EDGES_NEEDED:
+            edge_offset = (self._extra_edges_offset +
+                           (parent2 & ~GRAPH_EXTRA_EDGES_NEEDED) * 4)
+            while True:
+                edge = unpack_from('>L', self._contents, edge_offset)[0]
+                parents.append(edge & ~GRAPH_LAST_EDGE)
+                if edge & GRAPH_LAST_EDGE:
+                    break
+                edge_offset += 4
+        elif parent2 != GRAPH_PARENT_NONE:
+            parents.append(parent2)
+        commit_time |= (generation & 0x3) << 32
+        return tree, parents, generation >> 2, commit_time
+
+    def _position(self, sha):
+        """Find the position of a commit in this commit-graph.
+
+        :param sha: SHA1 of the commit, binary or hex
+        :raise KeyError: if the commit is not in this commit-graph
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        assert len(sha) == 20
+        idx = ord(sha[:1])
+        if idx == 0:
+            start = 0
+        else:
+            start = self._fan_out_table[idx-1]
+        end = self._fan_out_table[idx]
+        if start < end:
+            i = bisect_find_sha(start, end - 1, sha, self._unpack_name)
+            if i is not None:
+                return i
+        raise KeyError(sha)
+
+    def __iter__(self):
+        """Iterate over the SHAs in this commit-graph."""
+        for i in range(len(self)):
+            yield bytes(self._unpack_name(i))
+
+    def __contains__(self, sha):
+        try:
+            self._position(sha)
+        except KeyError:
+            return False
+        return True
+
+    def iterentries(self):
+        """Iterate over the entries in this commit-graph.
+
+        :return: iterator over tuples with binary commit SHA, binary tree
+            SHA, list of binary parent SHAs, generation number and commit
+            time
+        """
+        for i in range(len(self)):
+            tree, parents, generation, commit_time = self._unpack_commit(i)
+            yield (bytes(self._unpack_name(i)), bytes(tree),
+                   [bytes(self._unpack_name(p)) for p in parents],
+                   generation, commit_time)
+
+    def get_parents(self, sha):
+        """Return the parents of a commit.
+
+        :param sha: SHA1 of the commit, binary or hex
+        :return: List of hex SHAs of the parents
+        :raise KeyError: if the commit is not in this commit-graph
+        """
+        parents = self._unpack_commit(self._position(sha))[1]
+        return [sha_to_hex(self._unpack_name(p)) for p in parents]
+
+    def get_tree(self, sha):
+        """Return the hex SHA of the tree of a commit.
+
+        :raise KeyError: if the commit is not in this commit-graph
+        """
+        return sha_to_hex(self._unpack_commit(self._position(sha))[0])
+
+    def get_generation(self, sha):
+        """Return the generation number of a commit.
+
+        Commits without parents have generation number 1. Generation numbers
+        are capped at GENERATION_NUMBER_MAX.
+
+        :raise KeyError: if the commit is not in this commit-graph
+        """
+        return self._unpack_commit(self._position(sha))[2]
+
+    def get_commit_time(self, sha):
+        """Return the commit time of a commit.
+
+        :raise KeyError: if the commit is not in this commit-graph
+        """
+        return self._unpack_commit(self._position(sha))[3]
+
+    def calculate_checksum(self):
+        """Calculate the SHA1 checksum over this commit-graph.
+
+        :return: 20-byte binary digest
+        """
+        return sha1(self._contents[:-20]).digest()
+
+    def get_stored_checksum(self):
+        """Return the SHA1 checksum stored for this commit-graph.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-20:])
+
+    def check(self):
+        """Check that the stored checksum matches the actual checksum."""
+        actual = self.calculate_checksum()
+        stored = self.get_stored_checksum()
+        if actual != stored:
+            raise ChecksumMismatch(stored, actual)
+
+
+def load_commit_graph(path):
+    """Load a commit-graph file by path.
+
+    :param path: Path to the commit-graph file
+    :return: A CommitGraph
+    """
+    with GitFile(path, 'rb') as f:
+        contents, size = _load_file_contents(f)
+        return CommitGraph(path, file=f, contents=contents, size=size)
+
+
+def compute_generations(parents):
+    """Compute the generation numbers of a set of commits.
+
+    :param parents: Dict mapping commit SHAs to lists of parent SHAs; all
+        parents must be keys as well
+    :return: Dict mapping commit SHAs to generation numbers
+    """
+    generations = {}
+    for sha in parents:
+        if sha in generations:
+            continue
+        todo = [sha]
+        while todo:
+            current = todo[-1]
+            pending = [p for p in parents[current] if p not in generations]
+            if pending:
+                todo.extend(pending)
+                continue
+            todo.pop()
+            generations[current] = min(GENERATION_NUMBER_MAX, 1 + max(
+                [generations[p] for p in parents[current]] or [0]))
+    return generations
+
+
+def write_commit_graph(f, commits):
+    """Write a commit-graph file.
+
+    :param f: File-like object to write to
+    :param commits: Iterable over the Commit objects to include; the parents
+        of each commit must be included as well
+    :return: The SHA of the written commit-graph
+    :raise ValueError: if the parent of a commit is not included
+    """
+    entries = {}
+    for commit in commits:
+        entries[hex_to_sha(commit.id)] = (
+            hex_to_sha(commit.tree), [hex_to_sha(p) for p in commit.parents],
+            commit.commit_time)
+    shas = sorted(entries)
+    positions = dict((sha, i) for (i, sha) in enumerate(shas))
+    for sha, (tree, parents, commit_time) in entries.items():
+        for parent in parents:
+            if parent not in positions:
+                raise ValueError('Parent %s of %s is not included' %
+                                 (sha_to_hex(parent), sha_to_hex(sha)))
+    generations = compute_generations(
+        dict((sha, entry[1]) for (sha, entry) in entries.items()))
+
+    fan_out_table = [0] * 0x100
+    for sha in shas:
+        fan_out_table[ord(sha[:1])] += 1
+    for i in range(1, 0x100):
+        fan_out_table[i] += fan_out_table[i-1]
+
+    commit_data = []
+    extra_edges = []
+    for sha in shas:
+        tree, parents, commit_time = entries[sha]
+        parent_positions = [positions[p] for p in parents]
+        if not parent_positions:
+            parent1 = parent2 = GRAPH_PARENT_NONE
+        elif len(parent_positions) == 1:
+            parent1 = parent_positions[0]
+            parent2 = GRAPH_PARENT_NONE
+        elif len(parent_positions) == 2:
+            parent1, parent2 = parent_positions
+        else:
+            parent1 = parent_positions[0]
+            parent2 = GRAPH_EXTRA_EDGES_NEEDED | len(extra_edges)
+            extra_edges.extend(parent_positions[1:-1])
+            extra_edges.append(GRAPH_LAST_EDGE | parent_positions[-1])
+        commit_data.append(tree + struct.pack(
+            '>LLLL', parent1, parent2,
+            (generations[sha] << 2) | ((commit_time >> 32) & 0x3),
+            commit_time & 0xffffffff))
+
+    chunks = [
+        (CHUNK_OIDFANOUT, [struct.pack('>256L', *fan_out_table)]),
+        (CHUNK_OIDLOOKUP, shas),
+        (CHUNK_COMMITDATA, commit_data),
+        ]
+    if extra_edges:
+        chunks.append((CHUNK_EXTRAEDGES, [
+            struct.pack('>%dL' % len(extra_edges), *extra_edges)]))
+
+    f = SHA1Writer(f)
+    f.write(struct.pack('>4sBBBB', COMMIT_GRAPH_SIGNATURE,
+                        COMMIT_GRAPH_VERSION, COMMIT_GRAPH_HASH_VERSION_SHA1,
+                        len(chunks), 0))
+    offset = _HEADER_SIZE + (len(chunks) + 1) * _CHUNK_ENTRY_SIZE
+    for chunk_id, data in chunks:
+        f.write(struct.pack('>4sQ', chunk_id, offset))
+        offset += sum(len(d) for d in data)
+    f.write(struct.pack('>4sQ', b'\0\0\0\0', offset))
+    for chunk_id, data in chunks:
+        for d in data:
+            f.write(d)
+    return f.write_sha()
@@ -36,6 +36,13 @@ from collections import (
 from dulwich.file import GitFile
 
 
+_INT_SUFFIXES = {
+    b"k": 1024,
+    b"m": 1024 * 1024,
+    b"g": 1024 * 1024 * 1024,
+    }
+
+
 class Config(object):
     """A Git configuration."""
 
@@ -68,6 +75,31 @@ class Config(object):
             return False
         raise ValueError("not a valid boolean string: %r" % value)
 
+    def get_int(self, section, name, default=None):
+        """Retrieve a configuration setting as integer.
+
+        As in git, the value may have a k, m or g suffix to scale it by
+        1024, 1024^2 or 1024^3.
+
+        :param section: Tuple with section name and optional subsection namee
+        :param name: Name of the setting, including section and possible
+            subsection.
+        :return: Contents of the setting
+        """
+        try:
+            value = self.get(section, name)
+        except KeyError:
+            return default
+        factor = _INT_SUFFIXES.get(value[-1:].lower())
+        if factor is not None:
+            value = value[:-1]
+        else:
+            factor = 1
+        try:
+            return int(value) * factor
+        except ValueError:
+            raise ValueError("not a valid integer string: %r" % value)
+
     def set(self, section, name, value):
         """Set a configuration value.
 
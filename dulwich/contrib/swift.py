@@ -48,7 +48,6 @@ from dulwich.greenthreads import (
     GreenThreadsObjectStoreIterator,
     )
 
-from dulwich.lru_cache import LRUSizeCache
 from dulwich.objects import (
     Blob,
     Commit,
@@ -62,9 +61,10 @@ from dulwich.object_store import (
     INFODIR,
     )
 from dulwich.pack import (
+    DeltaBaseCache,
     PackData,
     Pack,
-    PackIndexer,
+    StreamingPackIndexer,
     PackStreamCopier,
     write_pack_header,
     compute_file_sha,
@@ -72,7 +72,6 @@ from dulwich.pack import (
     write_pack_index_v2,
     load_pack_index_file,
     read_pack_header,
-    _compute_object_size,
     unpack_object,
     write_pack_object,
     )
@@ -577,13 +576,13 @@ class SwiftPackData(PackData):
         pack_reader = SwiftPackReader(self.scon, self._filename,
                                       self.pack_length)
         (version, self._num_objects) = read_pack_header(pack_reader.read)
-        self._offset_cache = LRUSizeCache(1024*1024*self.scon.cache_length,
-                                          compute_size=_compute_object_size)
+        self._contents = None
+        self.delta_base_cache = DeltaBaseCache(
+            1024*1024*self.scon.cache_length)
+        self._cache_key = filename
         self.pack = None
 
-    def get_object_at(self, offset):
-        if offset in self._offset_cache:
-            return self._offset_cache[offset]
+    def _get_object_at(self, offset):
         assert offset >= self._header_size
         pack_reader = SwiftPackReader(self.scon, self._filename,
                                       self.pack_length)
@@ -650,11 +649,12 @@ class SwiftObjectStore(PackBasedObjectStore):
         """List with pack objects."""
         if not self._pack_cache:
             self._update_pack_cache()
-        return self._pack_cache.values()
+        return self._ordered_packs()
 
     def _update_pack_cache(self):
         for pack in self._load_packs():
             self._pack_cache[pack._basename] = pack
+        self._pack_order_stale = True
 
     def _iter_loose_objects(self):
         """Loose objects are not supported by this repository
@@ -767,7 +767,7 @@ class SwiftObjectStore(PackBasedObjectStore):
         fd, path = tempfile.mkstemp(prefix='tmp_pack_')
         f = os.fdopen(fd, 'w+b')
         try:
-            indexer = PackIndexer(f, resolve_ext_ref=self.get_raw)
+            indexer = StreamingPackIndexer(f, resolve_ext_ref=self.get_raw)
             copier = PackStreamCopier(read_all, read_some, f,
                                       delta_iter=indexer)
             copier.verify()
@@ -216,7 +216,7 @@ class SwiftRepoSmokeTest(unittest.TestCase):
         commit_sha = swift_repo.refs.read_loose_ref('refs/heads/master')
         otype, data = swift_repo.object_store.get_raw(commit_sha)
         commit = objects.ShaFile.from_raw_string(otype, data)
-        otype, data = swift_repo.object_store.get_raw(commit._tree)
+        otype, data = swift_repo.object_store.get_raw(commit.tree)
         tree = objects.ShaFile.from_raw_string(otype, data)
         objs = tree.items()
         objs_ = []
@@ -0,0 +1,250 @@
+# graph.py -- Reachability queries on the commit graph
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) a later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Reachability queries on the commit graph.
+
+The queries are answered by walking commits in order of decreasing
+generation number, where the generation number of a commit is one more than
+the largest generation number of its parents. Unlike commit times, these
+are never out of order, so a walk can stop as soon as the commits that
+remain cannot make a difference to the answer.
+"""
+
+import heapq
+from itertools import count
+
+
+_ONE = 1
+_TWO = 2
+_STALE = 4
+
+
+class Reachability(object):
+    """Answers reachability queries for the commits in an object store.
+
+    Generation numbers are read from the commit-graph of the object store
+    where possible, and computed otherwise. Computed generation numbers are
+    cached for the lifetime of this object.
+    """
+
+    def __init__(self, object_store, get_parents=None):
+        """Create a Reachability object.
+
+        :param object_store: Object store to read commits from
+        :param get_parents: Optional function that returns the parents of a
+            commit given its SHA, e.g. to honor grafts. By default the
+            parents recorded in the commits are used.
+        """
+        self._store = object_store
+        if get_parents is None:
+            self._graph = object_store.get_commit_graph()
+            self._get_parents = object_store.get_commit_parents
+        else:
+            # Generation numbers in the commit-graph do not take other
+            # parents into account.
+            self._graph = None
+            self._get_parents = get_parents
+        self._generations = {}
+
+    def get_parents(self, sha):
+        """Return the parents of a commit."""
+        return self._get_parents(sha)
+
+    def generation(self, sha):
+        """Return the generation number of a commit.
+
+        :param sha: SHA1 of the commit
+        :raise KeyError: if the commit or one of its ancestors is missing
+        """
+        generations = self._generations
+        try:
+            return generations[sha]
+        except KeyError:
+            pass
+        graph = self._graph
+        todo = [sha]
+        while todo:
+            current = todo[-1]
+            if current in generations:
+                todo.pop()
+                continue
+            if graph is not None:
+                try:
+                    generations[current] = graph.get_generation(current)
+                except KeyError:
+                    pass
+                else:
+                    todo.pop()
+                    continue
+            parents = self._get_parents(current)
+            pending = [p for p in parents if p not in generations]
+            if pending:
+                todo.extend(pending)
+                continue
+            todo.pop()
+            generations[current] = 1 + max(
+                [generations[p] for p in parents] or [0])
+        return generations[sha]
+
+    def _walk(self, starts, min_generation):
+        """Iterate over the commits reachable from starts.
+
+        Commits with a generation number below min_generation are not
+        returned, and their ancestors are not walked.
+        """
+        seen = set(starts)
+        todo = list(starts)
+        while todo:
+            sha = todo.pop()
+            if self.generation(sha) < min_generation:
+                continue
+            yield sha
+            for parent in self._get_parents(sha):
+                if parent not in seen:
+                    seen.add(parent)
+                    todo.append(parent)
+
+    def is_ancestor(self, ancestor, descendant):
+        """Check whether a commit is an ancestor of another commit.
+
+        A commit is considered to be an ancestor of itself.
+
+        :param ancestor: SHA1 of the possible ancestor
+        :param descendant: SHA1 of the possible descendant
+        """
+        return bool(self.reachable_from([descendant], [ancestor]))
+
+    def reachable_from(self, haves, commits):
+        """Find which commits are reachable from any of a set of commits.
+
+        Only history with generation numbers at least as large as the
+        smallest one in commits is walked.
+
+        :param haves: SHA1s of the commits to start from
+        :param commits: SHA1s of the commits to look for
+        :return: Set with the elements of commits that are ancestors of (or
+            equal to) one of haves
+        """
+        commits = set(commits)
+        if not commits:
+            return set()
+        min_generation = min(self.generation(sha) for sha in commits)
+        found = set()
+        for sha in self._walk(haves, min_generation):
+            if sha in commits:
+                found.add(sha)
+                if len(found) == len(commits):
+                    break
+        return found
+
+    def _paint_down(self, starts, mark_common=False):
+        """Propagate flags from commits to their ancestors.
+
+        Commits are visited in order of decreasing generation number, so the
+        flags of a commit are complete when it is visited. The walk stops
+        once all queued commits have the _STALE flag.
+
+        :param starts: List of (sha, flags) tuples
+        :param mark_common: Whether to add the _STALE flag to commits that
+            have both the _ONE and _TWO flags when visiting them
+        :return: Tuple with a dict mapping the visited and queued commits to
+            their flags, and a list with (sha, flags) tuples for the visited
+            commits, in order, with the flags they had when visited
+        """
+        flags = {}
+        # Commits with the same generation number may be visited in any
+        # order, so ties are broken by insertion order.
+        queue = []
+        counter = count()
+        nonstale = 0
+        for sha, flag in starts:
+            if sha in flags:
+                if not flags[sha] & _STALE and flag & _STALE:
+                    nonstale -= 1
+                flags[sha] |= flag
+                continue
+            flags[sha] = flag
+            heapq.heappush(
+                queue, (-self.generation(sha), next(counter), sha))
+            if not flag & _STALE:
+                nonstale += 1
+        visited = []
+        while nonstale:
+            _, _, sha = heapq.heappop(queue)
+            flag = flags[sha]
+            visited.append((sha, flag))
+            if not flag & _STALE:
+                nonstale -= 1
+                if mark_common and flag & _ONE and flag & _TWO:
+                    flag |= _STALE
+                    flags[sha] = flag
+            for parent in self._get_parents(sha):
+                old = flags.get(parent)
+                if old is None:
+                    flags[parent] = flag
+                    heapq.heappush(queue, (
+                        -self.generation(parent), next(counter), parent))
+                    if not flag & _STALE:
+                        nonstale += 1
+                elif old | flag != old:
+                    flags[parent] = old | flag
+                    if not old & _STALE and flag & _STALE:
+                        nonstale -= 1
+        return flags, visited
+
+    def merge_base(self, one, two):
+        """Find the best common ancestors of two commits.
+
+        :param one: SHA1 of the first commit
+        :param two: SHA1 of the second commit
+        :return: List of the SHA1s of the common ancestors that are not
+            ancestors of other common ancestors
+        """
+        if one == two:
+            return [one]
+        flags, visited = self._paint_down(
+            [(one, _ONE), (two, _TWO)], mark_common=True)
+        candidates = [sha for (sha, flag) in visited
+                      if flag & _ONE and flag & _TWO and not flag & _STALE]
+        # A candidate can still be an ancestor of another one, through a
+        # path that was not walked.
+        return [sha for sha in candidates if not self.reachable_from(
+            [c for c in candidates if c != sha], [sha])]
+
+    def missing_commits(self, haves, wants):
+        """Find the commits reachable from wants but not from haves.
+
+        :param haves: SHA1s of the commits that are present
+        :param wants: SHA1s of the commits that are wanted
+        :return: Tuple with the set of commits reachable from wants but not
+            from haves, and the set of commits reachable from haves that are
+            parents of those commits or wants themselves
+        """
+        starts = [(sha, _ONE) for sha in wants]
+        starts.extend((sha, _STALE) for sha in haves)
+        flags, visited = self._paint_down(starts)
+        missing = set(sha for (sha, flag) in visited if not flag & _STALE)
+        common = set()
+        for sha in wants:
+            if flags[sha] & _STALE:
+                common.add(sha)
+        for sha in missing:
+            for parent in self._get_parents(sha):
+                if flags[parent] & _STALE:
+                    common.add(parent)
+        return missing, common
@@ -0,0 +1,290 @@
+# midx.py -- Reading and writing multi-pack-index files
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) a later version of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Reading and writing multi-pack-index files.
+
+A multi-pack-index (MIDX) lists the objects of several packs in a single
+sorted table, so that an object can be found with one binary search rather
+than one per pack. It lives in objects/pack/multi-pack-index.
+"""
+
+from hashlib import sha1
+import struct
+from struct import unpack_from
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.file import GitFile
+from dulwich.objects import (
+    hex_to_sha,
+    )
+from dulwich.pack import (
+    SHA1Writer,
+    _load_file_contents,
+    bisect_find_sha,
+    )
+
+
+MIDX_FILENAME = 'multi-pack-index'
+
+MIDX_SIGNATURE = b'MIDX'
+MIDX_VERSION = 1
+MIDX_HASH_VERSION_SHA1 = 1
+
+CHUNK_PACKNAMES = b'PNAM'
+CHUNK_OIDFANOUT = b'OIDF'
+CHUNK_OIDLOOKUP = b'OIDL'
+CHUNK_OBJECTOFFSETS = b'OOFF'
+CHUNK_LARGEOFFSETS = b'LOFF'
+
+MIDX_LARGE_OFFSET_NEEDED = 0x80000000
+
+_HEADER_SIZE = 12
+_CHUNK_ENTRY_SIZE = 12
+
+
+class MultiPackIndex(object):
+    """A multi-pack-index file."""
+
+    def __init__(self, filename, file=None, contents=None, size=None):
+        """Create a MultiPackIndex object.
+
+        :param filename: Path to the multi-pack-index file
+        :param file: Optional file object to read from
+        :param contents: Optional contents of the file
+        :param size: Size of the file, if known
+        """
+        self._filename = filename
+        if file is None:
+            self._file = GitFile(filename, 'rb')
+        else:
+            self._file = file
+        if contents is None:
+            self._contents, self._size = _load_file_contents(self._file, size)
+        else:
+            self._contents, self._size = (contents, size)
+        (signature, version, hash_version, num_chunks, num_base_files,
+         num_packs) = unpack_from('>4sBBBBL', self._contents, 0)
+        if signature != MIDX_SIGNATURE:
+            raise AssertionError('Not a multi-pack-index file')
+        if version != MIDX_VERSION:
+            raise AssertionError('Version was %d' % version)
+        if hash_version != MIDX_HASH_VERSION_SHA1:
+            raise AssertionError('Unsupported hash version %d' % hash_version)
+        if num_base_files != 0:
+            raise AssertionError('Incremental multi-pack-index files are '
+                                 'not supported')
+        self._chunks = {}
+        for i in range(num_chunks):
+            chunk_id, offset = unpack_from(
+                '>4sQ', self._contents, _HEADER_SIZE + i * _CHUNK_ENTRY_SIZE)
+            self._chunks[chunk_id] = offset
+        for chunk_id in (CHUNK_PACKNAMES, CHUNK_OIDFANOUT, CHUNK_OIDLOOKUP,
+                         CHUNK_OBJECTOFFSETS):
+            if chunk_id not in self._chunks:
+                raise AssertionError('Missing %r chunk' % chunk_id)
+        self._fan_out_table = list(unpack_from(
+            '>256L', self._contents, self._chunks[CHUNK_OIDFANOUT]))
+        self._name_table_offset = self._chunks[CHUNK_OIDLOOKUP]
+        self._offset_table_offset = self._chunks[CHUNK_OBJECTOFFSETS]
+        self._large_offset_table_offset = self._chunks.get(CHUNK_LARGEOFFSETS)
+        self.pack_names = self._read_pack_names(
+            self._chunks[CHUNK_PACKNAMES], num_packs)
+
+    def _read_pack_names(self, offset, num_packs):
+        names = []
+        for i in range(num_packs):
+            end = self._contents.find(b'\0', offset)
+            names.append(bytes(self._contents[offset:end]))
+            offset = end + 1
+        return names
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._filename)
+
+    def close(self):
+        self._file.close()
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
+
+    def __len__(self):
+        """Return the number of objects in this multi-pack-index."""
+        return self._fan_out_table[-1]
+
+    def _unpack_name(self, i):
+        offset = self._name_table_offset + i * 20
+        return self._contents[offset:offset+20]
+
+    def _unpack_offset(self, i):
+        pack_id, offset = unpack_from(
+            '>LL', self._contents, self._offset_table_offset + i * 8)
+        if (self._large_offset_table_offset is not None and
+                offset & MIDX_LARGE_OFFSET_NEEDED):
+            offset = unpack_from(
+                '>Q', self._contents, self._large_offset_table_offset +
+                (offset & ~MIDX_LARGE_OFFSET_NEEDED) * 8)[0]
+        return pack_id, offset
+
+    def iterentries(self):
+        """Iterate over the entries in this multi-pack-index.
+
+        :return: iterator over tuples with object name, index of the pack
+            in pack_names and offset in that pack
+        """
+        for i in range(len(self)):
+            pack_id, offset = self._unpack_offset(i)
+            yield self._unpack_name(i), pack_id, offset
+
+    def __iter__(self):
+        """Iterate over the SHAs in this multi-pack-index."""
+        for i in range(len(self)):
+            yield bytes(self._unpack_name(i))
+
+    def object_offset(self, sha):
+        """Find the pack and offset of an object.
+
+        :param sha: SHA1 of the object, binary or hex
+        :return: Tuple with index of the pack in pack_names and offset of
+            the object in that pack
+        :raise KeyError: if the object is not in this multi-pack-index
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        assert len(sha) == 20
+        idx = ord(sha[:1])
+        if idx == 0:
+            start = 0
+        else:
+            start = self._fan_out_table[idx-1]
+        end = self._fan_out_table[idx]
+        if start < end:
+            i = bisect_find_sha(start, end - 1, sha, self._unpack_name)
+            if i is not None:
+                return self._unpack_offset(i)
+        raise KeyError(sha)
+
+    def __contains__(self, sha):
+        try:
+            self.object_offset(sha)
+        except KeyError:
+            return False
+        return True
+
+    def calculate_checksum(self):
+        """Calculate the SHA1 checksum over this multi-pack-index.
+
+        :return: 20-byte binary digest
+        """
+        return sha1(self._contents[:-20]).digest()
+
+    def get_stored_checksum(self):
+        """Return the SHA1 checksum stored for this multi-pack-index.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-20:])
+
+    def check(self):
+        """Check that the stored checksum matches the actual checksum."""
+        actual = self.calculate_checksum()
+        stored = self.get_stored_checksum()
+        if actual != stored:
+            raise ChecksumMismatch(stored, actual)
+
+
+def load_midx(path):
+    """Load a multi-pack-index file by path.
+
+    :param path: Path to the multi-pack-index file
+    :return: A MultiPackIndex
+    """
+    with GitFile(path, 'rb') as f:
+        contents, size = _load_file_contents(f)
+        return MultiPackIndex(path, file=f, contents=contents, size=size)
+
+
+def write_midx(f, packs):
+    """Write a multi-pack-index file.
+
+    When an object is present in more than one pack, the first of those
+    packs in the list is recorded for it.
+
+    :param f: File-like object to write to
+    :param packs: List of (name, entries) tuples, one per pack. name is the
+        file name of the pack index (e.g. b"pack-<sha>.idx"), entries an
+        iterable over (sha, offset, crc32) tuples as returned by
+        PackIndex.iterentries().
+    :return: The SHA of the written multi-pack-index
+    """
+    names = sorted(name for (name, entries) in packs)
+    pack_ids = dict((name, i) for (i, name) in enumerate(names))
+    objects = {}
+    for name, entries in packs:
+        pack_id = pack_ids[name]
+        for entry in entries:
+            sha = bytes(entry[0])
+            if sha not in objects:
+                objects[sha] = (pack_id, entry[1])
+    shas = sorted(objects)
+
+    large_offsets_needed = any(
+        offset > 0xffffffff for (pack_id, offset) in objects.values())
+
+    pack_names = b''.join(name + b'\0' for name in names)
+    if len(pack_names) % 4:
+        pack_names += b'\0' * (4 - len(pack_names) % 4)
+
+    fan_out_table = [0] * 0x100
+    for sha in shas:
+        fan_out_table[ord(sha[:1])] += 1
+    for i in range(1, 0x100):
+        fan_out_table[i] += fan_out_table[i-1]
+
+    object_offsets = []
+    large_offsets = []
+    for sha in shas:
+        pack_id, offset = objects[sha]
+        if large_offsets_needed and offset >= MIDX_LARGE_OFFSET_NEEDED:
+            object_offsets.append(struct.pack(
+                '>LL', pack_id, MIDX_LARGE_OFFSET_NEEDED | len(large_offsets)))
+            large_offsets.append(struct.pack('>Q', offset))
+        else:
+            object_offsets.append(struct.pack('>LL', pack_id, offset))
+
+    chunks = [
+        (CHUNK_PACKNAMES, [pack_names]),
+        (CHUNK_OIDFANOUT, [struct.pack('>256L', *fan_out_table)]),
+        (CHUNK_OIDLOOKUP, shas),
+        (CHUNK_OBJECTOFFSETS, object_offsets),
+        ]
+    if large_offsets:
+        chunks.append((CHUNK_LARGEOFFSETS, large_offsets))
+
+    f = SHA1Writer(f)
+    f.write(struct.pack('>4sBBBBL', MIDX_SIGNATURE, MIDX_VERSION,
+                        MIDX_HASH_VERSION_SHA1, len(chunks), 0, len(names)))
+    offset = _HEADER_SIZE + (len(chunks) + 1) * _CHUNK_ENTRY_SIZE
+    for chunk_id, data in chunks:
+        f.write(struct.pack('>4sQ', chunk_id, offset))
+        offset += sum(len(d) for d in data)
+    f.write(struct.pack('>4sQ', b'\0\0\0\0', offset))
+    for chunk_id, data in chunks:
+        for d in data:
+            f.write(d)
+    return f.write_sha()
@@ -23,20 +23,36 @@
 
 from io import BytesIO
 import errno
-from itertools import chain
+from itertools import (
+    chain,
+    islice,
+    )
 import os
 import stat
 import sys
 import tempfile
+import time
 
+from dulwich.bitmap import (
+    find_missing_objects_by_bitmap,
+    )
+from dulwich.commit_graph import (
+    COMMIT_GRAPH_FILENAME,
+    load_commit_graph,
+    write_commit_graph,
+    )
 from dulwich.diff_tree import (
     tree_changes,
     walk_trees,
     )
 from dulwich.errors import (
+    ChecksumMismatch,
     NotTreeError,
     )
 from dulwich.file import GitFile
+from dulwich.graph import (
+    Reachability,
+    )
 from dulwich.objects import (
     Commit,
     ShaFile,
@@ -49,7 +65,14 @@ from dulwich.objects import (
     S_ISGITLINK,
     object_class,
     )
+from dulwich.midx import (
+    MIDX_FILENAME,
+    load_midx,
+    write_midx,
+    )
 from dulwich.pack import (
+    REF_DELTA,
+    DeltaBaseCache,
     Pack,
     PackData,
     PackInflater,
@@ -59,21 +82,25 @@ from dulwich.pack import (
     write_pack_object,
     write_pack_objects,
     compute_file_sha,
-    PackIndexer,
+    StreamingPackIndexer,
     PackStreamCopier,
     )
 
 INFODIR = 'info'
 PACKDIR = 'pack'
 
+# Seconds for which a negative lookup cache trusts its misses
+DEFAULT_NEGATIVE_CACHE_TTL = 5
+
 
 class BaseObjectStore(object):
     """Object store interface."""
 
     def determine_wants_all(self, refs):
-        return [sha for (ref, sha) in refs.items()
-                if not sha in self and not ref.endswith(b"^{}") and
-                   not sha == ZERO_SHA]
+        shas = [sha for (ref, sha) in refs.items()
+                if not ref.endswith(b"^{}") and not sha == ZERO_SHA]
+        return [sha for (sha, present) in zip(shas, self.contains_many(shas))
+                if not present]
 
     def iter_shas(self, shas):
         """Iterate over the objects for the specified shas.
@@ -98,6 +125,14 @@ class BaseObjectStore(object):
         """
         return self.contains_packed(sha) or self.contains_loose(sha)
 
+    def contains_many(self, shas):
+        """Check which of several objects are present.
+
+        :param shas: Sequence of SHA1s
+        :return: List of booleans, one for each object in shas
+        """
+        return [sha in self for sha in shas]
+
     @property
     def packs(self):
         """Iterable of pack objects."""
@@ -111,6 +146,50 @@ class BaseObjectStore(object):
         """
         raise NotImplementedError(self.get_raw)
 
+    def get_raw_many(self, shas):
+        """Obtain the raw text for several objects.
+
+        Stores may return the objects in a different order than they were
+        requested in, if that is cheaper for them.
+
+        :param shas: Iterable over SHA1s of the objects
+        :return: Iterator over (sha, type_num, raw) tuples
+        :raise KeyError: if one of the objects is not present
+        """
+        for sha in shas:
+            type_num, raw = self.get_raw(sha)
+            yield sha, type_num, raw
+
+    def get_unpacked_object(self, sha, include_comp=False):
+        """Get an object as it is stored in a pack, without resolving deltas.
+
+        :param sha: SHA1 of the object
+        :param include_comp: Whether to include the compressed data
+        :return: UnpackedObject, with the base of deltas given by SHA
+        :raise KeyError: if the object is not stored in a pack
+        """
+        raise KeyError(sha)
+
+    def get_compressed_object(self, sha):
+        """Get an object as it is stored in a pack, without inflating it.
+
+        :param sha: SHA1 of the object
+        :return: UnpackedObject with comp_chunks and crc32 set, and the
+            base of deltas given by SHA
+        :raise KeyError: if the object is not stored in a pack
+        """
+        raise KeyError(sha)
+
+    def get_object_header(self, sha):
+        """Get the type and delta base of an object as it is stored in a pack.
+
+        :param sha: SHA1 of the object
+        :return: UnpackedObject with at least pack_type_num and delta_base
+            set, with the base of deltas given by SHA
+        :raise KeyError: if the object is not stored in a pack
+        """
+        return self.get_unpacked_object(sha)
+
     def __getitem__(self, sha):
         """Obtain an object by SHA1."""
         type_num, uncomp = self.get_raw(sha)
@@ -163,8 +242,7 @@ class BaseObjectStore(object):
                 yield entry
 
     def find_missing_objects(self, haves, wants, progress=None,
-                             get_tagged=None,
-                             get_parents=lambda commit: commit.parents):
+                             get_tagged=None, get_parents=None):
         """Find the missing objects required for a set of revisions.
 
         :param haves: Iterable over SHAs already in common.
@@ -218,18 +296,23 @@ class BaseObjectStore(object):
             obj = self[sha]
         return obj
 
-    def _collect_ancestors(self, heads, common=set(),
-                           get_parents=lambda commit: commit.parents):
+    def _collect_ancestors(self, heads, common=set(), get_parents=None):
         """Collect all ancestors of heads up to (excluding) those in common.
 
         :param heads: commits to start from
         :param common: commits to end at, or empty set to walk repository
             completely
-        :param get_parents: Optional function for getting the parents of a commit.
+        :param get_parents: Optional function for getting the parents of a
+            commit; by default the parents recorded in the commit are used,
+            read from the commit-graph where possible.
         :return: a tuple (A, B) where A - all commits reachable
             from heads but not present in common, B - common (shared) elements
             that are directly reachable from heads
         """
+        if get_parents is None:
+            get_commit_parents = self.get_commit_parents
+        else:
+            get_commit_parents = lambda sha: get_parents(self[sha])
         bases = set()
         commits = set()
         queue = []
@@ -240,10 +323,51 @@ class BaseObjectStore(object):
                 bases.add(e)
             elif e not in commits:
                 commits.add(e)
-                cmt = self[e]
-                queue.extend(get_parents(cmt))
+                queue.extend(get_commit_parents(e))
         return (commits, bases)
 
+    def get_commit_graph(self):
+        """Return the commit-graph for the commits in this object store.
+
+        :return: A CommitGraph, or None if there is none
+        """
+        return None
+
+    def get_commit_parents(self, sha):
+        """Return the parents of a commit, as recorded in the commit.
+
+        The commit-graph is used if it has the commit, so that the commit
+        does not have to be read and parsed.
+
+        :param sha: SHA1 of the commit
+        :return: List of hex SHAs of the parents
+        :raise KeyError: if the commit is not present
+        """
+        graph = self.get_commit_graph()
+        if graph is not None:
+            try:
+                return graph.get_parents(sha)
+            except KeyError:
+                pass
+        return self[sha].parents
+
+    def get_commit_time(self, sha):
+        """Return the commit time of a commit.
+
+        The commit-graph is used if it has the commit, so that the commit
+        does not have to be read and parsed.
+
+        :param sha: SHA1 of the commit
+        :raise KeyError: if the commit is not present
+        """
+        graph = self.get_commit_graph()
+        if graph is not None:
+            try:
+                return graph.get_commit_time(sha)
+            except KeyError:
+                pass
+        return self[sha].commit_time
+
     def close(self):
         """Close any files opened by this object store."""
         # Default implementation is a NO-OP
@@ -251,8 +375,42 @@ class BaseObjectStore(object):
 
 class PackBasedObjectStore(BaseObjectStore):
 
-    def __init__(self):
+    def __init__(self, negative_cache_size=None,
+                 negative_cache_ttl=DEFAULT_NEGATIVE_CACHE_TTL):
+        """Create a PackBasedObjectStore.
+
+        :param negative_cache_size: If set, remember up to this many SHAs
+            that were looked up but are not present, so that repeated
+            lookups for them are answered without touching disk. The cache
+            is invalidated when this store adds objects or packs, or finds
+            new packs when it reloads its packs.
+        :param negative_cache_ttl: Number of seconds for which cached misses
+            are trusted, after which the cache is dropped so that objects
+            added by other processes are noticed, or None to keep them
+            until the cache is invalidated
+        """
         self._pack_cache = {}
+        # Hex SHAs known not to be present, or None if disabled, and the
+        # time at which the first of them was added
+        self._negative_cache_size = negative_cache_size
+        self._negative_cache_ttl = negative_cache_ttl
+        if negative_cache_size:
+            self._missing_shas = set()
+        else:
+            self._missing_shas = None
+        self._missing_since = None
+        # Packs in _pack_cache, most recently used first, and the lookup
+        # statistics for each of them, keyed by id().
+        self._mru_packs = []
+        self._pack_order_stale = False
+        self._pack_stats = {}
+        # Optional multi-pack-index, with the pack for each of its pack
+        # names (None if not present) and the ids of all those packs.
+        self._midx = None
+        self._midx_packs = []
+        self._midx_pack_ids = set()
+        # Resolved delta bases, shared by all packs in this store.
+        self.delta_base_cache = DeltaBaseCache()
 
     @property
     def alternates(self):
@@ -263,23 +421,176 @@ class PackBasedObjectStore(BaseObjectStore):
 
         This does not check alternates.
         """
-        for pack in self.packs:
+        return self._find_pack(sha) is not None
+
+    def _find_pack(self, sha):
+        """Find the pack that contains a particular object.
+
+        If there is a multi-pack-index, it is consulted first. The packs it
+        does not cover are then tried in most recently used order, and the
+        pack that contains the object is moved to the front.
+
+        :param sha: SHA1 of the object
+        :return: The Pack containing the object, or None
+        """
+        packs = self.packs
+        if self._midx is not None:
+            try:
+                pack_id, offset = self._midx.object_offset(sha)
+            except KeyError:
+                pass
+            else:
+                pack = self._midx_packs[pack_id]
+                if pack is not None:
+                    self._pack_stats.setdefault(id(pack), [0, 0])[0] += 1
+                    return pack
+        for i, pack in enumerate(packs):
+            if id(pack) in self._midx_pack_ids:
+                continue
+            stats = self._pack_stats.setdefault(id(pack), [0, 0])
             if sha in pack:
-                return True
-        return False
+                stats[0] += 1
+                if i > 0:
+                    self._mru_packs = [pack] + packs[:i] + packs[i+1:]
+                return pack
+            stats[1] += 1
+        return None
+
+    def _ordered_packs(self):
+        """Return the packs in the pack cache, most recently used first.
+
+        Packs that were added since the last call come first.
+        """
+        if self._pack_order_stale:
+            live = set(id(pack) for pack in self._pack_cache.values())
+            order = [pack for pack in self._mru_packs if id(pack) in live]
+            known = set(id(pack) for pack in order)
+            self._mru_packs = [
+                pack for pack in self._pack_cache.values()
+                if id(pack) not in known] + order
+            for key in set(self._pack_stats) - live:
+                del self._pack_stats[key]
+            if self._midx is not None:
+                self._midx_packs = [
+                    self._pack_cache.get(self._midx_pack_key(name))
+                    for name in self._midx.pack_names]
+            else:
+                self._midx_packs = []
+            self._midx_pack_ids = set(
+                id(pack) for pack in self._midx_packs if pack is not None)
+            self._pack_order_stale = False
+        return self._mru_packs
+
+    def _midx_pack_key(self, name):
+        """Return the pack cache key for a pack in the multi-pack-index.
+
+        :param name: Name of the pack index, as stored in the
+            multi-pack-index
+        """
+        raise NotImplementedError(self._midx_pack_key)
+
+    def pack_stats(self):
+        """Return lookup statistics for the packs in this store.
+
+        A large number of packs with few hits and many misses is a sign
+        that the store should be repacked.
+
+        :return: List of (pack, hits, misses) tuples, most recently used
+            pack first. Hits count the lookups a pack answered, misses the
+            lookups that searched it without finding the object.
+        """
+        ret = []
+        for pack in self.packs:
+            hits, misses = self._pack_stats.get(id(pack), (0, 0))
+            ret.append((pack, hits, misses))
+        return ret
 
     def __contains__(self, sha):
         """Check if a particular object is present by SHA1.
 
         This method makes no distinction between loose and packed objects.
         """
+        if self._missing_shas is not None:
+            if len(sha) == 20:
+                hexsha = sha_to_hex(sha)
+            else:
+                hexsha = sha
+            if self._is_missing(hexsha):
+                return False
         if self.contains_packed(sha) or self.contains_loose(sha):
             return True
         for alternate in self.alternates:
             if sha in alternate:
                 return True
+        if self._missing_shas is not None:
+            self._add_missing(hexsha)
         return False
 
+    def contains_many(self, shas):
+        """Check which of several objects are present.
+
+        Each pack index is searched once, for all of the objects that were
+        not found in the packs before it. The remaining objects are then
+        looked for as loose objects and in the alternates.
+
+        :param shas: Sequence of SHA1s
+        :return: List of booleans, one for each object in shas
+        """
+        ret = [False] * len(shas)
+        pending = list(range(len(shas)))
+        for pack in self.packs:
+            if not pending:
+                break
+            found = pack.contains_many([shas[i] for i in pending])
+            remaining = []
+            for i, present in zip(pending, found):
+                if present:
+                    ret[i] = True
+                else:
+                    remaining.append(i)
+            pending = remaining
+        for i in pending:
+            sha = shas[i]
+            if self.contains_loose(sha):
+                ret[i] = True
+            else:
+                ret[i] = any(sha in alternate for alternate in self.alternates)
+        return ret
+
+    def _is_missing(self, hexsha):
+        """Check whether the negative lookup cache has an object as missing.
+
+        This does not touch disk. Once the cache is older than the negative
+        cache TTL it is dropped, and the object is looked for again.
+        """
+        if hexsha not in self._missing_shas:
+            return False
+        if (self._negative_cache_ttl is not None and
+                time.time() - self._missing_since > self._negative_cache_ttl):
+            self._missing_shas.clear()
+            return False
+        return True
+
+    def _add_missing(self, hexsha):
+        """Record that an object is not present in this store."""
+        if len(self._missing_shas) >= self._negative_cache_size:
+            self._missing_shas.clear()
+        if not self._missing_shas:
+            self._missing_since = time.time()
+        self._missing_shas.add(hexsha)
+
+    def _invalidate_missing(self, hexsha=None):
+        """Invalidate the negative lookup cache.
+
+        :param hexsha: Hex SHA of the object that was added, or None if
+            any object may have been added
+        """
+        if self._missing_shas is not None:
+            if hexsha is None:
+                self._missing_shas.clear()
+            else:
+                self._missing_shas.discard(hexsha)
+
     def _pack_cache_stale(self):
         """Check whether the pack cache is stale."""
         raise NotImplementedError(self._pack_cache_stale)
@@ -289,21 +600,27 @@ class PackBasedObjectStore(BaseObjectStore):
 
         """
         self._pack_cache[base_name] = pack
+        self._pack_order_stale = True
+        self._invalidate_missing()
 
     def close(self):
+        if self._midx is not None:
+            self._midx.close()
+            self._midx = None
         pack_cache = self._pack_cache
         self._pack_cache = {}
+        self._pack_order_stale = True
         while pack_cache:
             (name, pack) = pack_cache.popitem()
             pack.close()
 
     @property
     def packs(self):
-        """List with pack objects."""
+        """List with pack objects, most recently used first."""
         if self._pack_cache is None or self._pack_cache_stale():
             self._update_pack_cache()
 
-        return self._pack_cache.values()
+        return self._ordered_packs()
 
     def _iter_alternate_objects(self):
         """Iterate over the SHAs of all the objects in alternate stores."""
@@ -321,15 +638,27 @@ class PackBasedObjectStore(BaseObjectStore):
     def _remove_loose_object(self, sha):
         raise NotImplementedError(self._remove_loose_object)
 
-    def pack_loose_objects(self):
+    def pack_loose_objects(self, pack_options=None, write_bitmap=False):
         """Pack loose objects.
 
+        :param pack_options: Optional dict with keyword arguments for
+            write_pack_objects, e.g. from pack_write_options()
+        :param write_bitmap: Whether to write a bitmap index for the new
+            pack. This is only done if the pack holds every object that is
+            reachable from the commits in it, as when no objects were
+            packed before.
         :return: Number of objects packed
         """
         objects = set()
         for sha in self._iter_loose_objects():
             objects.add((self._get_loose_object(sha), None))
-        self.add_objects(list(objects))
+        pack = self.add_objects(list(objects), pack_options=pack_options)
+        if write_bitmap and pack is not None:
+            try:
+                pack.write_bitmap()
+            except ValueError:
+                # Some history of the new pack is in other packs.
+                pass
         for obj, path in objects:
             self._remove_loose_object(obj.id)
         return len(objects)
@@ -360,11 +689,14 @@ class PackBasedObjectStore(BaseObjectStore):
             hexsha = None
         else:
             raise AssertionError("Invalid object name %r" % name)
-        for pack in self.packs:
-            try:
-                return pack.get_raw(sha)
-            except KeyError:
-                pass
+        if self._missing_shas is not None:
+            if hexsha is None:
+                hexsha = sha_to_hex(name)
+            if self._is_missing(hexsha):
+                raise KeyError(hexsha)
+        pack = self._find_pack(sha)
+        if pack is not None:
+            return pack.get_raw(sha)
         if hexsha is None:
             hexsha = sha_to_hex(name)
         ret = self._get_loose_object(hexsha)
@@ -375,12 +707,139 @@ class PackBasedObjectStore(BaseObjectStore):
                 return alternate.get_raw(hexsha)
             except KeyError:
                 pass
+        if self._missing_shas is not None:
+            self._add_missing(hexsha)
         raise KeyError(hexsha)
 
-    def add_objects(self, objects):
+    def get_unpacked_object(self, sha, include_comp=False):
+        """Get an object as it is stored in a pack, without resolving deltas.
+
+        :param sha: SHA1 of the object
+        :param include_comp: Whether to include the compressed data, which
+            is checked against the CRC32 in the pack index
+        :return: UnpackedObject, with the base of deltas given by SHA
+        :raise KeyError: if the object is not stored in a pack
+        :raise ChecksumMismatch: if the CRC32 of the object is wrong
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        pack = self._find_pack(sha)
+        if pack is None:
+            raise KeyError(sha_to_hex(sha))
+        return pack.get_unpacked_object(sha, include_comp=include_comp)
+
+    def _bitmap_pack(self):
+        """Return the largest pack that has a bitmap index, or None."""
+        ret = None
+        for pack in self.packs:
+            if pack.bitmap is not None and (ret is None or
+                                            len(pack) > len(ret)):
+                ret = pack
+        return ret
+
+    def find_missing_objects(self, haves, wants, progress=None,
+                             get_tagged=None, get_parents=None):
+        """Find the missing objects required for a set of revisions.
+
+        If one of the packs has a bitmap index and no get_parents function is
+        specified, the bitmap index is used to avoid walking most of the
+        history.
+
+        :param haves: Iterable over SHAs already in common.
+        :param wants: Iterable over SHAs of objects to fetch.
+        :param progress: Simple progress function that will be called with
+            updated progress strings.
+        :param get_tagged: Function that returns a dict of pointed-to sha -> tag
+            sha for including tags.
+        :param get_parents: Optional function for getting the parents of a commit.
+        :return: Iterator over (sha, path) pairs.
+        """
+        if get_parents is None:
+            pack = self._bitmap_pack()
+            if pack is not None:
+                return iter(find_missing_objects_by_bitmap(
+                    self, pack, haves, wants, get_tagged=get_tagged,
+                    progress=progress))
+        return super(PackBasedObjectStore, self).find_missing_objects(
+            haves, wants, progress, get_tagged, get_parents=get_parents)
+
+    def get_compressed_object(self, sha):
+        """Get an object as it is stored in a pack, without inflating it.
+
+        :param sha: SHA1 of the object
+        :return: UnpackedObject with comp_chunks and crc32 set, and the
+            base of deltas given by SHA
+        :raise KeyError: if the object is not stored in a pack
+        :raise ChecksumMismatch: if the CRC32 of the object is wrong
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        pack = self._find_pack(sha)
+        if pack is None:
+            raise KeyError(sha_to_hex(sha))
+        return pack.get_compressed_object(sha)
+
+    def get_object_header(self, sha):
+        """Get the type and delta base of an object as it is stored in a pack.
+
+        Only the header of the object is read; nothing is inflated.
+
+        :param sha: SHA1 of the object
+        :return: UnpackedObject with pack_type_num, delta_base and decomp_len
+            set, with the base of deltas given by SHA
+        :raise KeyError: if the object is not stored in a pack
+        """
+        if len(sha) == 40:
+            sha = hex_to_sha(sha)
+        pack = self._find_pack(sha)
+        if pack is None:
+            raise KeyError(sha_to_hex(sha))
+        return pack.get_object_header(sha)
+
+    def get_raw_many(self, shas):
+        """Obtain the raw text for several objects.
+
+        Packed objects are grouped by pack and read in pack order, so that
+        delta bases are shared between the objects in the batch. They are
+        followed by loose objects and objects from alternates.
+
+        :param shas: Iterable over SHA1s of the objects
+        :return: Iterator over (sha, type_num, raw) tuples
+        :raise KeyError: if one of the objects is not present
+        """
+        by_pack = []
+        pack_names = {}
+        rest = []
+        for name in shas:
+            if len(name) == 40:
+                sha = hex_to_sha(name)
+            elif len(name) == 20:
+                sha = name
+            else:
+                raise AssertionError("Invalid object name %r" % name)
+            pack = self._find_pack(sha)
+            if pack is None:
+                rest.append(name)
+                continue
+            try:
+                names = pack_names[id(pack)]
+            except KeyError:
+                names = pack_names[id(pack)] = []
+                by_pack.append((pack, names))
+            names.append(name)
+        for pack, names in by_pack:
+            for ret in pack.get_raw_many(names):
+                yield ret
+        for name in rest:
+            type_num, raw = self.get_raw(name)
+            yield name, type_num, raw
+
+    def add_objects(self, objects, pack_options=None):
         """Add a set of objects to this object store.
 
         :param objects: Iterable over objects, should support __len__.
+        :param pack_options: Optional dict with keyword arguments for
+            write_pack_objects, e.g. from pack_write_options()
         :return: Pack object of the objects written.
         """
         if len(objects) == 0:
@@ -388,7 +847,7 @@ class PackBasedObjectStore(BaseObjectStore):
             return
         f, commit, abort = self.add_pack()
         try:
-            write_pack_objects(f, objects)
+            write_pack_objects(f, objects, **(pack_options or {}))
         except:
             abort()
             raise
@@ -399,17 +858,29 @@ class PackBasedObjectStore(BaseObjectStore):
 class DiskObjectStore(PackBasedObjectStore):
     """Git-style object store that exists on disk."""
 
-    def __init__(self, path):
+    def __init__(self, path, use_mmap=False, negative_cache_size=None,
+                 negative_cache_ttl=DEFAULT_NEGATIVE_CACHE_TTL):
         """Open an object store.
 
         :param path: Path of the object store.
+        :param use_mmap: Whether to map pack files into memory and read
+            objects straight from the mapping.
+        :param negative_cache_size: Number of missing SHAs to remember, see
+            PackBasedObjectStore.
+        :param negative_cache_ttl: Seconds for which missing SHAs are
+            remembered, see PackBasedObjectStore.
         """
-        super(DiskObjectStore, self).__init__()
+        super(DiskObjectStore, self).__init__(
+            negative_cache_size=negative_cache_size,
+            negative_cache_ttl=negative_cache_ttl)
         self.path = path
+        self.use_mmap = use_mmap
         self.pack_dir = os.path.join(self.path, PACKDIR)
         self._pack_cache_time = 0
         self._pack_cache = {}
         self._alternates = None
+        self._commit_graph = None
+        self._commit_graph_loaded = False
 
     def __repr__(self):
         return "<%s(%r)>" % (self.__class__.__name__, self.path)
@@ -420,7 +891,8 @@ class DiskObjectStore(PackBasedObjectStore):
             return self._alternates
         self._alternates = []
         for path in self._read_alternate_paths():
-            self._alternates.append(DiskObjectStore(path))
+            self._alternates.append(
+                DiskObjectStore(path, use_mmap=self.use_mmap))
         return self._alternates
 
     def _read_alternate_paths(self):
@@ -463,7 +935,8 @@ class DiskObjectStore(PackBasedObjectStore):
 
         if not os.path.isabs(path):
             path = os.path.join(self.path, path)
-        self.alternates.append(DiskObjectStore(path))
+        self.alternates.append(DiskObjectStore(path, use_mmap=self.use_mmap))
+        self._invalidate_missing()
 
     def _update_pack_cache(self):
         try:
@@ -485,10 +958,104 @@ class DiskObjectStore(PackBasedObjectStore):
         # Open newly appeared pack files
         for f in pack_files:
             if f not in self._pack_cache:
-                self._pack_cache[f] = Pack(os.path.join(self.pack_dir, f))
+                self._pack_cache[f] = Pack(
+                    os.path.join(self.pack_dir, f), use_mmap=self.use_mmap,
+                    delta_base_cache=self.delta_base_cache)
+                self._pack_order_stale = True
+                self._invalidate_missing()
         # Remove disappeared pack files
         for f in set(self._pack_cache) - pack_files:
             self._pack_cache.pop(f).close()
+            self._pack_order_stale = True
+        self._load_midx()
+
+    def _load_midx(self):
+        """(Re)load the multi-pack-index, if there is one."""
+        if self._midx is not None:
+            self._midx.close()
+            self._midx = None
+        try:
+            self._midx = load_midx(os.path.join(self.pack_dir, MIDX_FILENAME))
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self._pack_order_stale = True
+
+    def _midx_pack_key(self, name):
+        return name[:-len(b".idx")].decode(sys.getfilesystemencoding())
+
+    def write_multi_pack_index(self):
+        """Write a multi-pack-index for all packs in this object store.
+
+        Newer packs take precedence for objects that are present in more
+        than one pack.
+
+        :return: The SHA of the written multi-pack-index
+        """
+        if self._pack_cache_stale():
+            self._update_pack_cache()
+        packs = []
+        for name, pack in self._pack_cache.items():
+            mtime = os.stat(os.path.join(self.pack_dir, name + ".pack")).st_mtime
+            packs.append((mtime, name, pack))
+        packs.sort(reverse=True)
+        path = os.path.join(self.pack_dir, MIDX_FILENAME)
+        with GitFile(path, 'wb') as f:
+            sha = write_midx(f, [
+                ((name + ".idx").encode(sys.getfilesystemencoding()),
+                 pack.index.iterentries())
+                for (mtime, name, pack) in packs])
+        self._load_midx()
+        return sha
+
+    def get_commit_graph(self):
+        """Return the commit-graph in objects/info, if there is one."""
+        if not self._commit_graph_loaded:
+            try:
+                self._commit_graph = load_commit_graph(
+                    os.path.join(self.path, INFODIR, COMMIT_GRAPH_FILENAME))
+            except (OSError, IOError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            self._commit_graph_loaded = True
+        return self._commit_graph
+
+    def write_commit_graph(self, heads):
+        """Write a commit-graph for the commits reachable from heads.
+
+        :param heads: SHA1s of the commits to start from; tags are peeled,
+            other objects are ignored
+        :return: The SHA of the written commit-graph
+        """
+        commits = {}
+        todo = []
+        for sha in heads:
+            obj = self.peel_sha(sha)
+            if isinstance(obj, Commit):
+                todo.append(obj)
+        while todo:
+            commit = todo.pop()
+            sha = hex_to_sha(commit.id)
+            if sha in commits:
+                continue
+            commits[sha] = commit
+            todo.extend(self[p] for p in commit.parents
+                        if hex_to_sha(p) not in commits)
+        path = os.path.join(self.path, INFODIR, COMMIT_GRAPH_FILENAME)
+        with GitFile(path, 'wb') as f:
+            sha = write_commit_graph(f, commits.values())
+        if self._commit_graph is not None:
+            self._commit_graph.close()
+        self._commit_graph = None
+        self._commit_graph_loaded = False
+        return sha
+
+    def close(self):
+        if self._commit_graph is not None:
+            self._commit_graph.close()
+            self._commit_graph = None
+        self._commit_graph_loaded = False
+        super(DiskObjectStore, self).close()
 
     def _pack_cache_stale(self):
         try:
@@ -536,32 +1103,39 @@ class DiskObjectStore(PackBasedObjectStore):
         :param f: Open file object for the pack.
         :param path: Path to the pack file.
         :param copier: A PackStreamCopier to use for writing pack data.
-        :param indexer: A PackIndexer for indexing the pack.
+        :param indexer: A StreamingPackIndexer for indexing the pack.
         """
         entries = list(indexer)
 
-        # Update the header with the new number of objects.
-        f.seek(0)
-        write_pack_header(f, len(entries) + len(indexer.ext_refs()))
-
-        # Must flush before reading (http://bugs.python.org/issue3207)
-        f.flush()
-
-        # Rescan the rest of the pack, computing the SHA with the new header.
-        new_sha = compute_file_sha(f, end_ofs=-20)
-
-        # Must reposition before writing (http://bugs.python.org/issue3207)
-        f.seek(0, os.SEEK_CUR)
-
-        # Complete the pack.
-        for ext_sha in indexer.ext_refs():
-            assert len(ext_sha) == 20
-            type_num, data = self.get_raw(ext_sha)
-            offset = f.tell()
-            crc32 = write_pack_object(f, type_num, data, sha=new_sha)
-            entries.append((ext_sha, offset, crc32))
-        pack_sha = new_sha.digest()
-        f.write(pack_sha)
+        if indexer.ext_refs():
+            # Update the header with the new number of objects.
+            f.seek(0)
+            write_pack_header(f, len(entries) + len(indexer.ext_refs()))
+
+            # Must flush before reading (http://bugs.python.org/issue3207)
+            f.flush()
+
+            # Rescan the rest of the pack, computing the SHA with the new
+            # header.
+            new_sha = compute_file_sha(f, end_ofs=-20)
+
+            # Must reposition before writing
+            # (http://bugs.python.org/issue3207)
+            f.seek(0, os.SEEK_CUR)
+
+            # Complete the pack.
+            for ext_sha in indexer.ext_refs():
+                assert len(ext_sha) == 20
+                type_num, data = self.get_raw(ext_sha)
+                offset = f.tell()
+                crc32 = write_pack_object(f, type_num, data, sha=new_sha)
+                entries.append((ext_sha, offset, crc32))
+            pack_sha = new_sha.digest()
+            f.write(pack_sha)
+        else:
+            # Nothing to add; the pack and its checksum are complete as
+            # received.
+            pack_sha = copier.sha.digest()
         f.close()
 
         # Move the pack in.
@@ -585,7 +1159,8 @@ class DiskObjectStore(PackBasedObjectStore):
             index_file.abort()
 
         # Add the pack to the store and return it.
-        final_pack = Pack(pack_base_name)
+        final_pack = Pack(pack_base_name, use_mmap=self.use_mmap,
+                          delta_base_cache=self.delta_base_cache)
         final_pack.check_length_and_checksum()
         self._add_known_pack(pack_base_name, final_pack)
         return final_pack
@@ -606,7 +1181,7 @@ class DiskObjectStore(PackBasedObjectStore):
         """
         fd, path = tempfile.mkstemp(dir=self.path, prefix='tmp_pack_')
         with os.fdopen(fd, 'w+b') as f:
-            indexer = PackIndexer(f, resolve_ext_ref=self.get_raw)
+            indexer = StreamingPackIndexer(f, resolve_ext_ref=self.get_raw)
             copier = PackStreamCopier(read_all, read_some, f,
                                       delta_iter=indexer)
             copier.verify()
@@ -626,7 +1201,8 @@ class DiskObjectStore(PackBasedObjectStore):
             with GitFile(basename+".idx", "wb") as f:
                 write_pack_index_v2(f, entries, p.get_stored_checksum())
         os.rename(path, basename + ".pack")
-        final_pack = Pack(basename)
+        final_pack = Pack(basename, use_mmap=self.use_mmap,
+                          delta_base_cache=self.delta_base_cache)
         self._add_known_pack(basename, final_pack)
         return final_pack
 
@@ -657,6 +1233,7 @@ class DiskObjectStore(PackBasedObjectStore):
 
         :param obj: Object to add
         """
+        self._invalidate_missing(obj.id)
         path = self._get_shafile_path(obj.id)
         dir = os.path.dirname(path)
         try:
@@ -767,9 +1344,12 @@ class MemoryObjectStore(BaseObjectStore):
         """Complete a thin pack by adding external references.
 
         :param f: Open file object for the pack.
-        :param indexer: A PackIndexer for indexing the pack.
+        :param indexer: A StreamingPackIndexer for indexing the pack.
         """
         entries = list(indexer)
+        if not indexer.ext_refs():
+            # Nothing to add; the pack is complete as received.
+            return
 
         # Update the header with the new number of objects.
         f.seek(0)
@@ -800,7 +1380,7 @@ class MemoryObjectStore(BaseObjectStore):
         """
         f, commit, abort = self.add_pack()
         try:
-            indexer = PackIndexer(f, resolve_ext_ref=self.get_raw)
+            indexer = StreamingPackIndexer(f, resolve_ext_ref=self.get_raw)
             copier = PackStreamCopier(read_all, read_some, f, delta_iter=indexer)
             copier.verify()
             self._complete_thin_pack(f, indexer)
@@ -840,6 +1420,9 @@ class ObjectIterator(object):
 class ObjectStoreIterator(ObjectIterator):
     """ObjectIterator that works on top of an ObjectStore."""
 
+    # Number of objects to retrieve from the store at once
+    batch_size = 1000
+
     def __init__(self, store, sha_iter):
         """Create a new ObjectIterator.
 
@@ -851,15 +1434,79 @@ class ObjectStoreIterator(ObjectIterator):
         self._shas = []
 
     def __iter__(self):
-        """Yield tuple with next object and path."""
-        for sha, path in self.itershas():
-            yield self.store[sha], path
+        """Yield tuple with next object and path.
+
+        Objects are retrieved from the store in batches, and within a batch
+        they are yielded in the order the store returns them in.
+        """
+        shas = self.itershas()
+        while True:
+            batch = list(islice(shas, self.batch_size))
+            if not batch:
+                break
+            paths = {}
+            for sha, path in batch:
+                paths.setdefault(sha, []).append(path)
+            for sha, type_num, raw in self.store.get_raw_many(list(paths)):
+                for path in paths[sha]:
+                    yield ShaFile.from_raw_string(type_num, raw, sha=sha), path
 
     def iterobjects(self):
         """Iterate over just the objects."""
         for o, path in self:
             yield o
 
+    def iterrecords(self):
+        """Iterate over records for write_pack_data.
+
+        Objects that the store has packed are copied from their pack as they
+        are stored, without inflating and deflating them again. A delta is
+        only copied if its base has already been written, so the result is
+        never a thin pack; other objects are written whole. Within a batch,
+        packed objects are yielded in pack order, so bases tend to come
+        before the deltas against them.
+
+        :return: Iterator over (type_num, sha, delta_base, raw) tuples, with
+            one tuple per item yielded by __iter__
+        """
+        written = set()
+        shas = self.itershas()
+        while True:
+            batch = list(islice(shas, self.batch_size))
+            if not batch:
+                break
+            paths = {}
+            for sha, path in batch:
+                paths.setdefault(sha, []).append(path)
+            packed = []
+            rest = []
+            for sha in paths:
+                try:
+                    unpacked = self.store.get_compressed_object(sha)
+                except (KeyError, ChecksumMismatch):
+                    rest.append(sha)
+                else:
+                    packed.append((unpacked.offset, sha, unpacked))
+            packed.sort(key=lambda entry: entry[0])
+            for offset, sha, unpacked in packed:
+                bin_sha = sha if len(sha) == 20 else hex_to_sha(sha)
+                if unpacked.pack_type_num != REF_DELTA:
+                    record = (unpacked.pack_type_num, bin_sha, None, unpacked)
+                elif unpacked.delta_base in written:
+                    record = (REF_DELTA, bin_sha, unpacked.delta_base,
+                              unpacked)
+                else:
+                    type_num, raw = self.store.get_raw(sha)
+                    record = (type_num, bin_sha, None, raw)
+                written.add(bin_sha)
+                for path in paths[sha]:
+                    yield record
+            for sha, type_num, raw in self.store.get_raw_many(rest):
+                bin_sha = sha if len(sha) == 20 else hex_to_sha(sha)
+                written.add(bin_sha)
+                for path in paths[sha]:
+                    yield type_num, bin_sha, None, raw
+
     def itershas(self):
         """Iterate over the SHAs."""
         for sha in self._shas:
@@ -914,12 +1561,17 @@ def _collect_filetree_revs(obj_store, tree_sha, kset):
     :param tree_sha: tree reference to walk
     :param kset: set to fill with references to files and directories
     """
-    filetree = obj_store[tree_sha]
-    for name, mode, sha in filetree.iteritems():
-        if not S_ISGITLINK(mode) and sha not in kset:
-            kset.add(sha)
-            if stat.S_ISDIR(mode):
-                _collect_filetree_revs(obj_store, sha, kset)
+    todo = [tree_sha]
+    while todo:
+        subtrees = []
+        for tree_sha, type_num, raw in obj_store.get_raw_many(todo):
+            filetree = ShaFile.from_raw_string(type_num, raw, sha=tree_sha)
+            for name, mode, sha in filetree.iteritems():
+                if not S_ISGITLINK(mode) and sha not in kset:
+                    kset.add(sha)
+                    if stat.S_ISDIR(mode):
+                        subtrees.append(sha)
+        todo = subtrees
 
 
 def _split_commits_and_tags(obj_store, lst, ignore_unknown=False):
@@ -976,7 +1628,7 @@ class MissingObjectFinder(object):
     """
 
     def __init__(self, object_store, haves, wants, progress=None,
-                 get_tagged=None, get_parents=lambda commit: commit.parents):
+                 get_tagged=None, get_parents=None):
         self.object_store = object_store
         self._get_parents = get_parents
         # process Commits and Tags differently
@@ -988,15 +1640,23 @@ class MissingObjectFinder(object):
             _split_commits_and_tags(object_store, haves, True))
         want_commits, want_tags, want_others = (
             _split_commits_and_tags(object_store, wants, False))
-        # all_ancestors is a set of commits that shall not be sent
-        # (complete repository up to 'haves')
-        all_ancestors = object_store._collect_ancestors(
-            have_commits, get_parents=self._get_parents)[0]
-        # all_missing - complete set of commits between haves and wants
-        # common - commits from all_ancestors we hit into while
-        # traversing parent hierarchy of wants
-        missing_commits, common_commits = object_store._collect_ancestors(
-            want_commits, all_ancestors, get_parents=self._get_parents)
+        if get_parents is None:
+            # missing_commits - complete set of commits between haves and
+            # wants; common_commits - commits reachable from haves that are
+            # parents of those. Walking in generation number order only
+            # walks the history of the haves as far as necessary.
+            missing_commits, common_commits = Reachability(
+                object_store).missing_commits(have_commits, want_commits)
+        else:
+            # all_ancestors is a set of commits that shall not be sent
+            # (complete repository up to 'haves')
+            all_ancestors = object_store._collect_ancestors(
+                have_commits, get_parents=self._get_parents)[0]
+            # all_missing - complete set of commits between haves and wants
+            # common - commits from all_ancestors we hit into while
+            # traversing parent hierarchy of wants
+            missing_commits, common_commits = object_store._collect_ancestors(
+                want_commits, all_ancestors, get_parents=self._get_parents)
         self.sha_done = set()
         # Now, fill sha_done with commits and revisions of
         # files and directories known to be both locally
@@ -1039,7 +1699,7 @@ class MissingObjectFinder(object):
         if not leaf:
             o = self.object_store[sha]
             if isinstance(o, Commit):
-                self.add_todo([(o.tree, "", False)])
+                self.add_todo([(o.tree, b"", False)])
             elif isinstance(o, Tree):
                 self.add_todo([(s, n, not stat.S_ISDIR(m))
                                for n, m, s in o.iteritems()
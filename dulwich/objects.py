@@ -142,9 +142,11 @@ def serializable_property(name, docstring=None):
     """A property that helps tracking whether serialization is necessary.
     """
     def set(obj, value):
+        obj._ensure_parsed()
         setattr(obj, "_"+name, value)
         obj._needs_serialization = True
     def get(obj):
+        obj._ensure_parsed()
         return getattr(obj, "_"+name)
     return property(get, set, doc=docstring)
 
@@ -365,6 +367,9 @@ class ShaFile(object):
     def _deserialize(self, chunks):
         raise NotImplementedError(self._deserialize)
 
+    def _ensure_parsed(self):
+        """Parse any fields whose parsing _deserialize deferred."""
+
     def _serialize(self):
         raise NotImplementedError(self._serialize)
 
@@ -787,6 +792,125 @@ def parse_tree(text, strict=False):
         yield (name, mode, hexsha)
 
 
+def _tree_entry_offsets(text):
+    """Find the offsets of the entries in a tree text.
+
+    :param text: Serialized tree text
+    :return: List with the offset of each entry, in the order of the text,
+        or None if the entries are not in strictly increasing tree order
+    :raise ObjectFormatException: if the text is truncated
+    """
+    offsets = []
+    end = len(text)
+    pos = 0
+    last_key = None
+    while pos < end:
+        mode_end = text.find(b' ', pos)
+        name_end = text.find(b'\0', pos)
+        if name_end < 0 or name_end + 21 > end:
+            raise ObjectFormatException("Truncated tree entry")
+        if mode_end < 0 or mode_end > name_end:
+            return None
+        try:
+            mode = int(text[pos:mode_end], 8)
+        except ValueError:
+            return None
+        name = text[mode_end+1:name_end]
+        if stat.S_ISDIR(mode):
+            key = name + b'/'
+        else:
+            key = name
+        if last_key is not None and key <= last_key:
+            return None
+        if key is not name:
+            # A file with the same name as this subtree sorts before it,
+            # separated only by entries that start with that name.
+            i = len(offsets) - 1
+            while i >= 0:
+                prev_name = _tree_entry_at(text, offsets[i])[0]
+                if prev_name == name:
+                    return None
+                if not prev_name.startswith(name):
+                    break
+                i -= 1
+        offsets.append(pos)
+        last_key = key
+        pos = name_end + 21
+    return offsets
+
+
+def _tree_entry_at(text, offset):
+    """Parse the name and mode of the tree entry at an offset.
+
+    :return: Tuple with name, mode and the offset of the binary SHA
+    """
+    mode_end = text.find(b' ', offset)
+    name_end = text.find(b'\0', mode_end)
+    if mode_end < 0 or name_end < 0:
+        raise ObjectFormatException("Truncated tree entry")
+    try:
+        mode = int(text[offset:mode_end], 8)
+    except ValueError:
+        raise ObjectFormatException(
+            "Invalid mode '%s'" % text[offset:mode_end])
+    return text[mode_end+1:name_end], mode, name_end + 1
+
+
+def _tree_lookup(text, offsets, name):
+    """Look up an entry in a tree text by bisecting its entry offsets.
+
+    The entries are sorted with '/' appended to the names of subtrees,
+    so the name is looked for both as a file and as a subtree.
+
+    :param text: Serialized tree text
+    :param offsets: Offsets of the entries, as from _tree_entry_offsets
+    :param name: Name of the entry to look up
+    :return: Tuple of (mode, hexsha), or None if there is no such entry
+    """
+    for key in (name, name + b'/'):
+        lo = 0
+        hi = len(offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_name, mode, _ = _tree_entry_at(text, offsets[mid])
+            if stat.S_ISDIR(mode):
+                entry_name += b'/'
+            if entry_name < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(offsets):
+            entry_name, mode, sha_offset = _tree_entry_at(text, offsets[lo])
+            if entry_name == name:
+                return (mode, sha_to_hex(text[sha_offset:sha_offset+20]))
+    return None
+
+
+def _tree_name_order(text, offsets):
+    """Sort the entry offsets of a tree text in order of entry name.
+
+    :param text: Serialized tree text
+    :param offsets: Offsets of the entries, as from _tree_entry_offsets
+    :return: List of the offsets, sorted by the names of their entries
+    """
+    return sorted(offsets, key=lambda offset: _tree_entry_at(text, offset)[0])
+
+
+def _tree_entry(text, offset):
+    """Read the tree entry at an offset in a tree text.
+
+    :return: A TreeEntry
+    """
+    name, mode, sha_offset = _tree_entry_at(text, offset)
+    return TreeEntry(name, mode, sha_to_hex(text[sha_offset:sha_offset+20]))
+
+
+def _iter_tree_entries(text, offsets):
+    """Iterate over the entries at the given offsets in a tree text."""
+    for offset in offsets:
+        yield _tree_entry(text, offset)
+
+
 def serialize_tree(items):
     """Serialize the items in a tree to a text.
 
@@ -850,16 +974,25 @@ def pretty_format_tree_entry(name, mode, hexsha, encoding="utf-8"):
 
 
 class Tree(ShaFile):
-    """A Git tree object"""
+    """A Git tree object.
+
+    A tree that was read from its serialized text is not converted to a
+    dict of entries until it is modified. Until then, entries are iterated
+    over straight from the text, which git keeps in tree order, and
+    looked up by bisecting it.
+    """
 
     type_name = b'tree'
     type_num = 2
 
-    __slots__ = ('_entries')
+    __slots__ = ('_entries', '_text', '_offsets', '_name_order')
 
     def __init__(self):
         super(Tree, self).__init__()
         self._entries = {}
+        self._text = None
+        self._offsets = None
+        self._name_order = None
 
     @classmethod
     def from_path(cls, filename):
@@ -868,10 +1001,33 @@ class Tree(ShaFile):
             raise NotTreeError(filename)
         return tree
 
+    def _use_text(self):
+        """Check whether entries can be read from the serialized text.
+
+        A text that is not in strict tree order or has duplicate names is
+        parsed into a dict of entries instead, so it is sorted and
+        deduplicated like any other tree.
+        """
+        if self._text is None:
+            return False
+        if self._offsets is None:
+            self._offsets = _tree_entry_offsets(self._text)
+            if self._offsets is None:
+                self._ensure_parsed()
+                return False
+        return True
+
     def __contains__(self, name):
+        if self._use_text():
+            return _tree_lookup(self._text, self._offsets, name) is not None
         return name in self._entries
 
     def __getitem__(self, name):
+        if self._use_text():
+            entry = _tree_lookup(self._text, self._offsets, name)
+            if entry is None:
+                raise KeyError(name)
+            return entry
         return self._entries[name]
 
     def __setitem__(self, name, value):
@@ -883,17 +1039,24 @@ class Tree(ShaFile):
             a string.
         """
         mode, hexsha = value
+        self._ensure_parsed()
         self._entries[name] = (mode, hexsha)
         self._needs_serialization = True
 
     def __delitem__(self, name):
+        self._ensure_parsed()
         del self._entries[name]
         self._needs_serialization = True
 
     def __len__(self):
+        if self._use_text():
+            return len(self._offsets)
         return len(self._entries)
 
     def __iter__(self):
+        if self._use_text():
+            return (entry.path for entry in
+                    _iter_tree_entries(self._text, self._offsets))
         return iter(self._entries)
 
     def add(self, name, mode, hexsha):
@@ -911,6 +1074,7 @@ class Tree(ShaFile):
                 category=DeprecationWarning, stacklevel=2)
         if isinstance(hexsha, str):
             hexsha = hexsha.encode('ascii')
+        self._ensure_parsed()
         self._entries[name] = mode, hexsha
         self._needs_serialization = True
 
@@ -921,6 +1085,15 @@ class Tree(ShaFile):
             order.
         :return: Iterator over (name, mode, sha) tuples
         """
+        if self._use_text():
+            # The text is already in tree order; the offsets in name order
+            # are sorted once and kept.
+            offsets = self._offsets
+            if name_order:
+                if self._name_order is None:
+                    self._name_order = _tree_name_order(self._text, offsets)
+                offsets = self._name_order
+            return _iter_tree_entries(self._text, offsets)
         return sorted_tree_items(self._entries, name_order)
 
     def items(self):
@@ -931,14 +1104,28 @@ class Tree(ShaFile):
         return list(self.iteritems())
 
     def _deserialize(self, chunks):
-        """Grab the entries in the tree"""
+        """Grab the entries in the tree.
+
+        The entries are read from the text as they are accessed.
+        """
+        self._text = b''.join(chunks)
+        self._offsets = None
+        self._name_order = None
+
+    def _ensure_parsed(self):
+        text = self._text
+        if text is None:
+            return
         try:
-            parsed_entries = parse_tree(b''.join(chunks))
+            parsed_entries = parse_tree(text)
         except ValueError as e:
             raise ObjectFormatException(e)
         # TODO: list comprehension is for efficiency in the common (small)
         # case; if memory efficiency in the large case is a concern, use a genexp.
         self._entries = dict([(n, (m, s)) for n, m, s in parsed_entries])
+        self._text = None
+        self._offsets = None
+        self._name_order = None
 
     def check(self):
         """Check this object for internal consistency.
@@ -946,6 +1133,7 @@ class Tree(ShaFile):
         :raise ObjectFormatException: if the object is malformed in some way
         """
         super(Tree, self).check()
+        self._ensure_parsed()
         last = None
         allowed_modes = (stat.S_IFREG | 0o755, stat.S_IFREG | 0o644,
                          stat.S_IFLNK, stat.S_IFDIR, S_IFGITLINK,
@@ -1085,8 +1273,70 @@ def parse_commit(chunks):
             gpgsig, message, extra)
 
 
+def parse_commit_headers(chunks):
+    """Parse the tree, parents and commit time of a commit object.
+
+    Only the header lines up to the committer line are scanned, so the
+    rest of the headers and the message are not looked at.
+
+    :param chunks: Chunks to parse
+    :return: Tuple of (tree, parents, commit_time), or None if the headers
+        do not start with the tree, parent, author and committer headers
+        in that order. Use parse_commit for such commits.
+    """
+    text = b''.join(chunks)
+    if not text.startswith(_TREE_HEADER + b' '):
+        return None
+    end = text.find(b'\n')
+    if end < 0:
+        return None
+    tree = text[len(_TREE_HEADER) + 1:end]
+    pos = end + 1
+    parents = []
+    parent_prefix = _PARENT_HEADER + b' '
+    while text.startswith(parent_prefix, pos):
+        end = text.find(b'\n', pos)
+        if end < 0:
+            return None
+        parents.append(text[pos + len(parent_prefix):end])
+        pos = end + 1
+    if not text.startswith(_AUTHOR_HEADER + b' ', pos):
+        return None
+    pos = text.find(b'\n', pos) + 1
+    if pos == 0 or not text.startswith(_COMMITTER_HEADER + b' ', pos):
+        return None
+    end = text.find(b'\n', pos)
+    if end < 0:
+        return None
+    try:
+        commit_time = int(text[pos:end].rsplit(b' ', 2)[1])
+    except (IndexError, ValueError):
+        return None
+    return (tree, parents, commit_time)
+
+
+def _commit_header_property(name, docstring=None):
+    """A serializable property for one of the fields parse_commit_headers
+    parses, which does not need the rest of the commit to be parsed.
+    """
+    def set(obj, value):
+        obj._ensure_parsed()
+        setattr(obj, "_"+name, value)
+        obj._needs_serialization = True
+    def get(obj):
+        obj._ensure_headers_parsed()
+        return getattr(obj, "_"+name)
+    return property(get, set, doc=docstring)
+
+
 class Commit(ShaFile):
-    """A git commit object"""
+    """A git commit object.
+
+    Parsing of a commit is deferred until its fields are accessed. The
+    tree, parents and commit time are parsed on their own, from the start
+    of the headers; the other fields are parsed when one of them is first
+    accessed.
+    """
 
     type_name = b'commit'
     type_num = 1
@@ -1094,11 +1344,13 @@ class Commit(ShaFile):
     __slots__ = ('_parents', '_encoding', '_extra', '_author_timezone_neg_utc',
                  '_commit_timezone_neg_utc', '_commit_time',
                  '_author_time', '_author_timezone', '_commit_timezone',
-                 '_author', '_committer', '_parents', '_extra',
-                 '_encoding', '_tree', '_message', '_mergetag', '_gpgsig')
+                 '_author', '_committer', '_tree', '_message', '_mergetag',
+                 '_gpgsig', '_lazy_chunks', '_headers_parsed')
 
     def __init__(self):
         super(Commit, self).__init__()
+        self._lazy_chunks = None
+        self._headers_parsed = True
         self._parents = []
         self._encoding = None
         self._mergetag = []
@@ -1115,6 +1367,24 @@ class Commit(ShaFile):
         return commit
 
     def _deserialize(self, chunks):
+        self._lazy_chunks = chunks
+        self._headers_parsed = False
+
+    def _ensure_headers_parsed(self):
+        """Parse the tree, parents and commit time, if not parsed yet."""
+        if self._headers_parsed:
+            return
+        headers = parse_commit_headers(self._lazy_chunks)
+        if headers is None:
+            self._ensure_parsed()
+        else:
+            (self._tree, self._parents, self._commit_time) = headers
+            self._headers_parsed = True
+
+    def _ensure_parsed(self):
+        chunks = self._lazy_chunks
+        if chunks is None:
+            return
         (self._tree, self._parents, author_info, commit_info, self._encoding,
                 self._mergetag, self._gpgsig, self._message, self._extra) = (
                         parse_commit(chunks))
@@ -1122,6 +1392,8 @@ class Commit(ShaFile):
              self._author_timezone_neg_utc)) = author_info
         (self._committer, self._commit_time, (self._commit_timezone,
              self._commit_timezone_neg_utc)) = commit_info
+        self._lazy_chunks = None
+        self._headers_parsed = True
 
     def check(self):
         """Check this object for internal consistency.
@@ -1129,6 +1401,10 @@ class Commit(ShaFile):
         :raise ObjectFormatException: if the object is malformed in some way
         """
         super(Commit, self).check()
+        try:
+            self._ensure_parsed()
+        except Exception as e:
+            raise ObjectFormatException(e)
         self._check_has_member("_tree", "missing tree")
         self._check_has_member("_author", "missing author")
         self._check_has_member("_committer", "missing committer")
@@ -1160,6 +1436,7 @@ class Commit(ShaFile):
         # TODO: optionally check for duplicate parents
 
     def _serialize(self):
+        self._ensure_parsed()
         chunks = []
         tree_bytes = self._tree.as_raw_string() if isinstance(self._tree, Tree) else self._tree
         chunks.append(git_line(_TREE_HEADER, tree_bytes))
@@ -1199,15 +1476,17 @@ class Commit(ShaFile):
         chunks.append(self._message)
         return chunks
 
-    tree = serializable_property(
+    tree = _commit_header_property(
         "tree", "Tree that is the state of this commit")
 
     def _get_parents(self):
         """Return a list of parents of this commit."""
+        self._ensure_headers_parsed()
         return self._parents
 
     def _set_parents(self, value):
         """Set a list of parents of this commit."""
+        self._ensure_parsed()
         self._needs_serialization = True
         self._parents = value
 
@@ -1216,6 +1495,7 @@ class Commit(ShaFile):
 
     def _get_extra(self):
         """Return extra settings of this commit."""
+        self._ensure_parsed()
         return self._extra
 
     extra = property(_get_extra,
@@ -1233,7 +1513,7 @@ class Commit(ShaFile):
     message = serializable_property(
         "message", "The commit message")
 
-    commit_time = serializable_property("commit_time",
+    commit_time = _commit_header_property("commit_time",
         "The timestamp of the commit. As the number of seconds since the epoch.")
 
     commit_timezone = serializable_property("commit_timezone",
@@ -1273,8 +1553,27 @@ for cls in OBJECT_CLASSES:
 # Hold on to the pure-python implementations for testing
 _parse_tree_py = parse_tree
 _sorted_tree_items_py = sorted_tree_items
+_tree_entry_offsets_py = _tree_entry_offsets
+_tree_lookup_py = _tree_lookup
+_tree_name_order_py = _tree_name_order
+_tree_entry_py = _tree_entry
+_parse_commit_py = parse_commit
+_parse_message_py = _parse_message
 try:
     # Try to import C versions
     from dulwich._objects import parse_tree, sorted_tree_items
 except ImportError:
     pass
+try:
+    from dulwich._objects import (
+        _tree_entry_offsets,
+        _tree_lookup,
+        _tree_name_order,
+        _tree_entry,
+        )
+except ImportError:
+    pass
+try:
+    from dulwich._objects import parse_commit, _parse_message
+except ImportError:
+    pass
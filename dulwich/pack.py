@@ -32,15 +32,26 @@ a pointer in to the corresponding packfile.
 
 from collections import defaultdict
 
+import array
 import binascii
+import bisect
 from io import BytesIO, UnsupportedOperation
 from collections import (
     deque,
     )
-import difflib
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+import errno
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import struct
 
-from itertools import chain
+from itertools import (
+    chain,
+    count,
+    )
 try:
     from itertools import imap, izip
 except ImportError:
@@ -93,6 +104,7 @@ DELTA_TYPES = (OFS_DELTA, REF_DELTA)
 
 
 DEFAULT_PACK_DELTA_WINDOW_SIZE = 10
+DEFAULT_PACK_DELTA_DEPTH = 50
 
 
 def take_msb_bytes(read, crc32=None):
@@ -398,6 +410,29 @@ class PackIndex(object):
         """
         raise NotImplementedError(self._object_index)
 
+    def object_index_many(self, shas):
+        """Return the offsets in the packfile of several objects.
+
+        :param shas: Sequence of SHAs, hex or binary, in any order
+        :return: List with the offset of each object in shas, or None for
+            the objects that are not in the pack
+        """
+        ret = []
+        for sha in shas:
+            try:
+                ret.append(self.object_index(sha))
+            except KeyError:
+                ret.append(None)
+        return ret
+
+    def contains_many(self, shas):
+        """Check which of several objects are in the pack.
+
+        :param shas: Sequence of SHAs, hex or binary, in any order
+        :return: List of booleans, one for each object in shas
+        """
+        return [offset is not None for offset in self.object_index_many(shas)]
+
     def objects_sha1(self):
         """Return the hex SHA1 over all the shas of all objects in this pack.
 
@@ -437,6 +472,15 @@ class MemoryPackIndex(PackIndex):
     def _itersha(self):
         return iter(self._by_sha)
 
+    def _unpack_name(self, i):
+        return self._entries[i][0]
+
+    def _unpack_offset(self, i):
+        return self._entries[i][1]
+
+    def _unpack_crc32_checksum(self, i):
+        return self._entries[i][2]
+
     def iterentries(self):
         return iter(self._entries)
 
@@ -572,6 +616,60 @@ class FilePackIndex(PackIndex):
             raise KeyError(sha)
         return self._unpack_offset(i)
 
+    def object_index_many(self, shas):
+        """Return the offsets in the packfile of several objects.
+
+        The SHAs are sorted and merged with the name table, so the search for
+        each SHA starts where the previous one was found. Small batches are
+        looked up by bisecting the rest of their fan-out bucket. Batches for
+        which that would read more names than there are in the table are
+        joined by stepping through the name table instead, skipping the
+        buckets none of the SHAs fall in.
+
+        :param shas: Sequence of SHAs, hex or binary, in any order
+        :return: List with the offset of each object in shas, or None for
+            the objects that are not in the pack
+        """
+        shas = [hex_to_sha(sha) if len(sha) == 40 else sha for sha in shas]
+        ret = [None] * len(shas)
+        if not shas:
+            return ret
+        order = sorted(range(len(shas)), key=shas.__getitem__)
+        num_entries = len(self)
+        # Number of names each bisection of a fan-out bucket reads.
+        probes = max(1, (num_entries >> 8).bit_length())
+        fan_out_table = self._fan_out_table
+        unpack_name = self._unpack_name
+        if len(shas) * probes > num_entries:
+            i = 0
+            for j in order:
+                sha = shas[j]
+                idx = ord(sha[:1])
+                if idx:
+                    i = max(i, fan_out_table[idx-1])
+                end = fan_out_table[idx]
+                while i < end:
+                    name = unpack_name(i)
+                    if name >= sha:
+                        if name == sha:
+                            ret[j] = self._unpack_offset(i)
+                        break
+                    i += 1
+            return ret
+        lo = 0
+        for j in order:
+            sha = shas[j]
+            idx = ord(sha[:1])
+            start = max(lo, fan_out_table[idx-1] if idx else 0)
+            end = fan_out_table[idx] - 1
+            if start > end:
+                continue
+            i = bisect_find_sha(start, end, sha, unpack_name)
+            if i is not None:
+                ret[j] = self._unpack_offset(i)
+                lo = i + 1
+        return ret
+
 
 class PackIndex1(FilePackIndex):
     """Version 1 Pack Index file."""
@@ -599,6 +697,10 @@ class PackIndex1(FilePackIndex):
         return None
 
 
+# Number of entries PackIndex2.iterentries unpacks at a time.
+_ITERENTRIES_BLOCK_SIZE = 4096
+
+
 class PackIndex2(FilePackIndex):
     """Version 2 Pack Index file."""
 
@@ -621,6 +723,34 @@ class PackIndex2(FilePackIndex):
         return (self._unpack_name(i), self._unpack_offset(i),
                 self._unpack_crc32_checksum(i))
 
+    def iterentries(self):
+        """Iterate over the entries in this pack index.
+
+        The CRC32 and offset tables are unpacked a block of entries at a
+        time rather than one entry at a time.
+
+        :return: iterator over tuples with object name, offset in packfile and
+            crc32 checksum.
+        """
+        contents = self._contents
+        num_entries = len(self)
+        for first in range(0, num_entries, _ITERENTRIES_BLOCK_SIZE):
+            count = min(_ITERENTRIES_BLOCK_SIZE, num_entries - first)
+            fmt = '>%dL' % count
+            crc32s = unpack_from(
+                fmt, contents, self._crc32_table_offset + first * 4)
+            offsets = unpack_from(
+                fmt, contents, self._pack_offset_table_offset + first * 4)
+            name_offset = self._name_table_offset + first * 20
+            names = contents[name_offset:name_offset + count * 20]
+            for i in range(count):
+                offset = offsets[i]
+                if offset & (2**31):
+                    offset = unpack_from(
+                        '>Q', contents, self._pack_offset_largetable_offset +
+                        (offset & (2**31-1)) * 8)[0]
+                yield names[i*20:(i+1)*20], offset, crc32s[i]
+
     def _unpack_name(self, i):
         offset = self._name_table_offset + i * 20
         return self._contents[offset:offset+20]
@@ -638,6 +768,192 @@ class PackIndex2(FilePackIndex):
                           self._crc32_table_offset + i * 4)[0]
 
 
+class PackReverseIndex(object):
+    """A reverse index for a pack file.
+
+    The reverse index lists the objects in a pack in the order in which
+    they appear in the pack file, by their position in the pack index
+    (which is sorted by SHA). Together with the pack index it maps offsets
+    to names and finds the offset of the next object without scanning the
+    pack.
+    """
+
+    def __init__(self, index):
+        """Create a reverse index.
+
+        :param index: The PackIndex of the pack
+        """
+        self._index = index
+
+    def __len__(self):
+        """Return the number of objects in the pack."""
+        raise NotImplementedError(self.__len__)
+
+    def close(self):
+        pass
+
+    def index_position(self, pack_pos):
+        """Return the position in the pack index of an object.
+
+        :param pack_pos: Position of the object in the pack file
+        """
+        raise NotImplementedError(self.index_position)
+
+    def iterpositions(self):
+        """Iterate over the pack index positions, in pack order."""
+        for i in range(len(self)):
+            yield self.index_position(i)
+
+    def offset(self, pack_pos):
+        """Return the offset of the object at a position in the pack."""
+        return self._index._unpack_offset(self.index_position(pack_pos))
+
+    def name(self, pack_pos):
+        """Return the binary SHA of the object at a position in the pack."""
+        return self._index._unpack_name(self.index_position(pack_pos))
+
+    def pack_position(self, offset):
+        """Find the position in the pack of the object at an offset.
+
+        :param offset: Offset of the object in the pack file
+        :return: Position of the object in the pack file
+        :raise KeyError: if no object starts at offset
+        """
+        start = 0
+        end = len(self)
+        while start < end:
+            i = (start + end) // 2
+            file_offset = self.offset(i)
+            if file_offset < offset:
+                start = i + 1
+            elif file_offset > offset:
+                end = i
+            else:
+                return i
+        raise KeyError(offset)
+
+    def name_at_offset(self, offset):
+        """Return the binary SHA of the object at an offset."""
+        return self.name(self.pack_position(offset))
+
+    def next_offset(self, offset):
+        """Return the offset of the object following the one at an offset.
+
+        :return: Offset of the next object, or None if the object at offset
+            is the last one in the pack
+        """
+        pack_pos = self.pack_position(offset) + 1
+        if pack_pos == len(self):
+            return None
+        return self.offset(pack_pos)
+
+
+class MemoryPackReverseIndex(PackReverseIndex):
+    """Reverse index that is stored entirely in memory."""
+
+    def __init__(self, index, positions):
+        """Create a new MemoryPackReverseIndex.
+
+        :param index: The PackIndex of the pack
+        :param positions: Sequence of pack index positions, in pack order
+        """
+        super(MemoryPackReverseIndex, self).__init__(index)
+        self._positions = positions
+
+    @classmethod
+    def from_index(cls, index):
+        """Generate the reverse index for a pack index."""
+        offsets = [entry[1] for entry in index.iterentries()]
+        positions = array.array(
+            'L', sorted(range(len(offsets)), key=offsets.__getitem__))
+        return cls(index, positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def index_position(self, pack_pos):
+        return self._positions[pack_pos]
+
+    def iterpositions(self):
+        return iter(self._positions)
+
+
+class FilePackReverseIndex(PackReverseIndex):
+    """Reverse index that is read from a .rev file."""
+
+    def __init__(self, filename, index, file=None, contents=None, size=None):
+        super(FilePackReverseIndex, self).__init__(index)
+        self._filename = filename
+        if file is None:
+            self._file = GitFile(filename, 'rb')
+        else:
+            self._file = file
+        if contents is None:
+            self._contents, self._size = _load_file_contents(self._file, size)
+        else:
+            self._contents, self._size = (contents, size)
+        if self._contents[:4] != b'RIDX':
+            raise AssertionError('Not a pack reverse index file')
+        (self.version, hash_id) = unpack_from(b'>LL', self._contents, 4)
+        if self.version != 1:
+            raise AssertionError('Version was %d' % self.version)
+        if hash_id != 1:
+            raise AssertionError('Unsupported hash id %d' % hash_id)
+        self._num_objects = (self._size - 12 - 40) // 4
+
+    def close(self):
+        self._file.close()
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
+
+    def __len__(self):
+        return self._num_objects
+
+    def index_position(self, pack_pos):
+        return unpack_from(b'>L', self._contents, 12 + pack_pos * 4)[0]
+
+    def check(self):
+        """Check that the stored checksum matches the actual checksum."""
+        actual = self.calculate_checksum()
+        stored = self.get_stored_checksum()
+        if actual != stored:
+            raise ChecksumMismatch(stored, actual)
+
+    def calculate_checksum(self):
+        """Calculate the SHA1 checksum over this reverse index.
+
+        :return: This is a 20-byte binary digest
+        """
+        return sha1(self._contents[:-20]).digest()
+
+    def get_pack_checksum(self):
+        """Return the SHA1 checksum stored for the corresponding packfile.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-40:-20])
+
+    def get_stored_checksum(self):
+        """Return the SHA1 checksum stored for this reverse index.
+
+        :return: 20-byte binary digest
+        """
+        return bytes(self._contents[-20:])
+
+
+def load_pack_rev_index(path, index):
+    """Load a reverse index file by path.
+
+    :param path: Path to the .rev file
+    :param index: The PackIndex of the pack
+    :return: A FilePackReverseIndex loaded from the given path
+    """
+    with GitFile(path, 'rb') as f:
+        contents, size = _load_file_contents(f)
+        return FilePackReverseIndex(path, index, file=f, contents=contents,
+                                    size=size)
+
+
 def read_pack_header(read):
     """Read the header of a pack file.
 
@@ -727,6 +1043,142 @@ def unpack_object(read_all, read_some=None, compute_crc32=False,
     return unpacked, unused
 
 
+# Longest possible object header: a 10-byte size followed by a 20-byte
+# REF_DELTA base, with room to spare.
+_MAX_OBJECT_HEADER_SIZE = 32
+
+
+def _deflate_bound(size):
+    """Upper bound on the deflated size of size bytes, as in compressBound()."""
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 64
+
+
+if sys.version_info[0] == 2:
+    # Python 2 can't make a memoryview of an mmap, and its memoryviews
+    # can't be released; buffer objects give zero-copy slices there.
+    def _view_contents(contents):
+        return contents
+
+    def _view_slice(view, start, end):
+        return buffer(view, start, max(end - start, 0))
+
+    def _release_view(view):
+        pass
+else:
+    _view_contents = memoryview
+
+    def _view_slice(view, start, end):
+        return view[start:end]
+
+    def _release_view(view):
+        view.release()
+
+
+def unpack_object_from(contents, offset, compute_crc32=False,
+                       include_comp=False):
+    """Unpack a Git object directly from a buffer containing pack data.
+
+    Unlike unpack_object, this does not go through a read function: the
+    compressed data is handed to zlib as zero-copy slices of contents, so
+    nothing is copied when contents is an mmap.
+
+    :param contents: Buffer (bytes, mmap) with the pack data.
+    :param offset: Offset of the object in contents.
+    :param compute_crc32: If True, compute the CRC32 of the compressed data. If
+        False, the returned CRC32 will be None.
+    :param include_comp: If True, include compressed data in the result.
+    :return: A tuple of (unpacked, end), where end is the offset just past
+        the object and unpacked is an UnpackedObject with the same attrs set
+        as by unpack_object.
+    """
+    header = bytearray(contents[offset:offset+_MAX_OBJECT_HEADER_SIZE])
+    type_num, size, delta_base, i = _parse_object_header(header)
+    if compute_crc32:
+        crc32 = binascii.crc32(bytes(header[:i]))
+    else:
+        crc32 = None
+    unpacked = UnpackedObject(type_num, delta_base, size, crc32)
+    end = _decompress_from(contents, offset + i, unpacked, include_comp)
+    return unpacked, end
+
+
+def _parse_object_header(header):
+    """Parse the header of an object in a pack.
+
+    :param header: bytearray starting with the object header
+    :return: Tuple with type number, uncompressed size, delta base offset
+        or SHA (None for whole objects), and length of the header
+    """
+    byte = header[0]
+    type_num = (byte >> 4) & 0x07
+    size = byte & 0x0f
+    shift = 4
+    i = 1
+    while byte & 0x80:
+        byte = header[i]
+        size += (byte & 0x7f) << shift
+        shift += 7
+        i += 1
+    if type_num == OFS_DELTA:
+        byte = header[i]
+        delta_base = byte & 0x7f
+        i += 1
+        while byte & 0x80:
+            byte = header[i]
+            delta_base = ((delta_base + 1) << 7) + (byte & 0x7f)
+            i += 1
+    elif type_num == REF_DELTA:
+        delta_base = bytes(header[i:i+20])
+        i += 20
+    else:
+        delta_base = None
+    return type_num, size, delta_base, i
+
+
+def _decompress_from(contents, offset, unpacked, include_comp=False):
+    """Decompress the zlib stream at offset in contents into unpacked.
+
+    :return: Offset just past the end of the zlib stream.
+    """
+    view = _view_contents(contents)
+    try:
+        decomp_obj = zlib.decompressobj()
+        comp_chunks = []
+        decomp_chunks = unpacked.decomp_chunks
+        decomp_len = 0
+        crc32 = unpacked.crc32
+        window = _deflate_bound(unpacked.decomp_len)
+        while True:
+            data = _view_slice(view, offset, offset + window)
+            if not len(data):
+                raise zlib.error('EOF before end of zlib stream')
+            decomp = decomp_obj.decompress(data)
+            decomp_len += len(decomp)
+            decomp_chunks.append(decomp)
+            used = len(data) - len(decomp_obj.unused_data)
+            if crc32 is not None:
+                crc32 = binascii.crc32(data[:used], crc32)
+            if include_comp:
+                comp_chunks.append(bytes(data[:used]))
+            offset += used
+            _release_view(data)
+            if decomp_obj.unused_data:
+                break
+            window *= 2
+    finally:
+        _release_view(view)
+    if crc32 is not None:
+        crc32 &= 0xffffffff
+
+    if decomp_len != unpacked.decomp_len:
+        raise zlib.error('decompressed data does not match expected size')
+
+    unpacked.crc32 = crc32
+    if include_comp:
+        unpacked.comp_chunks = comp_chunks
+    return offset
+
+
 def _compute_object_size(value):
     """Compute the size of a unresolved object for use with LRUSizeCache."""
     (num, obj) = value
@@ -735,6 +1187,83 @@ def _compute_object_size(value):
     return chunks_length(obj)
 
 
+DEFAULT_DELTA_BASE_CACHE_SIZE = 20 * 1024 * 1024
+
+
+class DeltaBaseCache(object):
+    """Size-bounded cache of resolved delta bases.
+
+    Entries are keyed by (pack, offset), so a single cache can be shared by
+    all packs in an object store and the byte budget applies to all of them
+    together. Only objects that served as the base of a delta are stored;
+    resolving an object can then start from the nearest cached ancestor
+    rather than inflating the whole chain again.
+
+    Any object providing the same get/add methods can be passed to
+    PackData instead.
+    """
+
+    def __init__(self, max_size=DEFAULT_DELTA_BASE_CACHE_SIZE):
+        """Create a new DeltaBaseCache.
+
+        :param max_size: Maximum number of bytes of object data to keep.
+        """
+        self._cache = LRUSizeCache(max_size,
+                                   compute_size=_compute_object_size)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        return self._cache._max_size
+
+    @property
+    def size(self):
+        """Number of bytes of object data currently cached."""
+        return self._cache._value_size
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, pack_key, offset):
+        """Look up a resolved object.
+
+        :param pack_key: Key identifying the pack the object lives in
+        :param offset: Offset of the object in that pack
+        :return: Tuple with type number and chunks, or None if not cached
+        """
+        try:
+            value = self._cache[(pack_key, offset)]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def add(self, pack_key, offset, type_num, chunks):
+        """Store a resolved (non-delta) object.
+
+        :param pack_key: Key identifying the pack the object lives in
+        :param offset: Offset of the object in that pack
+        :param type_num: Type number of the object
+        :param chunks: Chunks with the full object contents
+        """
+        self._cache.add((pack_key, offset), (type_num, chunks))
+
+    def resize(self, max_size):
+        """Change the number of bytes that will be cached."""
+        self._cache.resize(max_size)
+
+    def clear(self):
+        """Drop all cached objects and reset the statistics."""
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+_pack_data_keys = count()
+
+
 class PackStreamReader(object):
     """Class to read a pack stream.
 
@@ -903,7 +1432,8 @@ class PackStreamCopier(PackStreamReader):
         throw.
         """
         if self._delta_iter:
-            for unpacked in self.read_objects():
+            for unpacked in self.read_objects(
+                    compute_crc32=self._delta_iter._record_crc32):
                 self._delta_iter.record(unpacked)
         else:
             for _ in self.read_objects():
@@ -976,7 +1506,8 @@ class PackData(object):
     position.  It will all just throw a zlib or KeyError.
     """
 
-    def __init__(self, filename, file=None, size=None):
+    def __init__(self, filename, file=None, size=None, use_mmap=False,
+                 delta_base_cache=None):
         """Create a PackData object representing the pack in the given filename.
 
         The file must exist and stay readable until the object is disposed of. It
@@ -984,6 +1515,14 @@ class PackData(object):
 
         Currently there is a restriction on the size of the pack as the python
         mmap implementation is flawed.
+
+        :param use_mmap: If True, map the pack into memory and unpack objects
+            straight from the mapping rather than seeking and reading the file.
+            Lookups then no longer share a file position, so the same
+            PackData can be used from several threads.
+        :param delta_base_cache: DeltaBaseCache to keep resolved delta bases
+            in, possibly shared with other packs. If not specified, a
+            private cache is used.
         """
         self._filename = filename
         self._size = size
@@ -992,9 +1531,16 @@ class PackData(object):
             self._file = GitFile(self._filename, 'rb')
         else:
             self._file = file
+        if use_mmap:
+            self._contents, self._size = _load_file_contents(self._file, size)
+            self._file.seek(0)
+        else:
+            self._contents = None
         (version, self._num_objects) = read_pack_header(self._file.read)
-        self._offset_cache = LRUSizeCache(1024*1024*20,
-            compute_size=_compute_object_size)
+        if delta_base_cache is None:
+            delta_base_cache = DeltaBaseCache()
+        self.delta_base_cache = delta_base_cache
+        self._cache_key = next(_pack_data_keys)
         self.pack = None
 
     @property
@@ -1002,14 +1548,18 @@ class PackData(object):
         return os.path.basename(self._filename)
 
     @classmethod
-    def from_file(cls, file, size):
-        return cls(str(file), file=file, size=size)
+    def from_file(cls, file, size, use_mmap=False, delta_base_cache=None):
+        return cls(str(file), file=file, size=size, use_mmap=use_mmap,
+                   delta_base_cache=delta_base_cache)
 
     @classmethod
-    def from_path(cls, path):
-        return cls(filename=path)
+    def from_path(cls, path, use_mmap=False, delta_base_cache=None):
+        return cls(filename=path, use_mmap=use_mmap,
+                   delta_base_cache=delta_base_cache)
 
     def close(self):
+        if getattr(self._contents, "close", None) is not None:
+            self._contents.close()
         self._file.close()
 
     def __enter__(self):
@@ -1037,6 +1587,16 @@ class PackData(object):
 
         :return: 20-byte binary SHA1 digest
         """
+        if self._contents is not None:
+            view = _view_contents(self._contents)
+            try:
+                data = _view_slice(view, 0, len(self._contents) - 20)
+                try:
+                    return sha1(data).digest()
+                finally:
+                    _release_view(data)
+            finally:
+                _release_view(view)
         return compute_file_sha(self._file, end_ofs=-20).digest()
 
     def get_ref(self, sha):
@@ -1062,10 +1622,12 @@ class PackData(object):
         :return: Tuple with object type and contents.
         """
         # Walk down the delta chain, building a stack of deltas to reach
-        # the requested object.
+        # the requested object. The walk stops at the first base found in
+        # the delta base cache.
         base_offset = offset
         base_type = type
         base_obj = obj
+        base_cached = False
         delta_stack = []
         while base_type in DELTA_TYPES:
             prev_offset = base_offset
@@ -1079,9 +1641,15 @@ class PackData(object):
                     or isinstance(base_offset, long))
                 assert (
                     isinstance(delta_offset, int)
-                    or isinstance(base_offset, long))
+                    or isinstance(delta_offset, long))
                 base_offset = base_offset - delta_offset
-                base_type, base_obj = self.get_object_at(base_offset)
+                cached = self.delta_base_cache.get(
+                    self._cache_key, base_offset)
+                if cached is None:
+                    base_type, base_obj = self._get_object_at(base_offset)
+                else:
+                    base_type, base_obj = cached
+                    base_cached = True
                 assert isinstance(base_type, int)
             elif base_type == REF_DELTA:
                 (basename, delta) = base_obj
@@ -1091,20 +1659,31 @@ class PackData(object):
             delta_stack.append((prev_offset, base_type, delta))
 
         # Now grab the base object (mustn't be a delta) and apply the
-        # deltas all the way up the stack.
+        # deltas all the way up the stack, caching every object that is
+        # used as a base on the way.
         chunks = base_obj
+        if delta_stack and not base_cached and base_offset is not None:
+            self.delta_base_cache.add(
+                self._cache_key, base_offset, base_type, chunks)
         for prev_offset, delta_type, delta in reversed(delta_stack):
             chunks = apply_delta(chunks, delta)
-            # TODO(dborowitz): This can result in poor performance if
-            # large base objects are separated from deltas in the pack.
-            # We should reorganize so that we apply deltas to all
-            # objects in a chain one after the other to optimize cache
-            # performance.
-            if prev_offset is not None:
-                self._offset_cache[prev_offset] = base_type, chunks
+            if prev_offset is not None and prev_offset != offset:
+                self.delta_base_cache.add(
+                    self._cache_key, prev_offset, base_type, chunks)
         return base_type, chunks
 
     def iterobjects(self, progress=None, compute_crc32=True):
+        if self._contents is not None:
+            offset = self._header_size
+            for i in range(1, self._num_objects + 1):
+                unpacked, next_offset = unpack_object_from(
+                    self._contents, offset, compute_crc32=compute_crc32)
+                if progress is not None:
+                    progress(i, self._num_objects)
+                yield (offset, unpacked.pack_type_num, unpacked._obj(),
+                       unpacked.crc32)
+                offset = next_offset
+            return
         self._file.seek(self._header_size)
         for i in range(1, self._num_objects + 1):
             offset = self._file.tell()
@@ -1119,11 +1698,20 @@ class PackData(object):
     def _iter_unpacked(self):
         # TODO(dborowitz): Merge this with iterobjects, if we can change its
         # return type.
-        self._file.seek(self._header_size)
-
         if self._num_objects is None:
             return
 
+        if self._contents is not None:
+            offset = self._header_size
+            for _ in range(self._num_objects):
+                unpacked, next_offset = unpack_object_from(
+                    self._contents, offset)
+                unpacked.offset = offset
+                yield unpacked
+                offset = next_offset
+            return
+
+        self._file.seek(self._header_size)
         for _ in range(self._num_objects):
             offset = self._file.tell()
             unpacked, unused = unpack_object(
@@ -1132,11 +1720,14 @@ class PackData(object):
             yield unpacked
             self._file.seek(-len(unused), SEEK_CUR)  # Back up over unused data.
 
-    def iterentries(self, progress=None):
+    def iterentries(self, progress=None, processes=1):
         """Yield entries summarizing the contents of this pack.
 
         :param progress: Progress function, called with current and total
             object count.
+        :param processes: Number of processes to resolve deltas with; None
+            for one per CPU. Entries are not returned in pack order when
+            more than one is used.
         :return: iterator of tuples with (sha, offset, crc32)
         """
         num_objects = self._num_objects
@@ -1144,61 +1735,71 @@ class PackData(object):
             self.pack.resolve_ext_ref if self.pack is not None else None)
         indexer = PackIndexer.for_pack_data(
             self, resolve_ext_ref=resolve_ext_ref)
+        if processes != 1:
+            indexer = indexer.iter_parallel(processes)
         for i, result in enumerate(indexer):
             if progress is not None:
                 progress(i, num_objects)
             yield result
 
-    def sorted_entries(self, progress=None):
+    def sorted_entries(self, progress=None, processes=1):
         """Return entries in this pack, sorted by SHA.
 
         :param progress: Progress function, called with current and total
             object count
+        :param processes: Number of processes to resolve deltas with; None
+            for one per CPU
         :return: List of tuples with (sha, offset, crc32)
         """
-        ret = list(self.iterentries(progress=progress))
+        ret = list(self.iterentries(progress=progress, processes=processes))
         ret.sort()
         return ret
 
-    def create_index_v1(self, filename, progress=None):
+    def create_index_v1(self, filename, progress=None, processes=1):
         """Create a version 1 file for this data file.
 
         :param filename: Index filename.
         :param progress: Progress report function
+        :param processes: Number of processes to resolve deltas with
         :return: Checksum of index file
         """
-        entries = self.sorted_entries(progress=progress)
+        entries = self.sorted_entries(progress=progress, processes=processes)
         with GitFile(filename, 'wb') as f:
             return write_pack_index_v1(f, entries, self.calculate_checksum())
 
-    def create_index_v2(self, filename, progress=None):
+    def create_index_v2(self, filename, progress=None, processes=1):
         """Create a version 2 index file for this data file.
 
         :param filename: Index filename.
         :param progress: Progress report function
+        :param processes: Number of processes to resolve deltas with
         :return: Checksum of index file
         """
-        entries = self.sorted_entries(progress=progress)
+        entries = self.sorted_entries(progress=progress, processes=processes)
         with GitFile(filename, 'wb') as f:
             return write_pack_index_v2(f, entries, self.calculate_checksum())
 
     def create_index(self, filename, progress=None,
-                     version=2):
+                     version=2, processes=1):
         """Create an  index file for this data file.
 
         :param filename: Index filename.
         :param progress: Progress report function
+        :param processes: Number of processes to resolve deltas with; None
+            for one per CPU
         :return: Checksum of index file
         """
         if version == 1:
-            return self.create_index_v1(filename, progress)
+            return self.create_index_v1(filename, progress, processes)
         elif version == 2:
-            return self.create_index_v2(filename, progress)
+            return self.create_index_v2(filename, progress, processes)
         else:
             raise ValueError('unknown index format %d' % version)
 
     def get_stored_checksum(self):
         """Return the expected checksum stored in this pack."""
+        if self._contents is not None:
+            return bytes(self._contents[-20:])
         self._file.seek(-20, SEEK_END)
         return self._file.read(20)
 
@@ -1216,13 +1817,83 @@ class PackData(object):
         and then the packfile can be asked directly for that object using this
         function.
         """
-        try:
-            return self._offset_cache[offset]
-        except KeyError:
-            pass
+        cached = self.delta_base_cache.get(self._cache_key, offset)
+        if cached is not None:
+            return cached
+        return self._get_object_at(offset)
+
+    def get_unpacked_object_at(self, offset, include_comp=False):
+        """Get the object at an offset as it is stored in the pack.
+
+        Deltas are not resolved.
+
+        :param offset: Offset of the object
+        :param include_comp: Whether to include the compressed data, and
+            compute the CRC32 over the object as it is stored
+        :return: UnpackedObject
+        """
+        assert offset >= self._header_size
+        if self._contents is not None:
+            unpacked, _ = unpack_object_from(
+                self._contents, offset, include_comp=include_comp,
+                compute_crc32=include_comp)
+        else:
+            self._file.seek(offset)
+            unpacked, _ = unpack_object(
+                self._file.read, include_comp=include_comp,
+                compute_crc32=include_comp)
+        unpacked.offset = offset
+        return unpacked
+
+    def get_object_header_at(self, offset):
+        """Get the header of the object at an offset, without inflating it.
+
+        :param offset: Offset of the object
+        :return: UnpackedObject with the type, size and delta base of the
+            object as it is stored, but no data
+        """
+        assert offset >= self._header_size
+        if self._contents is not None:
+            header = self._contents[offset:offset+_MAX_OBJECT_HEADER_SIZE]
+        else:
+            self._file.seek(offset)
+            header = self._file.read(_MAX_OBJECT_HEADER_SIZE)
+        type_num, size, delta_base, header_len = _parse_object_header(
+            bytearray(header))
+        unpacked = UnpackedObject(type_num, delta_base, size, None)
+        unpacked.offset = offset
+        return unpacked
+
+    def get_compressed_object_at(self, offset, end):
+        """Get the object at an offset as it is stored, without inflating it.
+
+        :param offset: Offset of the object
+        :param end: Offset just past the object, i.e. the offset of the next
+            object or of the pack checksum
+        :return: UnpackedObject with comp_chunks and the CRC32 over the
+            object as it is stored set, but no decompressed data
+        """
         assert offset >= self._header_size
-        self._file.seek(offset)
-        unpacked, _ = unpack_object(self._file.read)
+        if self._contents is not None:
+            data = bytes(self._contents[offset:end])
+        else:
+            self._file.seek(offset)
+            data = self._file.read(end - offset)
+        type_num, size, delta_base, header_len = _parse_object_header(
+            bytearray(data[:_MAX_OBJECT_HEADER_SIZE]))
+        unpacked = UnpackedObject(type_num, delta_base, size,
+                                  binascii.crc32(data) & 0xffffffff)
+        unpacked.comp_chunks = [data[header_len:]]
+        unpacked.offset = offset
+        return unpacked
+
+    def _get_object_at(self, offset):
+        assert offset >= self._header_size
+        if self._contents is not None:
+            unpacked, _ = unpack_object_from(self._contents, offset)
+        else:
+            self._file.seek(offset)
+            unpacked, _ = unpack_object(self._file.read)
         return (unpacked.pack_type_num, unpacked._obj())
 
 
@@ -1249,9 +1920,13 @@ class DeltaChainIterator(object):
 
     _compute_crc32 = False
     _include_comp = False
+    # Whether record() needs the CRC32 of objects read from a stream.
+    _record_crc32 = False
 
     def __init__(self, file_obj, resolve_ext_ref=None):
         self._file = file_obj
+        self._filename = None
+        self._contents = None
         self._resolve_ext_ref = resolve_ext_ref
         self._pending_ofs = defaultdict(list)
         self._pending_ref = defaultdict(list)
@@ -1280,6 +1955,8 @@ class DeltaChainIterator(object):
 
     def set_pack_data(self, pack_data):
         self._file = pack_data._file
+        self._contents = pack_data._contents
+        self._filename = pack_data._filename
 
     def _walk_all_chains(self):
         for offset, type_num in self._full_ofs:
@@ -1289,6 +1966,89 @@ class DeltaChainIterator(object):
             yield result
         assert not self._pending_ofs
 
+    def iter_parallel(self, processes=None):
+        """Iterate over the results, resolving delta chains in parallel.
+
+        The chains hanging off each full object in the pack are independent
+        of each other, so they are partitioned across a pool of worker
+        processes which each map the pack file themselves. Deltas against
+        objects named by SHA (REF_DELTA) are resolved in this process
+        afterwards. Results are not returned in chain order. Without mmap
+        support, the chains are walked serially instead.
+
+        :param processes: Number of worker processes to use, defaults to
+            the number of CPUs
+        :return: Iterator over the results
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if (processes <= 1 or not has_mmap or not self._full_ofs or
+                self._filename is None or not os.path.isfile(self._filename)):
+            return self._walk_all_chains()
+        return self._walk_all_chains_parallel(self._filename, processes)
+
+    def _walk_all_chains_parallel(self, filename, processes):
+        num_objects = (
+            len(self._full_ofs) +
+            sum(len(v) for v in self._pending_ofs.values()) +
+            sum(len(v) for v in self._pending_ref.values()))
+        num_chunks = min(len(self._full_ofs), processes * 4)
+        chunks = [self._full_ofs[i::num_chunks] for i in range(num_chunks)]
+        done = 0
+        ref_bases = []
+        pool = multiprocessing.Pool(
+            processes, initializer=_init_chain_worker,
+            initargs=(self.__class__, filename, dict(self._pending_ofs),
+                      set(self._pending_ref)))
+        try:
+            for results, bases in pool.imap_unordered(
+                    _walk_chains_in_worker, chunks):
+                for result in results:
+                    done += 1
+                    yield result
+                ref_bases.extend(bases)
+        finally:
+            pool.terminate()
+            pool.join()
+        for base_sha, type_num, chunks in ref_bases:
+            # The pack may contain the same object more than once.
+            pending = self._pending_ref.pop(base_sha, None)
+            if pending is None:
+                continue
+            for new_offset in pending:
+                for result in self._follow_chain(new_offset, type_num, chunks):
+                    done += 1
+                    yield result
+        for result in self._walk_ref_chains():
+            done += 1
+            yield result
+        assert done == num_objects
+
+    def _walk_ofs_chains(self, roots, ref_bases):
+        """Walk the OFS_DELTA chains starting at a set of full objects.
+
+        :param roots: List of (offset, type_num) tuples of full objects
+        :param ref_bases: Set of binary SHAs that REF_DELTAs in the pack
+            refer to
+        :return: Tuple with list of results and list of
+            (sha, type_num, chunks) tuples for the objects found in ref_bases
+        """
+        results = []
+        found = []
+        for offset, type_num in roots:
+            todo = [(offset, type_num, None)]
+            for offset, obj_type_num, base_chunks in todo:
+                unpacked = self._resolve_object(
+                    offset, obj_type_num, base_chunks)
+                results.append(self._result(unpacked))
+                if ref_bases and unpacked.sha() in ref_bases:
+                    found.append((unpacked.sha(), unpacked.obj_type_num,
+                                  unpacked.obj_chunks))
+                todo.extend(
+                    (new_offset, unpacked.obj_type_num, unpacked.obj_chunks)
+                    for new_offset in self._pending_ofs.pop(unpacked.offset, []))
+        return results, found
+
     def _ensure_no_pending(self):
         if self._pending_ref:
             raise KeyError([sha_to_hex(s) for s in self._pending_ref])
@@ -1320,10 +2080,15 @@ class DeltaChainIterator(object):
         return unpacked
 
     def _resolve_object(self, offset, obj_type_num, base_chunks):
-        self._file.seek(offset)
-        unpacked, _ = unpack_object(
-          self._file.read, include_comp=self._include_comp,
-          compute_crc32=self._compute_crc32)
+        if self._contents is not None:
+            unpacked, _ = unpack_object_from(
+              self._contents, offset, include_comp=self._include_comp,
+              compute_crc32=self._compute_crc32)
+        else:
+            self._file.seek(offset)
+            unpacked, _ = unpack_object(
+              self._file.read, include_comp=self._include_comp,
+              compute_crc32=self._compute_crc32)
         unpacked.offset = offset
         if base_chunks is None:
             assert unpacked.pack_type_num == obj_type_num
@@ -1355,6 +2120,24 @@ class DeltaChainIterator(object):
         return self._ext_refs
 
 
+# State of a process in the pool used by DeltaChainIterator.iter_parallel.
+_chain_worker = None
+
+
+def _init_chain_worker(cls, filename, pending_ofs, ref_bases):
+    global _chain_worker
+    f = GitFile(filename, 'rb')
+    walker = cls(f)
+    walker._contents, _ = _load_file_contents(f)
+    walker._pending_ofs = pending_ofs
+    _chain_worker = (walker, ref_bases)
+
+
+def _walk_chains_in_worker(roots):
+    walker, ref_bases = _chain_worker
+    return walker._walk_ofs_chains(roots, ref_bases)
+
+
 class PackIndexer(DeltaChainIterator):
     """Delta chain iterator that yields index entries."""
 
@@ -1364,6 +2147,107 @@ class PackIndexer(DeltaChainIterator):
         return unpacked.sha(), unpacked.offset, unpacked.crc32
 
 
+class StreamingPackIndexer(PackIndexer):
+    """Pack indexer that resolves objects while they are being recorded.
+
+    When used as the delta_iter of a PackStreamCopier, full objects and
+    deltas against recently seen objects are indexed as the pack is
+    received. Only deltas whose base was not available at that point
+    (because it comes later in the pack, lives outside of it or was evicted
+    from the cache) are read back from the file when iterating.
+    """
+
+    _record_crc32 = True
+
+    def __init__(self, file_obj, resolve_ext_ref=None,
+                 cache_size=DEFAULT_DELTA_BASE_CACHE_SIZE):
+        """Create a new StreamingPackIndexer.
+
+        :param file_obj: File object the pack is written to
+        :param resolve_ext_ref: Function to look up objects outside of the
+            pack by binary SHA
+        :param cache_size: Number of bytes of recently resolved objects to
+            keep for resolving deltas against
+        """
+        super(StreamingPackIndexer, self).__init__(
+            file_obj, resolve_ext_ref=resolve_ext_ref)
+        self._entries = []
+        # Offset -> (type_num, base offset) for each resolved object, with
+        # base offset None for full objects.
+        self._resolved = {}
+        self._sha_offsets = {}
+        self._cache = LRUSizeCache(
+            cache_size, compute_size=_compute_object_size)
+
+    def record(self, unpacked):
+        type_num = unpacked.pack_type_num
+        if type_num == OFS_DELTA:
+            base_offset = unpacked.offset - unpacked.delta_base
+        elif type_num == REF_DELTA:
+            base_offset = self._sha_offsets.get(unpacked.delta_base)
+        else:
+            base_offset = None
+        if type_num in DELTA_TYPES:
+            base = None
+            if base_offset is not None:
+                base = self._cache.get(base_offset)
+            if base is None:
+                super(StreamingPackIndexer, self).record(unpacked)
+                return
+            unpacked.obj_type_num, base_chunks = base
+            unpacked.obj_chunks = apply_delta(
+                base_chunks, unpacked.decomp_chunks)
+        self._entries.append(self._result(unpacked))
+        self._resolved[unpacked.offset] = (unpacked.obj_type_num, base_offset)
+        self._sha_offsets[unpacked.sha()] = unpacked.offset
+        self._cache[unpacked.offset] = (
+            unpacked.obj_type_num, unpacked.obj_chunks)
+
+    def _resolved_object(self, offset):
+        """Get the type and chunks of an object that was already resolved.
+
+        :param offset: Offset of the object
+        :return: Tuple with type number and chunks
+        """
+        todo = []
+        value = self._cache.get(offset)
+        while value is None:
+            type_num, base_offset = self._resolved[offset]
+            todo.append((offset, type_num))
+            if base_offset is None:
+                break
+            offset = base_offset
+            value = self._cache.get(offset)
+        for offset, type_num in reversed(todo):
+            unpacked = self._resolve_object(
+                offset, type_num, value[1] if value is not None else None)
+            value = (unpacked.obj_type_num, unpacked.obj_chunks)
+            self._cache[offset] = value
+        return value
+
+    def _walk_all_chains(self):
+        for result in self._entries:
+            yield result
+        # Deltas against objects that were resolved while recording, but
+        # were no longer (or not yet) in the cache at the time.
+        for base_offset in [offset for offset in self._pending_ofs
+                            if offset in self._resolved]:
+            type_num, chunks = self._resolved_object(base_offset)
+            for new_offset in self._pending_ofs.pop(base_offset, []):
+                for result in self._follow_chain(new_offset, type_num, chunks):
+                    yield result
+        for base_sha in [sha for sha in self._pending_ref
+                         if sha in self._sha_offsets]:
+            type_num, chunks = self._resolved_object(
+                self._sha_offsets[base_sha])
+            for new_offset in self._pending_ref.pop(base_sha, []):
+                for result in self._follow_chain(new_offset, type_num, chunks):
+                    yield result
+        for result in self._walk_ref_chains():
+            yield result
+        assert not self._pending_ofs
+
+
 class PackInflater(DeltaChainIterator):
     """Delta chain iterator that yields ShaFile objects."""
 
@@ -1457,22 +2341,41 @@ def pack_object_header(type_num, delta_base, size):
     return bytearray(header)
 
 
-def write_pack_object(f, type, object, sha=None):
+def write_pack_object(f, type, object, sha=None, compression_level=-1):
     """Write pack object to a file.
 
     :param f: File to write to
     :param type: Numeric type of the object
     :param object: Object to write
+    :param compression_level: zlib compression level, -1 for the default
     :return: Tuple with offset at which the object was written, and crc32
     """
     if type in DELTA_TYPES:
         delta_base, object = object
     else:
         delta_base = None
-    header = bytes(pack_object_header(type, delta_base, len(object)))
-    comp_data = zlib.compress(object)
-    crc32 = 0
-    for data in (header, comp_data):
+    return write_compressed_pack_object(
+        f, type, delta_base, len(object),
+        [zlib.compress(object, compression_level)], sha=sha)
+
+
+def write_compressed_pack_object(f, type, delta_base, size, comp_chunks,
+                                 sha=None):
+    """Write a pack object whose data has already been compressed.
+
+    :param f: File to write to
+    :param type: Numeric type of the object
+    :param delta_base: Delta base offset or ref, or None for whole objects
+    :param size: Uncompressed size of the object
+    :param comp_chunks: List of chunks of zlib compressed data
+    :return: crc32 of the written object
+    """
+    header = bytes(pack_object_header(type, delta_base, size))
+    crc32 = binascii.crc32(header)
+    f.write(header)
+    if sha is not None:
+        sha.update(header)
+    for data in comp_chunks:
         f.write(data)
         if sha is not None:
             sha.update(data)
@@ -1480,7 +2383,10 @@ def write_pack_object(f, type, object, sha=None):
     return crc32 & 0xffffffff
 
 
-def write_pack(filename, objects, deltify=None, delta_window_size=None):
+def write_pack(filename, objects, deltify=None, delta_window_size=None,
+               delta_window_memory=None, compression_threads=1,
+               delta_processes=1, compression_level=-1,
+               delta_max_depth=None):
     """Write a new pack data file.
 
     :param filename: Path to the new pack file (without .pack extension)
@@ -1488,17 +2394,57 @@ def write_pack(filename, objects, deltify=None, delta_window_size=None):
         Should provide __len__
     :param window_size: Delta window size
     :param deltify: Whether to deltify pack objects
+    :param delta_window_memory: Maximum total size in bytes of the objects
+        in the delta window; None for no limit
+    :param compression_threads: Number of threads to compress objects in,
+        or None for the number of CPUs
+    :param delta_processes: Number of processes to deltify objects in, or
+        None for the number of CPUs
+    :param compression_level: zlib compression level, -1 for the default
+    :param delta_max_depth: Maximum length of delta chains; None for no
+        limit
     :return: Tuple with checksum of pack file and index file
     """
     with GitFile(filename + '.pack', 'wb') as f:
         entries, data_sum = write_pack_objects(f, objects,
-            delta_window_size=delta_window_size, deltify=deltify)
-    entries = [(k, v[0], v[1]) for (k, v) in entries.items()]
-    entries.sort()
+            delta_window_size=delta_window_size, deltify=deltify,
+            delta_window_memory=delta_window_memory,
+            compression_threads=compression_threads,
+            delta_processes=delta_processes,
+            compression_level=compression_level,
+            delta_max_depth=delta_max_depth)
     with GitFile(filename + '.idx', 'wb') as f:
         return data_sum, write_pack_index_v2(f, entries, data_sum)
 
 
+def pack_write_options(config):
+    """Determine the options for writing packs from a git configuration.
+
+    This reads pack.compression (falling back to core.compression),
+    pack.window, pack.windowMemory and pack.depth, with the defaults git
+    uses for them. As in git, a pack.window of 0 disables deltification.
+
+    :param config: Config to read, e.g. from Repo.get_config_stack()
+    :return: Dict with keyword arguments for write_pack_objects
+    """
+    compression_level = config.get_int((b'pack', ), b'compression')
+    if compression_level is None:
+        compression_level = config.get_int((b'core', ), b'compression', -1)
+    if not -1 <= compression_level <= 9:
+        raise ValueError('invalid compression level %d' % compression_level)
+    window_size = config.get_int(
+        (b'pack', ), b'window', DEFAULT_PACK_DELTA_WINDOW_SIZE)
+    window_memory = config.get_int((b'pack', ), b'windowmemory', 0)
+    return {
+        'compression_level': compression_level,
+        'deltify': window_size > 0,
+        'delta_window_size': window_size,
+        'delta_window_memory': window_memory or None,
+        'delta_max_depth': config.get_int(
+            (b'pack', ), b'depth', DEFAULT_PACK_DELTA_DEPTH),
+        }
+
+
 def write_pack_header(f, num_objects):
     """Write a pack header for the given number of objects."""
     f.write(b'PACK')                          # Pack header
@@ -1506,43 +2452,253 @@ def write_pack_header(f, num_objects):
     f.write(struct.pack(b'>L', num_objects))  # Number of objects in pack
 
 
-def deltify_pack_objects(objects, window_size=None):
+def deltify_pack_objects(objects, window_size=None, window_memory=None,
+                         processes=1, segment_size=None, overlap=None,
+                         max_depth=None):
     """Generate deltas for pack objects.
 
+    In parallel mode the sorted objects are split into runs of a single
+    type, and each run into contiguous segments that are deltified in a
+    pool of worker processes. The window of a segment is first filled with
+    the objects preceding it, so with the default overlap every object is
+    compared against the same candidates as in serial mode. Results are
+    still yielded in order. Objects whose delta would exceed max_depth
+    because of the deltas chosen in the preceding segment are yielded
+    whole.
+
     :param objects: An iterable of (object, path) tuples to deltify.
     :param window_size: Window size; None for default
+    :param window_memory: Maximum total size in bytes of the objects in the
+        window; None for no limit
+    :param processes: Number of worker processes to deltify in, or None
+        for the number of CPUs
+    :param segment_size: Number of objects per segment in parallel mode;
+        None to split each run into about four segments per process
+    :param overlap: Number of objects before a segment that are put in its
+        window; None for the window size
+    :param max_depth: Maximum length of the delta chains; None for no limit
     :return: Iterator over type_num, object id, delta_base, content
         delta_base is None for full text entries
     """
     if window_size is None:
         window_size = DEFAULT_PACK_DELTA_WINDOW_SIZE
+    if processes is None:
+        processes = multiprocessing.cpu_count()
     # Build a list of objects ordered by the magic Linus heuristic
     # This helps us find good objects to diff against us
     magic = []
     for obj, path in objects:
         magic.append((obj.type_num, path, -obj.raw_length(), obj))
     magic.sort()
-
+    items = ((type_num, o.sha().digest(), o.as_raw_string())
+             for (type_num, path, neg_length, o) in magic)
+    if processes <= 1:
+        return _deltify_sorted(items, window_size, window_memory, max_depth)
+    if overlap is None:
+        overlap = window_size
+    return _deltify_sorted_parallel(
+        list(items), window_size, window_memory, max_depth, processes,
+        segment_size, overlap)
+
+
+def _deltify_sorted(items, window_size, window_memory, max_depth, primed=0):
+    """Deltify objects that have been sorted by the Linus heuristic.
+
+    :param items: Iterable over (type_num, sha, raw) tuples
+    :param primed: Number of objects at the start of items that are only
+        put in the window, not yielded. Their delta depth is taken to be 0.
+    """
+    # The window holds (type_num, sha, DeltaIndex, depth) tuples, so each
+    # object is serialized and indexed only once however many targets it is
+    # tried for.
     possible_bases = deque()
+    window_bytes = 0
+
+    for i, (type_num, sha, raw) in enumerate(items):
+        winner_depth = 0
+        if i >= primed:
+            winner = raw
+            winner_base = None
+            for (base_type_num, base_sha, base_index,
+                 base_depth) in possible_bases:
+                if base_type_num != type_num:
+                    continue
+                if max_depth is not None and base_depth >= max_depth:
+                    continue
+                delta = base_index.create_delta(raw)
+                if len(delta) < len(winner):
+                    winner_base = base_sha
+                    winner = delta
+                    winner_depth = base_depth + 1
+            yield type_num, sha, winner_base, winner
+        possible_bases.appendleft(
+            (type_num, sha, DeltaIndex(raw), winner_depth))
+        window_bytes += len(raw)
+        while len(possible_bases) > window_size or (
+                window_memory is not None and window_bytes > window_memory and
+                len(possible_bases) > 1):
+            window_bytes -= len(possible_bases.pop()[2])
+
+
+def _deltify_segment(args):
+    return list(_deltify_sorted(*args))
+
+
+def _deltify_sorted_parallel(items, window_size, window_memory, max_depth,
+                             processes, segment_size, overlap):
+    # Objects are only deltified against objects of the same type, so runs
+    # of a single type can be deltified independently.
+    runs = []
+    start = 0
+    for i in range(1, len(items) + 1):
+        if i == len(items) or items[i][0] != items[start][0]:
+            runs.append((start, i))
+            start = i
+    segments = []
+    for start, end in runs:
+        if segment_size is None:
+            size = max(1, -(-(end - start) // (processes * 4)))
+        else:
+            size = segment_size
+        for seg_start in range(start, end, size):
+            primed_start = max(start, seg_start - overlap)
+            segments.append((
+                items[primed_start:min(end, seg_start + size)],
+                window_size, window_memory, max_depth,
+                seg_start - primed_start))
+    del items
+    if len(segments) <= 1:
+        for args in segments:
+            for result in _deltify_sorted(*args):
+                yield result
+        return
+    # Depths of the objects in the current run. Workers do not know the
+    # depths of the objects they were primed with, so the limit is enforced
+    # here.
+    depths = {}
+    run_type = None
+    pool = multiprocessing.Pool(min(processes, len(segments)))
+    try:
+        for args, results in izip(
+                segments, pool.imap(_deltify_segment, segments)):
+            seg_items = args[0][args[-1]:]
+            for (type_num, sha, raw), result in izip(seg_items, results):
+                if max_depth is None:
+                    yield result
+                    continue
+                if type_num != run_type:
+                    depths.clear()
+                    run_type = type_num
+                delta_base = result[2]
+                if delta_base is None:
+                    depths[sha] = 0
+                elif depths[delta_base] >= max_depth:
+                    depths[sha] = 0
+                    result = (type_num, sha, None, raw)
+                else:
+                    depths[sha] = depths[delta_base] + 1
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
 
-    for type_num, path, neg_length, o in magic:
-        raw = o.as_raw_string()
-        winner = raw
-        winner_base = None
-        for base in possible_bases:
-            if base.type_num != type_num:
-                continue
-            delta = create_delta(base.as_raw_string(), raw)
-            if len(delta) < len(winner):
-                winner_base = base.sha().digest()
-                winner = delta
-        yield type_num, o.sha().digest(), winner_base, winner
-        possible_bases.appendleft(o)
-        while len(possible_bases) > window_size:
-            possible_bases.pop()
 
+def _find_reusable_deltas(objects, object_store):
+    """Find the objects that can be copied as deltas from an object store.
+
+    An object can be copied if it is stored as a delta against another object
+    that is also being written. If such deltas turn out to form a cycle
+    (which can happen when they come from different packs), one of the
+    objects in the cycle is written whole instead.
 
-def write_pack_objects(f, objects, delta_window_size=None, deltify=False):
+    :param objects: List of (object, path) tuples that are being written
+    :param object_store: Object store to copy deltas from
+    :return: Dict mapping the binary SHAs of the objects that can be copied
+        to the binary SHAs of their bases, and list of those SHAs ordered so
+        that bases come before the deltas against them
+    """
+    shas = set(o.sha().digest() for (o, path) in objects)
+    bases = {}
+    for o, path in objects:
+        sha = o.sha().digest()
+        try:
+            unpacked = object_store.get_object_header(sha)
+        except KeyError:
+            continue
+        if (unpacked.pack_type_num == REF_DELTA and
+                unpacked.delta_base in shas):
+            bases[sha] = unpacked.delta_base
+    order = []
+    done = set()
+    for sha in list(bases):
+        walk = []
+        while sha in bases and sha not in done:
+            if sha in walk:
+                # Break the cycle by writing this object whole.
+                del bases[sha]
+                break
+            walk.append(sha)
+            sha = bases[sha]
+        for sha in reversed(walk):
+            done.add(sha)
+            if sha in bases:
+                order.append(sha)
+    return bases, order
+
+
+def _reused_delta_records(by_sha, bases, order, object_store, depths=None,
+                          max_depth=None):
+    """Generate write_pack_data records for deltas copied from a store.
+
+    Objects whose delta fails the CRC32 check, or is no longer stored against
+    the expected base, are written whole instead. So are objects whose delta
+    would make a chain longer than max_depth.
+
+    :param depths: Dict mapping the binary SHAs of the objects that were
+        written before to their delta depth; updated with the depths of the
+        objects generated here. Only used if max_depth is set.
+    :param max_depth: Maximum length of delta chains; None for no limit
+    """
+    for sha in order:
+        base = bases[sha]
+        if max_depth is not None and depths[base] >= max_depth:
+            unpacked = None
+        else:
+            try:
+                unpacked = object_store.get_compressed_object(sha)
+            except (KeyError, ChecksumMismatch):
+                unpacked = None
+        if unpacked is None or unpacked.delta_base != base:
+            o = by_sha[sha]
+            if max_depth is not None:
+                depths[sha] = 0
+            yield o.type_num, sha, None, o.as_raw_string()
+        else:
+            if max_depth is not None:
+                depths[sha] = depths[base] + 1
+            yield REF_DELTA, sha, unpacked.delta_base, unpacked
+
+
+def _record_delta_depths(records, depths):
+    """Record the delta depth of each object in an iterable of records.
+
+    :param records: Iterable over type_num, object_id, delta_base, raw
+    :param depths: Dict to store the depths in, by object id
+    :return: Iterator over the records
+    """
+    for record in records:
+        delta_base = record[2]
+        if delta_base is None:
+            depths[record[1]] = 0
+        else:
+            depths[record[1]] = depths[delta_base] + 1
+        yield record
+
+
+def write_pack_objects(f, objects, delta_window_size=None, deltify=False,
+                       delta_window_memory=None, reuse_deltas_from=None,
+                       compression_threads=1, delta_processes=1,
+                       compression_level=-1, delta_max_depth=None):
     """Write a new pack data file.
 
     :param f: File to write to
@@ -1551,46 +2707,364 @@ def write_pack_objects(f, objects, delta_window_size=None, deltify=False):
     :param window_size: Sliding window size for searching for deltas;
                         Set to None for default window size.
     :param deltify: Whether to deltify objects
-    :return: Dict mapping id -> (offset, crc32 checksum), pack checksum
+    :param delta_window_memory: Maximum total size in bytes of the objects
+        in the delta window; None for no limit
+    :param reuse_deltas_from: Optional object store the objects come from.
+        Objects that it has packed as a delta against another object that
+        is also written are copied from its packs as they are.
+    :param compression_threads: Number of threads to compress objects in,
+        or None for the number of CPUs
+    :param delta_processes: Number of processes to deltify objects in, or
+        None for the number of CPUs
+    :param compression_level: zlib compression level, -1 for the default
+    :param delta_max_depth: Maximum length of delta chains; None for no
+        limit. Copied deltas that would make a chain longer than this are
+        written whole.
+    :return: PackIndexEntries mapping id -> (offset, crc32 checksum), pack
+        checksum
     """
+    num_records = len(objects)
+    reused = iter([])
+    depths = None
+    if reuse_deltas_from is not None:
+        objects = list(objects)
+        bases, order = _find_reusable_deltas(objects, reuse_deltas_from)
+        if bases:
+            by_sha = dict((o.sha().digest(), o) for (o, path) in objects)
+            if delta_max_depth is not None:
+                depths = {}
+            reused = _reused_delta_records(
+                by_sha, bases, order, reuse_deltas_from, depths,
+                delta_max_depth)
+            objects = [(o, path) for (o, path) in objects
+                       if o.sha().digest() not in bases]
     if deltify:
-        pack_contents = deltify_pack_objects(objects, delta_window_size)
+        pack_contents = deltify_pack_objects(
+            objects, delta_window_size, window_memory=delta_window_memory,
+            processes=delta_processes, max_depth=delta_max_depth)
     else:
         pack_contents = (
             (o.type_num, o.sha().digest(), None, o.as_raw_string())
             for (o, path) in objects)
+    if depths is not None:
+        # The copied deltas are written last, against bases whose depth
+        # is then known.
+        pack_contents = _record_delta_depths(pack_contents, depths)
+
+    return write_pack_data(f, num_records, chain(pack_contents, reused),
+                           compression_threads=compression_threads,
+                           compression_level=compression_level)
 
-    return write_pack_data(f, len(objects), pack_contents)
 
+# Number of objects per compression thread that write_pack_data compresses
+# ahead of the object it is writing.
+_COMPRESSION_WINDOW_PER_THREAD = 4
 
-def write_pack_data(f, num_records, records):
+
+def write_pack_data(f, num_records, records, compression_threads=1,
+                    compression_level=-1):
     """Write a new pack data file.
 
+    With more than one compression thread, objects are compressed in a
+    pool of threads (zlib releases the GIL while compressing) a bounded
+    number of objects ahead of the one being written. Objects are still
+    written in order, so delta base offsets are computed as usual.
+
     :param f: File to write to
     :param num_records: Number of records
-    :param records: Iterator over type_num, object_id, delta_base, raw
-    :return: Dict mapping id -> (offset, crc32 checksum), pack checksum
+    :param records: Iterator over type_num, object_id, delta_base, raw.
+        raw is either the uncompressed data, or an UnpackedObject with
+        comp_chunks set, whose compressed data is copied verbatim.
+    :param compression_threads: Number of threads to compress objects in,
+        or None for the number of CPUs
+    :param compression_level: zlib compression level, -1 for the default
+    :return: PackIndexEntries mapping id -> (offset, crc32 checksum), pack
+        checksum
     """
+    if compression_threads is None:
+        compression_threads = multiprocessing.cpu_count()
     # Write the pack
-    entries = {}
+    entries = PackIndexEntries()
     f = SHA1Writer(f)
     write_pack_header(f, num_records)
-    for type_num, object_id, delta_base, raw in records:
+
+    def write(type_num, object_id, delta_base, size, comp_chunks):
         offset = f.offset()
         if delta_base is not None:
             try:
-                base_offset, base_crc32 = entries[delta_base]
+                base_offset = entries.offset(delta_base)
             except KeyError:
                 type_num = REF_DELTA
-                raw = (delta_base, raw)
             else:
                 type_num = OFS_DELTA
-                raw = (offset - base_offset, raw)
-        crc32 = write_pack_object(f, type_num, raw)
-        entries[object_id] = (offset, crc32)
+                delta_base = offset - base_offset
+        if not isinstance(comp_chunks, list):
+            # Still being compressed by the pool.
+            comp_chunks = [comp_chunks.get()]
+        crc32 = write_compressed_pack_object(
+            f, type_num, delta_base, size, comp_chunks)
+        entries.add(object_id, offset, crc32)
+
+    if compression_threads > 1:
+        pool = ThreadPool(compression_threads)
+        window = compression_threads * _COMPRESSION_WINDOW_PER_THREAD
+    else:
+        pool = None
+        window = 0
+    pending = deque()
+    try:
+        for type_num, object_id, delta_base, raw in records:
+            if isinstance(raw, UnpackedObject):
+                if delta_base is None:
+                    type_num = raw.pack_type_num
+                size = raw.decomp_len
+                comp_chunks = raw.comp_chunks
+            else:
+                size = len(raw)
+                if pool is None:
+                    comp_chunks = [zlib.compress(raw, compression_level)]
+                else:
+                    comp_chunks = pool.apply_async(
+                        zlib.compress, (raw, compression_level))
+            pending.append(
+                (type_num, object_id, delta_base, size, comp_chunks))
+            while len(pending) > window:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
     return entries, f.write_sha()
 
 
+try:
+    array.array('Q')
+except ValueError:  # Python 2 has no 'Q' array type code.
+    if array.array('L').itemsize >= 8:
+        _OFFSET_ARRAY_TYPE = 'L'
+    else:
+        # Offsets beyond 4 GiB don't fit in a C long here.
+        _OFFSET_ARRAY_TYPE = None
+else:
+    _OFFSET_ARRAY_TYPE = 'Q'
+
+
+def _offset_array(values=()):
+    """Create a compact sequence of pack offsets.
+
+    :param values: List of offsets
+    :return: An array of 64-bit integers, or a list if there is no array
+        type that can hold them
+    """
+    if _OFFSET_ARRAY_TYPE is None:
+        return list(values)
+    return array.array(_OFFSET_ARRAY_TYPE, values)
+
+
+def sort_names(names):
+    """Sort concatenated 20-byte object names.
+
+    :param names: Concatenated binary SHAs
+    :return: Tuple with the concatenated binary SHAs in sorted order, and
+        the bytes of an 'I' array with the original position of each
+    """
+    order = sorted(range(len(names) // 20),
+                   key=lambda i: names[i*20:(i+1)*20])
+    names = b''.join([bytes(names[i*20:(i+1)*20]) for i in order])
+    order = array.array('I', order)
+    if sys.version_info[0] == 2:
+        return names, order.tostring()
+    return names, order.tobytes()
+
+
+# Decodes the first bytes of an object name, to pick its hash table slot.
+_NAME_HASH = struct.Struct('>L')
+
+
+class PackIndexEntries(MutableMapping):
+    """Index entries for the objects written to a pack.
+
+    This maps object names to (offset, crc32) tuples, like the dict it
+    replaces. Rather than keeping objects per entry, the names, offsets
+    and CRC32 checksums are kept in flat arrays. Names are found through
+    an open addressing hash table of positions in those arrays, slotted by
+    the first bytes of the name, and are sorted when the index is written.
+    """
+
+    def __init__(self):
+        self._names = bytearray()
+        self._offsets = _offset_array()
+        self._crc32s = array.array('I')
+        # Position plus one of the entry in each slot, or 0 if it is empty.
+        self._table = array.array('I', [0]) * 16
+        # Positions of the entries that were deleted.
+        self._deleted = set()
+
+    def __len__(self):
+        return len(self._crc32s) - len(self._deleted)
+
+    def _find(self, name):
+        """Return the position of an entry, or None if it is not present."""
+        if len(name) != 20:
+            return None
+        table = self._table
+        names = self._names
+        mask = len(table) - 1
+        slot = _NAME_HASH.unpack_from(name)[0] & mask
+        while table[slot]:
+            i = table[slot] - 1
+            if names[i*20:(i+1)*20] == name and i not in self._deleted:
+                return i
+            slot = (slot + 1) & mask
+        return None
+
+    def _rehash(self, size):
+        """Rebuild the hash table with a number of slots (a power of two)."""
+        table = array.array('I', [0]) * size
+        names = self._names
+        mask = size - 1
+        unpack_from = _NAME_HASH.unpack_from
+        for i in range(len(self._crc32s)):
+            if i in self._deleted:
+                continue
+            slot = unpack_from(names, i * 20)[0] & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = i + 1
+        self._table = table
+
+    def _compact(self):
+        """Drop the deleted entries from the arrays."""
+        deleted = self._deleted
+        live = [i for i in range(len(self._crc32s)) if i not in deleted]
+        names = self._names
+        self._names = bytearray().join([names[i*20:(i+1)*20] for i in live])
+        self._offsets = _offset_array([self._offsets[i] for i in live])
+        self._crc32s = array.array('I', [self._crc32s[i] for i in live])
+        self._deleted = set()
+        self._rehash(len(self._table))
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def __iter__(self):
+        names = self._names
+        deleted = self._deleted
+        for i in range(len(self._crc32s)):
+            if i not in deleted:
+                yield bytes(names[i*20:(i+1)*20])
+
+    def __getitem__(self, name):
+        """Return the (offset, crc32) tuple for an object name."""
+        i = self._find(name)
+        if i is None:
+            raise KeyError(name)
+        return (self._offsets[i], self._crc32s[i])
+
+    def __setitem__(self, name, value):
+        self.add(name, value[0], value[1])
+
+    def __delitem__(self, name):
+        # The array slots are left unused until the arrays are compacted.
+        i = self._find(name)
+        if i is None:
+            raise KeyError(name)
+        self._deleted.add(i)
+
+    def __repr__(self):
+        return '%s(%d entries)' % (self.__class__.__name__, len(self))
+
+    def add(self, name, offset, crc32):
+        """Add an entry.
+
+        :param name: Binary SHA of the object
+        :param offset: Offset of the object in the pack
+        :param crc32: CRC32 checksum of the object as stored in the pack
+        """
+        if len(name) != 20:
+            raise ValueError('Invalid object name %r' % name)
+        count = len(self._crc32s)
+        if (count + 1) * 2 > len(self._table):
+            if self._deleted:
+                self._compact()
+                count = len(self._crc32s)
+            self._rehash(len(self._table) * 2)
+        table = self._table
+        names = self._names
+        mask = len(table) - 1
+        slot = _NAME_HASH.unpack_from(name)[0] & mask
+        while table[slot]:
+            i = table[slot] - 1
+            if names[i*20:(i+1)*20] == name and i not in self._deleted:
+                self._offsets[i] = offset
+                self._crc32s[i] = crc32
+                return
+            slot = (slot + 1) & mask
+        names += name
+        self._offsets.append(offset)
+        self._crc32s.append(crc32)
+        table[slot] = count + 1
+
+    def offset(self, name):
+        """Return the offset of an object in the pack."""
+        i = self._find(name)
+        if i is None:
+            raise KeyError(name)
+        return self._offsets[i]
+
+    def iterentries(self):
+        """Iterate over (name, offset, crc32) tuples, sorted by name."""
+        names, offsets, crc32s = self.sorted_columns()
+        for i in range(len(offsets)):
+            yield names[i*20:(i+1)*20], offsets[i], crc32s[i]
+
+    def sorted_columns(self):
+        """Return the entries as columns, sorted by name.
+
+        :return: Tuple with the concatenated binary SHAs, an array with the
+            offsets and an array with the CRC32 checksums
+        """
+        if self._deleted:
+            self._compact()
+        names, order = sort_names(self._names)
+        order = array.array('I', order)
+        offsets = self._offsets
+        crc32s = self._crc32s
+        return (names,
+                _offset_array(offsets[i] for i in order),
+                array.array('I', (crc32s[i] for i in order)))
+
+
+def _index_entry_columns(entries):
+    """Convert a list of index entry tuples to columns.
+
+    :param entries: List of (name, offset, crc32) tuples
+    :return: Tuple as returned by PackIndexEntries.sorted_columns(), in the
+        same order as entries
+    """
+    return (b''.join([entry[0] for entry in entries]),
+            _offset_array([entry[1] for entry in entries]),
+            array.array('I', [entry[2] for entry in entries]))
+
+
+# Number of values packed at a time by _write_be_values.
+_PACK_VALUES_CHUNK_SIZE = 1 << 16
+
+
+def _write_be_values(f, fmt, values):
+    """Write a sequence of integers in big endian byte order.
+
+    :param f: File-like object to write to
+    :param fmt: struct format character for a single value
+    :param values: Sequence of integers
+    """
+    for i in range(0, len(values), _PACK_VALUES_CHUNK_SIZE):
+        chunk = values[i:i + _PACK_VALUES_CHUNK_SIZE]
+        f.write(struct.pack('>%d%s' % (len(chunk), fmt), *chunk))
+
+
 def write_pack_index_v1(f, entries, pack_checksum):
     """Write a new pack index file.
 
@@ -1648,47 +3122,126 @@ def _encode_copy_operation(start, length):
     return bytearray([op] + scratch)
 
 
+# Size of the blocks of the delta source that are indexed by DeltaIndex.
+_DELTA_BLOCK_SIZE = 16
+
+# Maximum number of offsets DeltaIndex keeps for blocks with the same content.
+_DELTA_BLOCK_LIMIT = 64
+
+
+def _common_prefix_length(a, a_start, b, b_start):
+    """Find the length of the common prefix of a[a_start:] and b[b_start:]."""
+    max_len = min(len(a) - a_start, len(b) - b_start)
+    length = 0
+    step = _DELTA_BLOCK_SIZE
+    while step and length < max_len:
+        n = min(step, max_len - length)
+        if (a[a_start+length:a_start+length+n] ==
+                b[b_start+length:b_start+length+n]):
+            length += n
+            step *= 2
+        else:
+            step //= 2
+    return length
+
+
+def _encode_insert_operations(out_buf, data):
+    """Append insert operations for data to out_buf."""
+    for i in range(0, len(data), 127):
+        chunk = data[i:i+127]
+        out_buf.append(len(chunk))
+        out_buf += chunk
+
+
+def _encode_copy_operations(out_buf, copy_start, copy_len):
+    """Append copy operations for a range of the source to out_buf."""
+    while copy_len > 0:
+        to_copy = min(copy_len, _MAX_COPY_LEN)
+        out_buf += _encode_copy_operation(copy_start, to_copy)
+        copy_start += to_copy
+        copy_len -= to_copy
+
+
+class DeltaIndex(object):
+    """Index of a delta source, for creating deltas against it.
+
+    The source is split up into blocks of _DELTA_BLOCK_SIZE bytes. Creating a
+    delta looks up every block-sized window of the target in the index and
+    copies the longest matching run from the source. Since building the index
+    is the expensive part, an index can be reused to create deltas against the
+    same source for several targets.
+    """
+
+    def __init__(self, base_buf):
+        """Create a new DeltaIndex.
+
+        :param base_buf: Source buffer, as bytes
+        """
+        assert isinstance(base_buf, bytes)
+        self.base = base_buf
+        self._blocks = {}
+        for offset in range(0, len(base_buf) - _DELTA_BLOCK_SIZE + 1,
+                            _DELTA_BLOCK_SIZE):
+            offsets = self._blocks.setdefault(
+                base_buf[offset:offset+_DELTA_BLOCK_SIZE], [])
+            if len(offsets) < _DELTA_BLOCK_LIMIT:
+                offsets.append(offset)
+
+    def __len__(self):
+        """Return the size of the source."""
+        return len(self.base)
+
+    def create_delta(self, target_buf):
+        """Create a delta that transforms the source into target_buf.
+
+        :param target_buf: Target buffer, as bytes
+        :return: Delta, as bytes
+        """
+        assert isinstance(target_buf, bytes)
+        base_buf = self.base
+        blocks = self._blocks
+        out_buf = bytearray()
+        out_buf += _delta_encode_size(len(base_buf))
+        out_buf += _delta_encode_size(len(target_buf))
+        insert_start = 0
+        i = 0
+        end = len(target_buf) - _DELTA_BLOCK_SIZE
+        while i <= end:
+            offsets = blocks.get(target_buf[i:i+_DELTA_BLOCK_SIZE])
+            if offsets is None:
+                i += 1
+                continue
+            best_len = 0
+            for offset in offsets:
+                length = _DELTA_BLOCK_SIZE + _common_prefix_length(
+                    base_buf, offset + _DELTA_BLOCK_SIZE,
+                    target_buf, i + _DELTA_BLOCK_SIZE)
+                if length > best_len:
+                    best_offset, best_len = offset, length
+            # Take any preceding data that also matches from the source,
+            # rather than inserting it.
+            while (i > insert_start and best_offset > 0 and
+                   base_buf[best_offset-1:best_offset] ==
+                   target_buf[i-1:i]):
+                i -= 1
+                best_offset -= 1
+                best_len += 1
+            _encode_insert_operations(out_buf, target_buf[insert_start:i])
+            _encode_copy_operations(out_buf, best_offset, best_len)
+            i += best_len
+            insert_start = i
+        _encode_insert_operations(out_buf, target_buf[insert_start:])
+        return bytes(out_buf)
+
+
 def create_delta(base_buf, target_buf):
-    """Use python difflib to work out how to transform base_buf to target_buf.
+    """Work out how to transform base_buf to target_buf.
 
     :param base_buf: Base buffer
     :param target_buf: Target buffer
+    :return: Delta, as bytes
     """
-    assert isinstance(base_buf, bytes)
-    assert isinstance(target_buf, bytes)
-    out_buf = bytearray()
-    # write delta header
-    out_buf += _delta_encode_size(len(base_buf))
-    out_buf += _delta_encode_size(len(target_buf))
-    # write out delta opcodes
-    seq = difflib.SequenceMatcher(a=base_buf, b=target_buf)
-    for opcode, i1, i2, j1, j2 in seq.get_opcodes():
-        # Git patch opcodes don't care about deletes!
-        #if opcode == 'replace' or opcode == 'delete':
-        #    pass
-        if opcode == 'equal':
-            # If they are equal, unpacker will use data from base_buf
-            # Write out an opcode that says what range to use
-            copy_start = i1
-            copy_len = i2 - i1
-            while copy_len > 0:
-                to_copy = min(copy_len, _MAX_COPY_LEN)
-                out_buf += _encode_copy_operation(copy_start, to_copy)
-                copy_start += to_copy
-                copy_len -= to_copy
-        if opcode == 'replace' or opcode == 'insert':
-            # If we are replacing a range or adding one, then we just
-            # output it to the stream (prefixed by its size)
-            s = j2 - j1
-            o = j1
-            while s > 127:
-                out_buf.append(127)
-                out_buf += bytearray(target_buf[o:o+127])
-                s -= 127
-                o += 127
-            out_buf.append(s)
-            out_buf += bytearray(target_buf[o:o+s])
-    return bytes(out_buf)
+    return DeltaIndex(base_buf).create_delta(target_buf)
 
 
 def apply_delta(src_buf, delta):
@@ -1760,35 +3313,41 @@ def apply_delta(src_buf, delta):
 def write_pack_index_v2(f, entries, pack_checksum):
     """Write a new pack index file.
 
+    The index is written from the entries as columns, rather than by
+    walking over the entries once for every table.
+
     :param f: File-like object to write to
     :param entries: List of tuples with object name (sha), offset_in_pack, and
-        crc32_checksum.
+        crc32_checksum, sorted by name; or a PackIndexEntries.
     :param pack_checksum: Checksum of the pack file.
     :return: The SHA of the index file written
     """
+    if isinstance(entries, PackIndexEntries):
+        names, offsets, crc32s = entries.sorted_columns()
+    else:
+        names, offsets, crc32s = _index_entry_columns(entries)
     f = SHA1Writer(f)
     f.write(b'\377tOc')  # Magic!
     f.write(struct.pack('>L', 2))
-    fan_out_table = defaultdict(lambda: 0)
-    for (name, offset, entry_checksum) in entries:
-        fan_out_table[ord(name[:1])] += 1
-    # Fan-out table
+    # Fan-out table; the names are sorted, so the number of names with a
+    # first byte up to i can be found by bisecting the first bytes.
+    first_bytes = bytearray(names[::20])
+    f.write(struct.pack('>256L', *[
+        bisect.bisect_right(first_bytes, i) for i in range(0x100)]))
+    f.write(names)
+    _write_be_values(f, 'L', crc32s)
     largetable = []
-    for i in range(0x100):
-        f.write(struct.pack(b'>L', fan_out_table[i]))
-        fan_out_table[i+1] += fan_out_table[i]
-    for (name, offset, entry_checksum) in entries:
-        f.write(name)
-    for (name, offset, entry_checksum) in entries:
-        f.write(struct.pack(b'>L', entry_checksum))
-    for (name, offset, entry_checksum) in entries:
-        if offset < 2**31:
-            f.write(struct.pack(b'>L', offset))
-        else:
-            f.write(struct.pack(b'>L', 2**31 + len(largetable)))
-            largetable.append(offset)
-    for offset in largetable:
-        f.write(struct.pack(b'>Q', offset))
+    if offsets and max(offsets) >= 2**31:
+        small_offsets = array.array('I')
+        for offset in offsets:
+            if offset < 2**31:
+                small_offsets.append(offset)
+            else:
+                small_offsets.append(2**31 + len(largetable))
+                largetable.append(offset)
+        offsets = small_offsets
+    _write_be_values(f, 'L', offsets)
+    _write_be_values(f, 'Q', largetable)
     assert len(pack_checksum) == 20
     f.write(pack_checksum)
     return f.write_sha()
@@ -1797,17 +3356,45 @@ def write_pack_index_v2(f, entries, pack_checksum):
 write_pack_index = write_pack_index_v2
 
 
+def write_pack_rev_index(f, entries, pack_checksum):
+    """Write a reverse index file for a pack.
+
+    :param f: File-like object to write to
+    :param entries: List of tuples with object name (sha), offset_in_pack,
+        and crc32_checksum, sorted by name, as for write_pack_index_v2.
+    :param pack_checksum: Checksum of the pack file.
+    :return: The SHA of the reverse index file written
+    """
+    f = SHA1Writer(f)
+    f.write(b'RIDX')
+    f.write(struct.pack(b'>LL', 1, 1))
+    offsets = [entry[1] for entry in entries]
+    for i in sorted(range(len(offsets)), key=offsets.__getitem__):
+        f.write(struct.pack(b'>L', i))
+    assert len(pack_checksum) == 20
+    f.write(pack_checksum)
+    return f.write_sha()
+
+
 class Pack(object):
     """A Git pack object."""
 
-    def __init__(self, basename, resolve_ext_ref=None):
+    def __init__(self, basename, resolve_ext_ref=None, use_mmap=False,
+                 delta_base_cache=None):
         self._basename = basename
         self._data = None
         self._idx = None
         self._idx_path = self._basename + '.idx'
         self._data_path = self._basename + '.pack'
-        self._data_load = lambda: PackData(self._data_path)
+        self._data_load = lambda: PackData(
+            self._data_path, use_mmap=use_mmap,
+            delta_base_cache=delta_base_cache)
         self._idx_load = lambda: load_pack_index(self._idx_path)
+        self._rev_idx = None
+        self._rev_idx_path = self._basename + '.rev'
+        self._bitmap = None
+        self._bitmap_loaded = False
+        self._bitmap_path = self._basename + '.bitmap'
         self.resolve_ext_ref = resolve_ext_ref
 
     @classmethod
@@ -1850,11 +3437,103 @@ class Pack(object):
             self._idx = self._idx_load()
         return self._idx
 
+    @property
+    def rev_index(self):
+        """The reverse index for this pack.
+
+        This is read from the .rev file next to the pack if there is one
+        for the current pack, and generated from the index otherwise.
+        """
+        if self._rev_idx is None:
+            rev_idx = None
+            if self._basename:
+                try:
+                    rev_idx = load_pack_rev_index(
+                        self._rev_idx_path, self.index)
+                except (IOError, OSError) as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                else:
+                    if (rev_idx.get_pack_checksum() !=
+                            self.index.get_pack_checksum()):
+                        rev_idx.close()
+                        rev_idx = None
+            if rev_idx is None:
+                rev_idx = MemoryPackReverseIndex.from_index(self.index)
+            self._rev_idx = rev_idx
+        return self._rev_idx
+
+    @property
+    def bitmap(self):
+        """The bitmap index for this pack.
+
+        This is read from the .bitmap file next to the pack.
+
+        :return: A PackBitmap, or None if there is no bitmap index for the
+            current pack
+        """
+        if not self._bitmap_loaded:
+            bitmap = None
+            if self._basename:
+                from dulwich.bitmap import load_pack_bitmap
+                try:
+                    bitmap = load_pack_bitmap(self._bitmap_path, self.index)
+                except (IOError, OSError) as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                else:
+                    if (bitmap.get_pack_checksum() !=
+                            self.index.get_pack_checksum()):
+                        bitmap.close()
+                        bitmap = None
+            self._bitmap = bitmap
+            self._bitmap_loaded = True
+        return self._bitmap
+
+    def write_bitmap(self, commits=None):
+        """Write a bitmap index for this pack.
+
+        :param commits: Binary SHAs of the commits to store bitmaps for; see
+            build_pack_bitmaps for the default
+        :return: The path of the .bitmap file, as a string.
+        """
+        from dulwich.bitmap import build_pack_bitmaps, write_pack_bitmap
+        type_bitmaps, bitmaps = build_pack_bitmaps(self, commits)
+        index = self.index
+        positions = dict(
+            (bytes(sha), i) for (i, sha) in enumerate(sorted(index._itersha())))
+        entries = [(positions[sha], bitmap) for (sha, bitmap) in bitmaps]
+        with GitFile(self._bitmap_path, 'wb') as f:
+            write_pack_bitmap(f, index.get_pack_checksum(), len(index),
+                              type_bitmaps, entries)
+        if self._bitmap is not None:
+            self._bitmap.close()
+        self._bitmap = None
+        self._bitmap_loaded = False
+        return self._bitmap_path
+
+    def object_size_on_disk(self, sha1):
+        """Return the number of bytes an object takes up in the pack file.
+
+        :param sha1: SHA1 of the object
+        :raise KeyError: if the object is not present in this pack
+        """
+        offset = self.index.object_index(sha1)
+        next_offset = self.rev_index.next_offset(offset)
+        if next_offset is None:
+            # The last object is followed by the pack checksum
+            next_offset = self.data._get_size() - 20
+        return next_offset - offset
+
     def close(self):
         if self._data is not None:
             self._data.close()
         if self._idx is not None:
             self._idx.close()
+        if self._rev_idx is not None:
+            self._rev_idx.close()
+        if self._bitmap is not None:
+            self._bitmap.close()
 
     def __enter__(self):
         return self
@@ -1907,12 +3586,128 @@ class Pack(object):
         except KeyError:
             return False
 
+    def contains_many(self, shas):
+        """Check which of several objects are in this pack.
+
+        :param shas: Sequence of SHA1s
+        :return: List of booleans, one for each object in shas
+        """
+        return self.index.contains_many(shas)
+
     def get_raw(self, sha1):
         offset = self.index.object_index(sha1)
         obj_type, obj = self.data.get_object_at(offset)
         type_num, chunks = self.data.resolve_object(offset, obj_type, obj)
         return type_num, b''.join(chunks)
 
+    def get_raw_many(self, shas):
+        """Obtain the raw text for several objects in this pack.
+
+        The objects are read in the order in which they appear in the pack
+        rather than in the order they were requested in. Every resolved
+        object is kept in the delta base cache, so deltas later in the
+        batch can be applied against it without resolving it again.
+
+        :param shas: Iterable over SHA1s of objects in this pack
+        :return: Iterator over (sha, type_num, raw) tuples
+        :raise KeyError: if one of the objects is not present in this pack
+        """
+        shas = list(shas)
+        offsets = []
+        for sha, offset in zip(shas, self.index.object_index_many(shas)):
+            if offset is None:
+                raise KeyError(sha)
+            offsets.append((offset, sha))
+        offsets.sort()
+        data = self.data
+        for offset, sha in offsets:
+            obj_type, obj = data.get_object_at(offset)
+            type_num, chunks = data.resolve_object(offset, obj_type, obj)
+            data.delta_base_cache.add(
+                data._cache_key, offset, type_num, chunks)
+            yield sha, type_num, b''.join(chunks)
+
+    def get_unpacked_object(self, sha1, include_comp=False):
+        """Get an object as it is stored in this pack.
+
+        Deltas are not resolved. OFS_DELTA objects are returned as
+        REF_DELTA objects with the SHA of their base, so they can be
+        written to another pack.
+
+        :param sha1: SHA1 of the object
+        :param include_comp: Whether to include the compressed data. Its
+            CRC32 is checked against the one in the pack index.
+        :return: UnpackedObject
+        :raise KeyError: if the object is not present in this pack
+        :raise ChecksumMismatch: if the CRC32 of the object does not match
+            the one in the pack index
+        """
+        offset = self.index.object_index(sha1)
+        unpacked = self.data.get_unpacked_object_at(
+            offset, include_comp=include_comp)
+        if include_comp:
+            rev_index = self.rev_index
+            expected = self.index._unpack_crc32_checksum(
+                rev_index.index_position(rev_index.pack_position(offset)))
+            if expected is not None and expected != unpacked.crc32:
+                raise ChecksumMismatch(
+                    '%08x' % expected, '%08x' % unpacked.crc32)
+        return self._as_ref_delta(unpacked)
+
+    def get_object_header(self, sha1):
+        """Get the type and delta base of an object as it is stored.
+
+        Only the header of the object is read; nothing is inflated.
+        OFS_DELTA objects are returned as REF_DELTA objects, as by
+        get_unpacked_object.
+
+        :param sha1: SHA1 of the object
+        :return: UnpackedObject with pack_type_num, delta_base and decomp_len
+            set, but no data
+        :raise KeyError: if the object is not present in this pack
+        """
+        offset = self.index.object_index(sha1)
+        return self._as_ref_delta(self.data.get_object_header_at(offset))
+
+    def _as_ref_delta(self, unpacked):
+        """Refer to the base of an OFS_DELTA object by SHA instead."""
+        if unpacked.pack_type_num == OFS_DELTA:
+            unpacked.delta_base = bytes(self.rev_index.name_at_offset(
+                unpacked.offset - unpacked.delta_base))
+            unpacked.pack_type_num = REF_DELTA
+        return unpacked
+
+    def get_compressed_object(self, sha1):
+        """Get an object as it is stored in this pack, without inflating it.
+
+        The end of the object is found through the reverse index, and its
+        data is checked against the CRC32 in the pack index rather than by
+        decompressing it. OFS_DELTA objects are returned as REF_DELTA
+        objects, as by get_unpacked_object.
+
+        :param sha1: SHA1 of the object
+        :return: UnpackedObject with comp_chunks and crc32 set, but no
+            decompressed data
+        :raise KeyError: if the object is not present in this pack
+        :raise ChecksumMismatch: if the CRC32 of the object does not match
+            the one in the pack index
+        """
+        offset = self.index.object_index(sha1)
+        rev_index = self.rev_index
+        expected = self.index._unpack_crc32_checksum(
+            rev_index.index_position(rev_index.pack_position(offset)))
+        if expected is None:
+            # Version 1 indexes have no CRC32s, so the only way to check the
+            # data is to inflate it.
+            return self.get_unpacked_object(sha1, include_comp=True)
+        end = rev_index.next_offset(offset)
+        if end is None:
+            end = self.data._get_size() - 20
+        unpacked = self.data.get_compressed_object_at(offset, end)
+        if expected != unpacked.crc32:
+            raise ChecksumMismatch('%08x' % expected, '%08x' % unpacked.crc32)
+        return self._as_ref_delta(unpacked)
+
     def __getitem__(self, sha1):
         """Retrieve the specified SHA1."""
         type, uncomp = self.get_raw(sha1)
@@ -1957,7 +3752,19 @@ class Pack(object):
         return keepfile_name
 
 
+# Hold on to the pure-python implementations for testing
+_read_zlib_chunks_py = read_zlib_chunks
+_unpack_object_py = unpack_object
+_DeltaIndex_py = DeltaIndex
+_sort_names_py = sort_names
 try:
-    from dulwich._pack import apply_delta, bisect_find_sha
+    from dulwich._pack import (
+        DeltaIndex,
+        apply_delta,
+        bisect_find_sha,
+        read_zlib_chunks,
+        sort_names,
+        unpack_object,
+        )
 except ImportError:
     pass
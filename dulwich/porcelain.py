@@ -82,6 +82,7 @@ from dulwich.objectspec import (
     parse_reftuples,
     )
 from dulwich.pack import (
+    pack_write_options,
     write_pack_index,
     write_pack_objects,
     )
@@ -839,12 +840,19 @@ def ls_remote(remote):
 def repack(repo):
     """Repack loose files in a repository.
 
-    Currently this only packs loose objects.
+    Currently this only packs loose objects. The pack.compression,
+    pack.window, pack.windowMemory and pack.depth settings are honored.
+    If repack.writeBitmaps is true, a bitmap index is written for the new
+    pack when it holds all history of the commits in it.
 
     :param repo: Path to the repository
     """
     with open_repo_closing(repo) as r:
-        r.object_store.pack_loose_objects()
+        config = r.get_config_stack()
+        r.object_store.pack_loose_objects(
+            pack_options=pack_write_options(config),
+            write_bitmap=config.get_boolean(
+                (b'repack', ), b'writebitmaps', False))
 
 
 def pack_objects(repo, object_ids, packf, idxf, delta_window_size=None):
@@ -854,15 +862,21 @@ def pack_objects(repo, object_ids, packf, idxf, delta_window_size=None):
     :param object_ids: List of object ids to write
     :param packf: File-like object to write to
     :param idxf: File-like object to write to (can be None)
+    :param delta_window_size: Delta window size, overriding pack.window
+
+    Objects that are packed in the repository as a delta against another
+    object that is written are copied as they are. The pack.compression,
+    pack.window, pack.windowMemory and pack.depth settings are honored.
     """
     with open_repo_closing(repo) as r:
+        options = pack_write_options(r.get_config_stack())
+        if delta_window_size is not None:
+            options['delta_window_size'] = delta_window_size
         entries, data_sum = write_pack_objects(
             packf,
             r.object_store.iter_shas((oid, None) for oid in object_ids),
-            delta_window_size=delta_window_size)
+            reuse_deltas_from=r.object_store, **options)
     if idxf is not None:
-        entries = [(k, v[0], v[1]) for (k, v) in entries.items()]
-        entries.sort()
         write_pack_index(idxf, entries, data_sum)
 
 
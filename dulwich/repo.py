@@ -280,11 +280,15 @@ class BaseRepo(object):
                 return []
             return self.get_parents(commit.id, commit)
 
+        kwargs = {}
+        if shallows or unshallows or self._graftpoints:
+            # Only pass get_parents when it differs from the stored parents,
+            # so the object store is free to use its bitmap indexes.
+            kwargs['get_parents'] = get_parents
         return self.object_store.iter_shas(
           self.object_store.find_missing_objects(
               haves, wants, progress,
-              get_tagged,
-              get_parents=get_parents))
+              get_tagged, **kwargs))
 
     def get_graph_walker(self, heads=None):
         """Retrieve a graph walker.
@@ -351,7 +355,7 @@ class BaseRepo(object):
             return self._graftpoints[sha]
         except KeyError:
             if commit is None:
-                commit = self[sha]
+                return self.object_store.get_commit_parents(sha)
             return commit.parents
 
     def get_config(self):
@@ -433,7 +437,9 @@ class BaseRepo(object):
         if isinstance(include, str):
             include = [include]
 
-        kwargs['get_parents'] = lambda commit: self.get_parents(commit.id, commit)
+        if self._graftpoints:
+            kwargs['get_parents'] = (
+                lambda commit: self.get_parents(commit.id, commit))
 
         return Walker(self.object_store, include, *args, **kwargs)
 
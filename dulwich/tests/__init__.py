@@ -91,17 +91,21 @@ class BlackboxTestCase(TestCase):
 def self_test_suite():
     names = [
         'archive',
+        'bitmap',
         'blackbox',
         'client',
+        'commit_graph',
         'config',
         'diff_tree',
         'fastexport',
         'file',
         'grafts',
+        'graph',
         'greenthreads',
         'hooks',
         'index',
         'lru_cache',
+        'midx',
         'objects',
         'objectspec',
         'object_store',
@@ -0,0 +1,279 @@
+# test_bitmap.py -- tests for bitmap.py
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for dulwich.bitmap."""
+
+from io import BytesIO
+import os
+import shutil
+import tempfile
+
+from dulwich.bitmap import (
+    PackBitmap,
+    _BitSet,
+    iter_bits,
+    read_ewah,
+    write_ewah,
+    write_pack_bitmap,
+    )
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.object_store import (
+    DiskObjectStore,
+    MissingObjectFinder,
+    )
+from dulwich.objects import (
+    Blob,
+    hex_to_sha,
+    )
+from dulwich.pack import (
+    MemoryPackIndex,
+    )
+from dulwich.tests import (
+    TestCase,
+    )
+from dulwich.tests.utils import (
+    build_commit_graph,
+    make_object,
+    )
+
+
+class EwahTests(TestCase):
+
+    def assertRoundtrip(self, bitmap, bit_size):
+        data = write_ewah(bitmap, bit_size)
+        self.assertEqual((bitmap, bit_size, len(data)),
+                         read_ewah(data, 0))
+        return data
+
+    def test_empty(self):
+        self.assertRoundtrip(0, 0)
+        self.assertRoundtrip(0, 1000)
+
+    def test_literal(self):
+        self.assertRoundtrip(0x5, 3)
+        self.assertRoundtrip(0x123456789abcdef, 64)
+
+    def test_runs(self):
+        data = self.assertRoundtrip((1 << 6400) - 1, 6400)
+        # A single marker word covers the whole run.
+        self.assertEqual(20, len(data))
+        self.assertRoundtrip(((1 << 640) - 1) << 6400 | 0x3, 8000)
+
+    def test_mixed(self):
+        bitmap = 0
+        for i in range(0, 5000, 7):
+            bitmap |= 1 << i
+        bitmap |= ((1 << 1000) - 1) << 6000
+        self.assertRoundtrip(bitmap, 7100)
+
+    def test_iter_bits(self):
+        self.assertEqual([], list(iter_bits(0)))
+        self.assertEqual([0, 3, 64, 200], list(iter_bits(
+            1 | 1 << 3 | 1 << 64 | 1 << 200)))
+
+
+class BitSetTests(TestCase):
+
+    def test_add_update(self):
+        bitset = _BitSet(100)
+        bitset.add(3)
+        bitset.update(1 << 70 | 1 << 3)
+        self.assertTrue(3 in bitset)
+        self.assertTrue(70 in bitset)
+        self.assertFalse(71 in bitset)
+        bitset.update(1 << 71)
+        bitset.add(99)
+        self.assertTrue(71 in bitset)
+        self.assertEqual([3, 70, 71, 99], list(iter_bits(bitset.to_int())))
+
+
+class PackBitmapTests(TestCase):
+
+    def setUp(self):
+        super(PackBitmapTests, self).setUp()
+        self.index = MemoryPackIndex(
+            [(b'\x01' * 20, 12, 0), (b'\x02' * 20, 42, 0),
+             (b'\x03' * 20, 98, 0)], pack_checksum=b'\xaa' * 20)
+
+    def _write(self, entries):
+        f = BytesIO()
+        sha = write_pack_bitmap(
+            f, b'\xaa' * 20, 3, (0x3, 0, 0x4, 0), entries)
+        contents = f.getvalue()
+        self.assertEqual(sha, contents[-20:])
+        return PackBitmap('pack.bitmap', self.index, file=f,
+                          contents=contents, size=len(contents))
+
+    def test_empty(self):
+        bitmap = self._write([])
+        bitmap.check()
+        self.assertEqual(0, len(bitmap))
+        self.assertEqual(b'\xaa' * 20, bitmap.get_pack_checksum())
+        self.assertEqual((0x3, 0, 0x4, 0), (
+            bitmap.commits, bitmap.trees, bitmap.blobs, bitmap.tags))
+
+    def test_roundtrip(self):
+        bitmap = self._write([(1, 0x7), (0, 0x5)])
+        bitmap.check()
+        self.assertEqual(2, len(bitmap))
+        self.assertEqual([b'\x01' * 20, b'\x02' * 20], list(bitmap))
+        self.assertEqual(0x5, bitmap.get(b'\x01' * 20))
+        self.assertEqual(0x7, bitmap.get('02' * 20))
+        self.assertTrue(b'\x02' * 20 in bitmap)
+        self.assertFalse(b'\x03' * 20 in bitmap)
+        self.assertRaises(KeyError, bitmap.get, b'\x03' * 20)
+
+    def test_xor(self):
+        bitmap = self._write([(0, 0x5), (1, 0x2)])
+        # Make the second entry relative to the first one.
+        contents = bitmap._contents
+        xor_offset_pos = bitmap._entries[1][2] - 2
+        contents = (contents[:xor_offset_pos] + b'\x01' +
+                    contents[xor_offset_pos+1:])
+        bitmap = PackBitmap('pack.bitmap', self.index, file=BytesIO(),
+                            contents=contents, size=len(contents))
+        self.assertEqual(0x7, bitmap.get(b'\x02' * 20))
+        self.assertEqual(0x5, bitmap.get(b'\x01' * 20))
+
+    def test_checksum_mismatch(self):
+        f = BytesIO()
+        write_pack_bitmap(f, b'\xaa' * 20, 3, (0, 0, 0, 0), [(0, 0x1)])
+        contents = f.getvalue()[:-1] + b'\x00'
+        bitmap = PackBitmap('pack.bitmap', self.index, file=f,
+                            contents=contents, size=len(contents))
+        self.assertRaises(ChecksumMismatch, bitmap.check)
+
+    def test_not_bitmap(self):
+        contents = b'PACK' + b'\x00' * 100
+        self.assertRaises(AssertionError, PackBitmap, 'pack.bitmap',
+                          self.index, file=BytesIO(), contents=contents,
+                          size=len(contents))
+
+
+class BitmapObjectStoreTests(TestCase):
+
+    def setUp(self):
+        super(BitmapObjectStoreTests, self).setUp()
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        store = DiskObjectStore.init(self.store_dir)
+        self.blobs = [make_object(Blob, data=('blob %d' % i).encode('ascii'))
+                      for i in range(5)]
+        b = self.blobs
+        self.commits = build_commit_graph(
+            store, [[1], [2, 1], [3, 2], [4, 2], [5, 3, 4]],
+            {1: [(b'a', b[0])], 2: [(b'a', b[1]), (b'b', b[0])],
+             3: [(b'a', b[2])], 4: [(b'c', b[3])], 5: [(b'd', b[4])]})
+        store.pack_loose_objects()
+        self.pack = store.packs[0]
+        self.addCleanup(self.pack.close)
+
+    def _open_store(self):
+        store = DiskObjectStore(self.store_dir)
+        self.addCleanup(lambda: [p.close() for p in store.packs])
+        return store
+
+    def assertMissing(self, store, haves, wants, expected):
+        missing = store.find_missing_objects(
+            [self.commits[i].id for i in haves],
+            [self.commits[i].id for i in wants])
+        self.assertEqual(
+            set(hex_to_sha(sha) for sha in expected),
+            set(hex_to_sha(sha) for (sha, path) in missing))
+
+    def test_no_bitmap(self):
+        self.assertEqual(None, self._open_store().packs[0].bitmap)
+
+    def test_write_bitmap(self):
+        path = self.pack.write_bitmap()
+        self.assertTrue(os.path.exists(path))
+        bitmap = self._open_store().packs[0].bitmap
+        bitmap.check()
+        # Only the tip is selected in a history this short.
+        self.assertEqual([hex_to_sha(self.commits[4].id)], list(bitmap))
+        self.assertEqual(5, len(list(iter_bits(bitmap.commits))))
+        self.assertEqual(5, len(list(iter_bits(bitmap.blobs))))
+        self.assertEqual(15, len(list(iter_bits(
+            bitmap.get(self.commits[4].id)))))
+
+    def test_write_bitmap_commits(self):
+        self.pack.write_bitmap(commits=[hex_to_sha(self.commits[1].id)])
+        bitmap = self._open_store().packs[0].bitmap
+        self.assertEqual([hex_to_sha(self.commits[1].id)], list(bitmap))
+        self.assertEqual(6, len(list(iter_bits(
+            bitmap.get(self.commits[1].id)))))
+
+    def test_find_missing_objects(self):
+        self.pack.write_bitmap(commits=[hex_to_sha(self.commits[1].id)])
+        store = self._open_store()
+        c = self.commits
+        b = self.blobs
+        self.assertMissing(store, [], [0], [c[0].id, c[0].tree, b[0].id])
+        self.assertMissing(store, [1], [4], [
+            c[2].id, c[2].tree, b[2].id, c[3].id, c[3].tree, b[3].id,
+            c[4].id, c[4].tree, b[4].id])
+        self.assertMissing(store, [2], [4], [
+            c[3].id, c[3].tree, b[3].id, c[4].id, c[4].tree, b[4].id])
+        self.assertMissing(store, [4], [2], [])
+        self.assertMissing(store, [3], [2], [c[2].id, c[2].tree, b[2].id])
+
+    def test_find_missing_objects_unknown_have(self):
+        self.pack.write_bitmap()
+        store = self._open_store()
+        c = self.commits
+        missing = store.find_missing_objects(['ff' * 20], [c[0].id])
+        self.assertEqual(
+            set(hex_to_sha(sha) for sha in
+                [c[0].id, c[0].tree, self.blobs[0].id]),
+            set(hex_to_sha(sha) for (sha, path) in missing))
+
+    def test_find_missing_objects_paths(self):
+        self.pack.write_bitmap(commits=[hex_to_sha(self.commits[1].id)])
+        store = self._open_store()
+        blobs = [make_object(Blob, data=('new %d' % i).encode('ascii'))
+                 for i in range(3)]
+        # A loose commit on top of the pack, with trees that are not packed.
+        c = build_commit_graph(
+            store, [[1]],
+            {1: [(b'x', blobs[0]), (b'd/e', blobs[1]), (b'd/f/g', blobs[2])]},
+            attrs={1: {'parents': [self.commits[4].id]}})
+        # Every missing tree and blob has a single name in these cases.
+        for haves, wants in [([self.commits[1].id], [c[0].id]),
+                             ([self.commits[4].id], [c[0].id])]:
+            missing = dict((hex_to_sha(sha), path) for (sha, path) in
+                           store.find_missing_objects(haves, wants))
+            finder = MissingObjectFinder(store, haves, wants)
+            expected = dict((hex_to_sha(sha), path) for (sha, path) in
+                            iter(finder.next, None))
+            self.assertEqual(
+                dict((sha, expected[sha]) for sha in missing), missing)
+        self.assertEqual(
+            [b'', b'd', b'e', b'f', b'g', b'x', None],
+            sorted(missing.values(), key=lambda p: (p is None, p)))
+
+    def test_stale_bitmap(self):
+        self.pack.write_bitmap()
+        path = self.pack._bitmap_path
+        with open(path, 'rb') as f:
+            contents = f.read()
+        with open(path, 'wb') as f:
+            f.write(contents[:12] + b'\x00' * 20 + contents[32:])
+        self.assertEqual(None, self._open_store().packs[0].bitmap)
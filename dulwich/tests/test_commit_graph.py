@@ -0,0 +1,177 @@
+# test_commit_graph.py -- tests for commit_graph.py
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for dulwich.commit_graph."""
+
+from io import BytesIO
+import shutil
+import tempfile
+
+from dulwich.commit_graph import (
+    CHUNK_EXTRAEDGES,
+    CommitGraph,
+    compute_generations,
+    write_commit_graph,
+    )
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.object_store import (
+    DiskObjectStore,
+    )
+from dulwich.objects import (
+    hex_to_sha,
+    sha_to_hex,
+    )
+from dulwich.tests import (
+    TestCase,
+    )
+from dulwich.tests.utils import (
+    build_commit_graph,
+    make_commit,
+    )
+from dulwich.walk import (
+    Walker,
+    )
+
+
+class CommitGraphTests(TestCase):
+
+    def _write(self, commits):
+        f = BytesIO()
+        sha = write_commit_graph(f, commits)
+        contents = f.getvalue()
+        self.assertEqual(sha, contents[-20:])
+        return CommitGraph('commit-graph', file=f, contents=contents,
+                           size=len(contents))
+
+    def test_empty(self):
+        graph = self._write([])
+        graph.check()
+        self.assertEqual(0, len(graph))
+        self.assertEqual([], list(graph))
+        self.assertFalse(b'\x00' * 20 in graph)
+
+    def test_roundtrip(self):
+        c1 = make_commit(commit_time=100)
+        c2 = make_commit(parents=[c1.id], commit_time=2**33 + 5)
+        c3 = make_commit(parents=[c1.id, c2.id], commit_time=300)
+        graph = self._write([c3, c1, c2])
+        graph.check()
+        self.assertEqual(3, len(graph))
+        self.assertEqual(sorted(hex_to_sha(c.id) for c in [c1, c2, c3]),
+                         list(graph))
+        self.assertFalse(CHUNK_EXTRAEDGES in graph._chunks)
+        self.assertEqual([], graph.get_parents(c1.id))
+        self.assertEqual([hex_to_sha(c1.id), hex_to_sha(c2.id)],
+                         [hex_to_sha(p) for p in graph.get_parents(c3.id)])
+        self.assertEqual(2**33 + 5, graph.get_commit_time(c2.id))
+        self.assertEqual(300, graph.get_commit_time(hex_to_sha(c3.id)))
+        self.assertEqual([1, 2, 3], [graph.get_generation(c.id)
+                                     for c in [c1, c2, c3]])
+        self.assertEqual(hex_to_sha(c3.tree),
+                         hex_to_sha(graph.get_tree(c3.id)))
+        self.assertRaises(KeyError, graph.get_parents, b'\xff' * 20)
+
+    def test_octopus(self):
+        parents = [make_commit(message=('p%d' % i).encode('ascii'))
+                   for i in range(4)]
+        merge = make_commit(parents=[p.id for p in parents])
+        graph = self._write(parents + [merge])
+        self.assertTrue(CHUNK_EXTRAEDGES in graph._chunks)
+        self.assertEqual([hex_to_sha(p.id) for p in parents],
+                         [hex_to_sha(p) for p in graph.get_parents(merge.id)])
+        self.assertEqual(2, graph.get_generation(merge.id))
+
+    def test_missing_parent(self):
+        c1 = make_commit()
+        c2 = make_commit(parents=[c1.id])
+        self.assertRaises(ValueError, write_commit_graph, BytesIO(), [c2])
+
+    def test_checksum_mismatch(self):
+        f = BytesIO()
+        write_commit_graph(f, [make_commit()])
+        contents = f.getvalue()[:-1] + b'\x00'
+        graph = CommitGraph('commit-graph', contents=contents,
+                            size=len(contents), file=f)
+        self.assertRaises(ChecksumMismatch, graph.check)
+
+    def test_not_commit_graph(self):
+        contents = b'MIDX' + b'\x00' * 100
+        self.assertRaises(AssertionError, CommitGraph, 'commit-graph',
+                          file=BytesIO(), contents=contents,
+                          size=len(contents))
+
+    def test_compute_generations(self):
+        self.assertEqual(
+            {b'a': 1, b'b': 2, b'c': 2, b'd': 3, b'e': 1},
+            compute_generations({b'a': [], b'b': [b'a'], b'c': [b'a'],
+                                 b'd': [b'b', b'c'], b'e': []}))
+
+
+class CommitGraphObjectStoreTests(TestCase):
+
+    def setUp(self):
+        super(CommitGraphObjectStoreTests, self).setUp()
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        self.store = DiskObjectStore.init(self.store_dir)
+        self.addCleanup(self.store.close)
+        commits = build_commit_graph(
+            self.store, [[1], [2, 1], [3, 1], [4, 2, 3], [5, 4], [6, 4],
+                         [7, 5, 6]])
+        self.ids = [sha_to_hex(hex_to_sha(c.id)) for c in commits]
+
+    def test_no_commit_graph(self):
+        self.assertEqual(None, self.store.get_commit_graph())
+        self.assertEqual(self.ids[:1],
+                         self.store.get_commit_parents(self.ids[1]))
+
+    def test_write_commit_graph(self):
+        self.store.write_commit_graph([self.ids[5]])
+        graph = self.store.get_commit_graph()
+        graph.check()
+        self.assertEqual(5, len(graph))
+        self.assertFalse(self.ids[4] in graph)
+        self.assertEqual(4, graph.get_generation(self.ids[5]))
+        self.assertEqual(self.ids[1:3],
+                         self.store.get_commit_parents(self.ids[3]))
+        # Commits that are not in the commit-graph are read from the store.
+        self.assertEqual(self.ids[4:6],
+                         self.store.get_commit_parents(self.ids[6]))
+        self.assertEqual(300, self.store.get_commit_time(self.ids[3]))
+
+    def test_collect_ancestors(self):
+        self.store.write_commit_graph([self.ids[6]])
+        self.assertEqual(
+            (set(self.ids[4:]), set([self.ids[3]])),
+            self.store._collect_ancestors(
+                [self.ids[6]], set(self.ids[:4])))
+
+    def test_walker(self):
+        def walk(store, include, exclude):
+            return [e.commit.id for e in Walker(
+                store, [self.ids[i] for i in include],
+                exclude=[self.ids[i] for i in exclude])]
+        cases = [([6], []), ([6], [2]), ([5], [0]), ([6], [3, 1])]
+        expected = [walk(self.store, *case) for case in cases]
+        self.assertEqual([7, 5, 4, 3], [len(e) for e in expected])
+        self.store.write_commit_graph([self.ids[6]])
+        self.assertNotEqual(None, self.store.get_commit_graph())
+        self.assertEqual(expected, [walk(self.store, *case) for case in cases])
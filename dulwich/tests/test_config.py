@@ -31,6 +31,9 @@ from dulwich.config import (
     _parse_string,
     parse_submodules,
     )
+from dulwich.pack import (
+    pack_write_options,
+    )
 from dulwich.tests import (
     TestCase,
     )
@@ -162,6 +165,22 @@ class ConfigFileTests(TestCase):
             b'fontdiff': b'-family "Ubuntu Mono" -size 11 -weight normal -slant roman -underline 0 -overstrike 0',
         }}), cf)
 
+    def test_pack_write_options(self):
+        cf = self.from_file(b"""[core]
+	compression = 1
+[pack]
+	window = 0
+	windowMemory = 2k
+	depth = 3
+""")
+        self.assertEqual({
+            'compression_level': 1,
+            'deltify': False,
+            'delta_window_size': 0,
+            'delta_window_memory': 2048,
+            'delta_max_depth': 3,
+            }, pack_write_options(cf))
+
 
 class ConfigDictTests(TestCase):
 
@@ -182,6 +201,21 @@ class ConfigDictTests(TestCase):
         cd.set((b"core", ), b"foo", b"invalid")
         self.assertRaises(ValueError, cd.get_boolean, (b"core", ), b"foo")
 
+    def test_get_int(self):
+        cd = ConfigDict()
+        self.assertEqual(None, cd.get_int((b"core", ), b"foo"))
+        self.assertEqual(3, cd.get_int((b"core", ), b"foo", 3))
+        cd.set((b"core", ), b"foo", b"-1")
+        self.assertEqual(-1, cd.get_int((b"core", ), b"foo"))
+        cd.set((b"core", ), b"foo", b"2k")
+        self.assertEqual(2048, cd.get_int((b"core", ), b"foo"))
+        cd.set((b"core", ), b"foo", b"3M")
+        self.assertEqual(3 * 1024 * 1024, cd.get_int((b"core", ), b"foo"))
+        cd.set((b"core", ), b"foo", b"1g")
+        self.assertEqual(1024 ** 3, cd.get_int((b"core", ), b"foo"))
+        cd.set((b"core", ), b"foo", b"invalid")
+        self.assertRaises(ValueError, cd.get_int, (b"core", ), b"foo")
+
     def test_dict(self):
         cd = ConfigDict()
         cd.set((b"core", ), b"foo", b"bla")
@@ -0,0 +1,133 @@
+# test_graph.py -- tests for graph.py
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for dulwich.graph."""
+
+import shutil
+import tempfile
+
+from dulwich.graph import (
+    Reachability,
+    )
+from dulwich.object_store import (
+    DiskObjectStore,
+    )
+from dulwich.objects import (
+    hex_to_sha,
+    sha_to_hex,
+    )
+from dulwich.tests import (
+    TestCase,
+    )
+from dulwich.tests.utils import (
+    build_commit_graph,
+    )
+
+
+class ReachabilityTests(TestCase):
+
+    # 1 - 2 - 4 - 5 - 7
+    #  \     /     /
+    #   - 3 - --- 6     8 (root)
+    commit_spec = [[1], [2, 1], [3, 1], [4, 2, 3], [5, 4], [6, 3], [7, 5, 6],
+                   [8]]
+
+    def setUp(self):
+        super(ReachabilityTests, self).setUp()
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        self.store = DiskObjectStore.init(self.store_dir)
+        self.addCleanup(self.store.close)
+        commits = build_commit_graph(self.store, self.commit_spec)
+        self.ids = dict(
+            (i + 1, sha_to_hex(hex_to_sha(c.id)))
+            for (i, c) in enumerate(commits))
+        self.reachability = Reachability(self.store)
+
+    def c(self, *nums):
+        return [self.ids[n] for n in nums]
+
+    def test_generation(self):
+        self.assertEqual(
+            [1, 2, 2, 3, 4, 3, 5, 1],
+            [self.reachability.generation(self.ids[n]) for n in range(1, 9)])
+
+    def test_generation_commit_graph(self):
+        self.store.write_commit_graph(self.c(7, 8))
+        reachability = Reachability(self.store)
+        self.assertEqual(
+            [1, 2, 2, 3, 4, 3, 5, 1],
+            [reachability.generation(self.ids[n]) for n in range(1, 9)])
+
+    def test_is_ancestor(self):
+        r = self.reachability
+        self.assertTrue(r.is_ancestor(self.ids[1], self.ids[7]))
+        self.assertTrue(r.is_ancestor(self.ids[6], self.ids[7]))
+        self.assertTrue(r.is_ancestor(self.ids[4], self.ids[4]))
+        self.assertFalse(r.is_ancestor(self.ids[7], self.ids[1]))
+        self.assertFalse(r.is_ancestor(self.ids[2], self.ids[6]))
+        self.assertFalse(r.is_ancestor(self.ids[8], self.ids[7]))
+
+    def test_reachable_from(self):
+        r = self.reachability
+        self.assertEqual(set(self.c(2, 3)),
+                         r.reachable_from(self.c(4), self.c(2, 3, 5, 8)))
+        self.assertEqual(set(self.c(3, 8)),
+                         r.reachable_from(self.c(6, 8), self.c(2, 3, 8)))
+        self.assertEqual(set(), r.reachable_from(self.c(7), []))
+
+    def test_merge_base(self):
+        r = self.reachability
+        self.assertEqual(self.c(4), r.merge_base(self.ids[5], self.ids[4]))
+        self.assertEqual(self.c(3), r.merge_base(self.ids[5], self.ids[6]))
+        self.assertEqual(self.c(1), r.merge_base(self.ids[2], self.ids[3]))
+        self.assertEqual(self.c(7), r.merge_base(self.ids[7], self.ids[7]))
+        self.assertEqual([], r.merge_base(self.ids[7], self.ids[8]))
+
+    def test_merge_base_criss_cross(self):
+        # 1 - 2 - 4
+        #  \    X
+        #   - 3 - 5
+        commits = build_commit_graph(
+            self.store, [[1], [2, 1], [3, 1], [4, 2, 3], [5, 3, 2]],
+            attrs={1: {'message': b'criss-cross'}})
+        ids = [sha_to_hex(hex_to_sha(c.id)) for c in commits]
+        self.assertEqual(
+            set(ids[1:3]),
+            set(self.reachability.merge_base(ids[3], ids[4])))
+
+    def test_missing_commits(self):
+        r = self.reachability
+        self.assertEqual((set(self.c(5, 6, 7)), set(self.c(3, 4))),
+                         r.missing_commits(self.c(4), self.c(7)))
+        self.assertEqual((set(), set(self.c(5))),
+                         r.missing_commits(self.c(7), self.c(5)))
+        self.assertEqual((set(self.c(8)), set()),
+                         r.missing_commits(self.c(7), self.c(8)))
+        self.assertEqual((set(self.c(1, 2)), set()),
+                         r.missing_commits([], self.c(2)))
+
+    def test_get_parents(self):
+        # Pretend 4 is not a merge.
+        parents = dict((self.ids[n], self.store.get_commit_parents(
+            self.ids[n])) for n in self.ids)
+        parents[self.ids[4]] = self.c(2)
+        r = Reachability(self.store, get_parents=parents.__getitem__)
+        self.assertFalse(r.is_ancestor(self.ids[3], self.ids[5]))
+        self.assertEqual(self.c(1), r.merge_base(self.ids[5], self.ids[6]))
@@ -0,0 +1,115 @@
+# test_midx.py -- tests for midx.py
+# Copyright (C) 2016 Jelmer Vernooij and others.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for dulwich.midx."""
+
+from io import BytesIO
+
+from dulwich.errors import (
+    ChecksumMismatch,
+    )
+from dulwich.midx import (
+    CHUNK_LARGEOFFSETS,
+    MultiPackIndex,
+    write_midx,
+    )
+from dulwich.objects import (
+    sha_to_hex,
+    )
+from dulwich.tests import (
+    TestCase,
+    )
+
+
+class MultiPackIndexTests(TestCase):
+
+    def _write(self, packs):
+        f = BytesIO()
+        sha = write_midx(f, packs)
+        contents = f.getvalue()
+        self.assertEqual(sha, contents[-20:])
+        return MultiPackIndex('multi-pack-index', file=f, contents=contents,
+                              size=len(contents))
+
+    def test_empty(self):
+        midx = self._write([])
+        self.assertEqual(0, len(midx))
+        self.assertEqual([], midx.pack_names)
+        self.assertFalse(b'\x00' * 20 in midx)
+        midx.check()
+
+    def test_roundtrip(self):
+        midx = self._write([
+            (b'pack-b.idx', [(b'\x02' * 20, 42, 0), (b'\xff' * 20, 12, 0)]),
+            (b'pack-a.idx', [(b'\x01' * 20, 178, 0)]),
+            ])
+        midx.check()
+        self.assertEqual([b'pack-a.idx', b'pack-b.idx'], midx.pack_names)
+        self.assertEqual(3, len(midx))
+        self.assertEqual([b'\x01' * 20, b'\x02' * 20, b'\xff' * 20],
+                         list(midx))
+        self.assertEqual([(b'\x01' * 20, 0, 178), (b'\x02' * 20, 1, 42),
+                          (b'\xff' * 20, 1, 12)], list(midx.iterentries()))
+        self.assertEqual((1, 42), midx.object_offset(b'\x02' * 20))
+        self.assertEqual((0, 178),
+                         midx.object_offset(sha_to_hex(b'\x01' * 20)))
+        self.assertTrue(b'\xff' * 20 in midx)
+        self.assertFalse(b'\x03' * 20 in midx)
+        self.assertFalse(b'\x02' * 19 + b'\x03' in midx)
+        self.assertRaises(KeyError, midx.object_offset, b'\x00' * 20)
+
+    def test_duplicates(self):
+        midx = self._write([
+            (b'pack-b.idx', [(b'\x02' * 20, 42, 0)]),
+            (b'pack-a.idx', [(b'\x02' * 20, 178, 0)]),
+            ])
+        self.assertEqual(1, len(midx))
+        self.assertEqual((1, 42), midx.object_offset(b'\x02' * 20))
+
+    def test_offsets_below_4gb(self):
+        midx = self._write([
+            (b'pack-a.idx', [(b'\x01' * 20, 2**31 + 5, 0)]),
+            ])
+        self.assertFalse(CHUNK_LARGEOFFSETS in midx._chunks)
+        self.assertEqual((0, 2**31 + 5), midx.object_offset(b'\x01' * 20))
+
+    def test_large_offsets(self):
+        midx = self._write([
+            (b'pack-a.idx', [(b'\x01' * 20, 2**32 + 5, 0),
+                             (b'\x02' * 20, 2**31 + 5, 0),
+                             (b'\x03' * 20, 12, 0)]),
+            ])
+        self.assertTrue(CHUNK_LARGEOFFSETS in midx._chunks)
+        self.assertEqual((0, 2**32 + 5), midx.object_offset(b'\x01' * 20))
+        self.assertEqual((0, 2**31 + 5), midx.object_offset(b'\x02' * 20))
+        self.assertEqual((0, 12), midx.object_offset(b'\x03' * 20))
+
+    def test_checksum_mismatch(self):
+        f = BytesIO()
+        write_midx(f, [(b'pack-a.idx', [(b'\x01' * 20, 12, 0)])])
+        contents = f.getvalue()[:-1] + b'\x00'
+        midx = MultiPackIndex('multi-pack-index', contents=contents,
+                              size=len(contents), file=f)
+        self.assertRaises(ChecksumMismatch, midx.check)
+
+    def test_not_midx(self):
+        contents = b'\377tOc' + b'\x00' * 100
+        self.assertRaises(AssertionError, MultiPackIndex, 'multi-pack-index',
+                          file=BytesIO(), contents=contents,
+                          size=len(contents))
@@ -24,6 +24,7 @@ from io import BytesIO
 import os
 import shutil
 import tempfile
+import zlib
 
 from dulwich.index import (
     commit_tree,
@@ -32,6 +33,7 @@ from dulwich.errors import (
     NotTreeError,
     )
 from dulwich.objects import (
+    hex_to_sha,
     sha_to_hex,
     Blob,
     Tree,
@@ -44,7 +46,11 @@ from dulwich.object_store import (
     tree_lookup_path,
     )
 from dulwich.pack import (
+    OFS_DELTA,
     REF_DELTA,
+    DeltaChainIterator,
+    PackData,
+    write_pack_data,
     write_pack_objects,
     )
 from dulwich.tests import (
@@ -199,6 +205,18 @@ class ObjectStoreTests(object):
         self.assertEqual((Blob.type_num, b'yummy data'),
                          self.store.get_raw(testobject.id))
 
+    def test_get_raw_many(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        b2 = make_object(Blob, data=b"more yummy data")
+        self.store.add_objects([(b1, None), (b2, None)])
+        self.assertEqual(
+            {b1.id: (Blob.type_num, b"yummy data"),
+             b2.id: (Blob.type_num, b"more yummy data")},
+            dict((sha, (type_num, raw)) for (sha, type_num, raw)
+                 in self.store.get_raw_many([b1.id, b2.id])))
+        self.assertRaises(KeyError, list,
+                          self.store.get_raw_many([b1.id, b"1" * 40]))
+
     def test_close(self):
         # For now, just check that close doesn't barf.
         self.store.add_object(testobject)
@@ -271,6 +289,58 @@ class PackBasedObjectStoreTests(ObjectStoreTests):
         self.assertNotEqual([], list(self.store.packs))
         self.assertEqual(0, self.store.pack_loose_objects())
 
+    def test_packs_mru_order(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        self.store.add_object(b1)
+        self.store.pack_loose_objects()
+        b2 = make_object(Blob, data=b"more yummy data")
+        self.store.add_object(b2)
+        self.store.pack_loose_objects()
+        self.assertEqual(2, len(self.store.packs))
+        self.assertTrue(self.store.contains_packed(b2.id))
+        self.assertTrue(b2.id in self.store.packs[0])
+        self.assertEqual((Blob.type_num, b"yummy data"),
+                         self.store.get_raw(b1.id))
+        self.assertTrue(b1.id in self.store.packs[0])
+        stats = self.store.pack_stats()
+        self.assertEqual([1, 1], [hits for (pack, hits, misses) in stats])
+        self.assertFalse(self.store.contains_packed(b"1" * 40))
+        self.assertEqual(
+            [(pack, hits, misses + 1) for (pack, hits, misses) in stats],
+            self.store.pack_stats())
+
+    def test_get_raw_many_packed_and_loose(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        self.store.add_object(b1)
+        b2 = make_object(Blob, data=b"more yummy data")
+        self.store.add_object(b2)
+        self.store.pack_loose_objects()
+        b3 = make_object(Blob, data=b"loose data")
+        self.store.add_object(b3)
+        # Packed objects come first; names are returned as passed in.
+        results = list(self.store.get_raw_many(
+            [b3.id, hex_to_sha(b1.id), b2.id]))
+        self.assertEqual((b3.id, Blob.type_num, b"loose data"), results[-1])
+        self.assertEqual(
+            {hex_to_sha(b1.id): (Blob.type_num, b"yummy data"),
+             b2.id: (Blob.type_num, b"more yummy data")},
+            dict((sha, (type_num, raw))
+                 for (sha, type_num, raw) in results[:2]))
+
+    def test_contains_many(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        self.store.add_object(b1)
+        self.store.pack_loose_objects()
+        b2 = make_object(Blob, data=b"more yummy data")
+        self.store.add_object(b2)
+        self.store.pack_loose_objects()
+        b3 = make_object(Blob, data=b"loose data")
+        self.store.add_object(b3)
+        self.assertEqual(
+            [True, False, True, True],
+            self.store.contains_many(
+                [b2.id, b"1" * 40, hex_to_sha(b1.id), b3.id]))
+
 
 class DiskObjectStoreTests(PackBasedObjectStoreTests, TestCase):
 
@@ -335,6 +405,21 @@ class DiskObjectStoreTests(PackBasedObjectStoreTests, TestCase):
         else:
             commit()
 
+    def test_add_pack_mmap(self):
+        o = DiskObjectStore(self.store_dir, use_mmap=True)
+        f, commit, abort = o.add_pack()
+        b = make_object(Blob, data=b"more yummy data")
+        try:
+            write_pack_objects(f, [(b, None)])
+        except:
+            abort()
+            raise
+        else:
+            pack = commit()
+        self.assertTrue(pack.data._contents is not None)
+        self.assertEqual((Blob.type_num, b"more yummy data"), o.get_raw(b.id))
+        o.close()
+
     def test_add_thin_pack(self):
         o = DiskObjectStore(self.store_dir)
         try:
@@ -357,6 +442,178 @@ class DiskObjectStoreTests(PackBasedObjectStoreTests, TestCase):
         finally:
             o.close()
 
+    def test_multi_pack_index(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        self.store.add_object(b1)
+        self.store.pack_loose_objects()
+        b2 = make_object(Blob, data=b"more yummy data")
+        self.store.add_object(b2)
+        self.store.pack_loose_objects()
+        self.store.write_multi_pack_index()
+        self.assertTrue(os.path.exists(
+            os.path.join(self.store.pack_dir, 'multi-pack-index')))
+        store = DiskObjectStore(self.store_dir)
+        self.addCleanup(store.close)
+        self.assertEqual((Blob.type_num, b"yummy data"), store.get_raw(b1.id))
+        self.assertTrue(store.contains_packed(b2.id))
+        self.assertFalse(store.contains_packed(b"1" * 40))
+        # All lookups were answered by the multi-pack-index.
+        self.assertEqual(
+            [(1, 0), (1, 0)],
+            sorted((hits, misses) for (pack, hits, misses)
+                   in store.pack_stats()))
+        # Packs that are not in the multi-pack-index are still searched.
+        b3 = make_object(Blob, data=b"loose data")
+        store.add_object(b3)
+        store.pack_loose_objects()
+        self.assertEqual(3, len(store.packs))
+        self.assertEqual((Blob.type_num, b"loose data"), store.get_raw(b3.id))
+
+    def test_negative_cache(self):
+        store = DiskObjectStore(self.store_dir, negative_cache_size=10)
+        self.addCleanup(store.close)
+        b1 = make_object(Blob, data=b"yummy data")
+        self.assertFalse(b1.id in store)
+        self.assertFalse(b"1" * 40 in store)
+        self.assertEqual(set([b1.id, b"1" * 40]), store._missing_shas)
+
+        def fail(*args):
+            self.fail("negative cache not used")
+        store.contains_packed = fail
+        store._find_pack = fail
+        store._get_loose_object = fail
+        store._pack_cache_stale = fail
+        self.assertFalse(b1.id in store)
+        self.assertRaises(KeyError, store.get_raw, b"1" * 40)
+        del store.contains_packed
+        del store._find_pack
+        del store._get_loose_object
+        del store._pack_cache_stale
+        store.add_object(b1)
+        self.assertTrue(b1.id in store)
+        self.assertFalse(b"1" * 40 in store)
+        store.pack_loose_objects()
+        self.assertEqual(set(), store._missing_shas)
+
+    def test_negative_cache_other_writer(self):
+        store = DiskObjectStore(self.store_dir, negative_cache_size=10,
+                                negative_cache_ttl=60)
+        self.addCleanup(store.close)
+        other = DiskObjectStore(self.store_dir)
+        self.addCleanup(other.close)
+        b1 = make_object(Blob, data=b"yummy data")
+        b2 = make_object(Blob, data=b"more yummy data")
+        self.assertFalse(b1.id in store)
+        self.assertRaises(KeyError, store.get_raw, b2.id)
+        other.add_object(b1)
+        other.add_objects([(b2, None)])
+        # Within the TTL, the misses are answered from the cache.
+        self.assertFalse(b1.id in store)
+        self.assertRaises(KeyError, store.get_raw, b2.id)
+        store._missing_since -= 61
+        self.assertTrue(b1.id in store)
+        self.assertEqual((Blob.type_num, b"more yummy data"),
+                         store.get_raw(b2.id))
+        self.assertEqual(set(), store._missing_shas)
+
+    def test_negative_cache_no_ttl(self):
+        store = DiskObjectStore(self.store_dir, negative_cache_size=10,
+                                negative_cache_ttl=None)
+        self.addCleanup(store.close)
+        self.assertFalse(b"1" * 40 in store)
+        store._missing_since -= 3600
+        self.assertFalse(b"1" * 40 in store)
+        self.assertEqual(set([b"1" * 40]), store._missing_shas)
+
+    def test_negative_cache_size(self):
+        store = DiskObjectStore(self.store_dir, negative_cache_size=2)
+        self.addCleanup(store.close)
+        for c in (b"1", b"2", b"3"):
+            self.assertFalse(c * 40 in store)
+        self.assertEqual(set([b"3" * 40]), store._missing_shas)
+
+    def test_get_unpacked_object(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        self.store.add_object(b1)
+        self.assertRaises(KeyError, self.store.get_unpacked_object, b1.id)
+        self.store.pack_loose_objects()
+        unpacked = self.store.get_unpacked_object(b1.id, include_comp=True)
+        self.assertEqual(Blob.type_num, unpacked.pack_type_num)
+        self.assertEqual(b"yummy data",
+                         zlib.decompress(b"".join(unpacked.comp_chunks)))
+        self.assertRaises(KeyError, self.store.get_unpacked_object, b"1" * 40)
+
+    def test_get_object_header(self):
+        b1 = make_object(Blob, data=b"yummy data")
+        self.store.add_object(b1)
+        self.assertRaises(KeyError, self.store.get_object_header, b1.id)
+        self.store.pack_loose_objects()
+        unpacked = self.store.get_object_header(b1.id)
+        self.assertEqual(Blob.type_num, unpacked.pack_type_num)
+        self.assertEqual(None, unpacked.delta_base)
+        self.assertEqual(len(b"yummy data"), unpacked.decomp_len)
+        self.assertRaises(KeyError, self.store.get_object_header, b"1" * 40)
+
+    def test_add_thin_pack_complete(self):
+        with closing(DiskObjectStore(self.store_dir)) as o:
+            f = BytesIO()
+            entries = build_pack(f, [
+                (Blob.type_num, b'yummy data'),
+                (OFS_DELTA, (0, b'more yummy data')),
+                ])
+            with o.add_thin_pack(BytesIO(f.getvalue()).read, None) as pack:
+                pack.check()
+                self.assertEqual(f.getvalue()[-20:],
+                                 pack.data.get_stored_checksum())
+                self.assertEqual(
+                    sorted(entry[3] for entry in entries),
+                    [sha for (sha, offset, crc32) in pack.index.iterentries()])
+
+    def _write_records(self, store, shas):
+        objects = store.iter_shas((sha_to_hex(sha), None) for sha in shas)
+        f = BytesIO()
+        write_pack_data(f, len(objects), objects.iterrecords())
+        data = PackData.from_file(BytesIO(f.getvalue()), len(f.getvalue()))
+        return dict((unpacked.sha(), unpacked)
+                    for unpacked in DeltaChainIterator.for_pack_data(data))
+
+    def test_iterrecords(self):
+        with closing(DiskObjectStore(self.store_dir)) as o:
+            f = BytesIO()
+            entries = build_pack(f, [
+                (Blob.type_num, b'yummy data' * 10),
+                (OFS_DELTA, (0, b'yummy data' * 10 + b'more')),
+                ])
+            o.add_thin_pack(BytesIO(f.getvalue()).read, None).close()
+            b = make_object(Blob, data=b'loose data')
+            o.add_object(b)
+            shas = [entries[1][3], entries[0][3], b.sha().digest()]
+            written = self._write_records(o, shas)
+            self.assertEqual(set(shas), set(written))
+            self.assertEqual(Blob.type_num,
+                             written[entries[0][3]].pack_type_num)
+            self.assertEqual(OFS_DELTA, written[entries[1][3]].pack_type_num)
+            self.assertEqual(
+                o.get_unpacked_object(entries[1][3]).decomp_chunks,
+                written[entries[1][3]].decomp_chunks)
+            self.assertEqual([b'loose data'],
+                             written[b.sha().digest()].obj_chunks)
+
+    def test_iterrecords_base_not_written(self):
+        with closing(DiskObjectStore(self.store_dir)) as o:
+            f = BytesIO()
+            entries = build_pack(f, [
+                (Blob.type_num, b'yummy data' * 10),
+                (OFS_DELTA, (0, b'yummy data' * 10 + b'more')),
+                ])
+            o.add_thin_pack(BytesIO(f.getvalue()).read, None).close()
+            written = self._write_records(o, [entries[1][3]])
+            self.assertEqual([entries[1][3]], list(written))
+            self.assertEqual(Blob.type_num,
+                             written[entries[1][3]].pack_type_num)
+            self.assertEqual([b'yummy data' * 10 + b'more'],
+                             written[entries[1][3]].obj_chunks)
+
     def test_add_thin_pack_empty(self):
         with closing(DiskObjectStore(self.store_dir)) as o:
             f = BytesIO()
@@ -49,12 +49,25 @@ from dulwich.objects import (
     check_hexsha,
     check_identity,
     object_class,
+    parse_commit,
+    parse_commit_headers,
     parse_timezone,
     pretty_format_tree_entry,
     parse_tree,
+    _parse_commit_py,
+    _parse_message,
+    _parse_message_py,
     _parse_tree_py,
     sorted_tree_items,
     _sorted_tree_items_py,
+    _tree_entry,
+    _tree_entry_py,
+    _tree_entry_offsets,
+    _tree_entry_offsets_py,
+    _tree_lookup,
+    _tree_lookup_py,
+    _tree_name_order,
+    _tree_name_order_py,
     )
 from dulwich.tests import (
     TestCase,
@@ -543,6 +556,33 @@ class CommitParseTests(ShaFileCheckTests):
         self.assertEqual(0, c.author_timezone)
         self.assertEqual(None, c.encoding)
 
+    def test_parse_headers_only(self):
+        c = Commit.from_string(self.make_commit_text(
+            extra={b'extra-field': b'data'}))
+        self.assertEqual(b'd80c186a03f423a81b39df39dc87fd269736ca86', c.tree)
+        self.assertEqual(1174773719, c.commit_time)
+        # The rest of the commit has not been parsed yet.
+        self.assertTrue(c._lazy_chunks is not None)
+        self.assertEqual([(b'extra-field', b'data')], c.extra)
+        self.assertTrue(c._lazy_chunks is None)
+
+    def test_parse_commit_headers(self):
+        self.assertEqual(
+            (b'd80c186a03f423a81b39df39dc87fd269736ca86',
+             [b'ab64bbdcc51b170d21588e5c5d391ee5c0c96dfd',
+              b'4cffe90e0a41ad3f5190079d7c8f036bde29cbe6'], 1174773719),
+            parse_commit_headers([self.make_commit_text()]))
+        self.assertEqual(
+            None, parse_commit_headers([self.make_commit_text(author=None)]))
+
+    def test_parse_headers_unusual_order(self):
+        lines = self.make_commit_lines()
+        lines.insert(0, lines.pop(3))
+        c = Commit.from_string(b'\n'.join(lines))
+        self.assertEqual(b'd80c186a03f423a81b39df39dc87fd269736ca86', c.tree)
+        self.assertEqual(1174773719, c.commit_time)
+        self.assertTrue(c._lazy_chunks is None)
+
     def test_custom(self):
         c = Commit.from_string(self.make_commit_text(
             extra={b'extra-field': b'data'}))
@@ -640,6 +680,58 @@ fDeF1m4qYs+cUXKNUZ03
 =X6RT
 -----END PGP SIGNATURE-----""", c.gpgsig)
 
+    def _do_test_parse_commit(self, parse_commit):
+        text = self.make_commit_text(
+            encoding=b'UTF-8', extra={b'extra-field': b'data'},
+            committer=b'Jelmer <jelmer@samba.org> 1412179807 --0130')
+        text = text.replace(b'encoding', b'gpgsig line 1\n line 2\nencoding')
+        self.assertEqual(
+            (b'd80c186a03f423a81b39df39dc87fd269736ca86',
+             [b'ab64bbdcc51b170d21588e5c5d391ee5c0c96dfd',
+              b'4cffe90e0a41ad3f5190079d7c8f036bde29cbe6'],
+             (b'James Westby <jw+debian@jameswestby.net>', 1174773719,
+              (0, False)),
+             (b'Jelmer <jelmer@samba.org>', 1412179807, (5400, True)),
+             b'UTF-8', [], b'line 1\nline 2', b'Merge ../b\n',
+             [(b'extra-field', b'data')]),
+            parse_commit([text[:30], text[30:]]))
+        self.assertEqual(
+            (b'd80c186a03f423a81b39df39dc87fd269736ca86', [],
+             (None, None, (None, None)),
+             (b'James Westby <jw+debian@jameswestby.net>', 1174773719,
+              (-3600, False)),
+             None, [], None, None, []),
+            parse_commit([self.make_commit_text(
+                parents=[], author=None, message=None,
+                committer=default_committer[:-5] + b'-0100')[:-1]]))
+        self.assertRaises(ValueError, parse_commit, [
+            self.make_commit_text(author=b'Jelmer 1412179807')])
+        author = parse_commit([self.make_commit_text()])[2]
+        self.assertEqual(int, type(author[1]))
+        self.assertEqual(int, type(author[2][0]))
+
+    test_parse_commit = functest_builder(
+        _do_test_parse_commit, _parse_commit_py)
+    test_parse_commit_extension = ext_functest_builder(
+        _do_test_parse_commit, parse_commit)
+
+    def _do_test_parse_message(self, parse_message):
+        self.assertEqual(
+            [(b'object', b'a38d6181ff27824c79fc7df825164a212eff6a3f'),
+             (b'tag', b'v2.6.22-rc7\ncontinued'),
+             (None, b'message\n\nbody\n')],
+            list(parse_message([
+                b'object a38d6181ff27824c79fc7df825164a212eff6a3f\n'
+                b'tag v2.6.22-rc7\n continued\n\nmessage\n\nbody\n'])))
+        self.assertEqual([(b'tag', b'v1'), (None, None)],
+                         list(parse_message([b'tag v1\n'])))
+        self.assertEqual([(None, b'')], list(parse_message([b'\n'])))
+
+    test_parse_message = functest_builder(
+        _do_test_parse_message, _parse_message_py)
+    test_parse_message_extension = ext_functest_builder(
+        _do_test_parse_message, _parse_message)
+
 
 _TREE_ITEMS = {
     b'a.c': (0o100755, b'd80c186a03f423a81b39df39dc87fd269736ca86'),
@@ -656,6 +748,142 @@ _SORTED_TREE_ITEMS = [
 
 class TreeTests(ShaFileCheckTests):
 
+    def _make_raw_tree(self):
+        t = Tree()
+        t.add(b'a', stat.S_IFDIR, a_sha)
+        t.add(b'a.c', 0o100644, b_sha)
+        t.add(b'a/c', stat.S_IFDIR, tree_sha)
+        t.add(b'b', 0o100644, tree_sha)
+        return Tree.from_string(t.as_raw_string())
+
+    def test_raw_iteritems(self):
+        t = self._make_raw_tree()
+        self.assertEqual([
+            TreeEntry(b'a.c', 0o100644, b_sha),
+            TreeEntry(b'a', stat.S_IFDIR, a_sha),
+            TreeEntry(b'a/c', stat.S_IFDIR, tree_sha),
+            TreeEntry(b'b', 0o100644, tree_sha),
+            ], list(t.iteritems()))
+        self.assertEqual([b'a', b'a.c', b'a/c', b'b'],
+                         [entry.path for entry in t.iteritems(True)])
+        self.assertEqual([b'a.c', b'a', b'a/c', b'b'], list(t))
+        self.assertEqual(4, len(t))
+        # No dict of entries has been built.
+        self.assertTrue(t._text is not None)
+
+    def test_raw_lookup(self):
+        t = self._make_raw_tree()
+        self.assertEqual((stat.S_IFDIR, a_sha), t[b'a'])
+        self.assertEqual((0o100644, b_sha), t[b'a.c'])
+        self.assertEqual((0o100644, tree_sha), t[b'b'])
+        self.assertTrue(b'a/c' in t)
+        self.assertFalse(b'a.' in t)
+        self.assertFalse(b'c' in t)
+        self.assertRaises(KeyError, t.__getitem__, b'')
+        self.assertTrue(t._text is not None)
+
+    def test_raw_modify(self):
+        t = self._make_raw_tree()
+        del t[b'a.c']
+        self.assertTrue(t._text is None)
+        self.assertEqual([b'a', b'a/c', b'b'],
+                         [entry.path for entry in t.iteritems()])
+
+    def _do_test_tree_entry_offsets(self, tree_entry_offsets):
+        text = self._make_raw_tree().as_raw_string()
+        offsets = tree_entry_offsets(text)
+        self.assertEqual(4, len(offsets))
+        self.assertEqual(0, offsets[0])
+        sha = hex_to_sha(a_sha)
+        self.assertEqual(None, tree_entry_offsets(
+            b'100644 b\0' + sha + b'100644 a\0' + sha))
+        self.assertEqual(None, tree_entry_offsets(
+            b'100644 a\0' + sha + b'100644 a\0' + sha))
+        self.assertEqual(None, tree_entry_offsets(
+            b'100644 a\0' + sha + b'100644 a.c\0' + sha +
+            b'40000 a\0' + sha))
+        self.assertEqual(None, tree_entry_offsets(b'1x0644 a\0' + sha))
+        self.assertRaises(ObjectFormatException, tree_entry_offsets,
+                          b'100644 a\0' + sha[:10])
+
+    test_tree_entry_offsets = functest_builder(
+        _do_test_tree_entry_offsets, _tree_entry_offsets_py)
+    test_tree_entry_offsets_extension = ext_functest_builder(
+        _do_test_tree_entry_offsets, _tree_entry_offsets)
+
+    def _do_test_tree_lookup(self, tree_lookup):
+        text = self._make_raw_tree().as_raw_string()
+        offsets = _tree_entry_offsets_py(text)
+        self.assertEqual((stat.S_IFDIR, a_sha),
+                         tree_lookup(text, offsets, b'a'))
+        self.assertEqual((0o100644, b_sha), tree_lookup(text, offsets, b'a.c'))
+        self.assertEqual((stat.S_IFDIR, tree_sha),
+                         tree_lookup(text, offsets, b'a/c'))
+        self.assertEqual((0o100644, tree_sha), tree_lookup(text, offsets, b'b'))
+        self.assertEqual(None, tree_lookup(text, offsets, b'a.'))
+        self.assertEqual(None, tree_lookup(text, offsets, b'c'))
+        self.assertEqual(None, tree_lookup(text, offsets, b''))
+        self.assertEqual(None, tree_lookup(text, [], b'a'))
+
+    test_tree_lookup = functest_builder(_do_test_tree_lookup, _tree_lookup_py)
+    test_tree_lookup_extension = ext_functest_builder(
+        _do_test_tree_lookup, _tree_lookup)
+
+    def _do_test_tree_name_order(self, tree_name_order):
+        text = self._make_raw_tree().as_raw_string()
+        offsets = _tree_entry_offsets_py(text)
+        self.assertEqual([offsets[1], offsets[0], offsets[2], offsets[3]],
+                         tree_name_order(text, offsets))
+
+    test_tree_name_order = functest_builder(
+        _do_test_tree_name_order, _tree_name_order_py)
+    test_tree_name_order_extension = ext_functest_builder(
+        _do_test_tree_name_order, _tree_name_order)
+
+    def _do_test_tree_entry(self, tree_entry):
+        text = self._make_raw_tree().as_raw_string()
+        offsets = _tree_entry_offsets_py(text)
+        entry = tree_entry(text, offsets[1])
+        self.assertEqual(TreeEntry(b'a', stat.S_IFDIR, a_sha), entry)
+        self.assertTrue(isinstance(entry, TreeEntry))
+        self.assertEqual(int, type(entry.mode))
+        self.assertRaises(ObjectFormatException, tree_entry, text, len(text))
+
+    test_tree_entry = functest_builder(_do_test_tree_entry, _tree_entry_py)
+    test_tree_entry_extension = ext_functest_builder(
+        _do_test_tree_entry, _tree_entry)
+
+    def test_raw_iteritems_repeated(self):
+        t = self._make_raw_tree()
+        self.assertEqual(list(t.iteritems(True)), list(t.iteritems(True)))
+        self.assertEqual(list(t.iteritems()), t.items())
+        self.assertTrue(t._text is not None)
+
+    def test_raw_unsorted(self):
+        sha = hex_to_sha(a_sha)
+        sha2 = hex_to_sha(b_sha)
+        t = Tree.from_string(
+            b'100644 b\0' + sha + b'100644 a\0' + sha +
+            b'100644 c\0' + sha + b'100644 c\0' + sha2)
+        self.assertTrue(b'a' in t)
+        self.assertEqual((0o100644, b_sha), t[b'c'])
+        self.assertEqual([
+            TreeEntry(b'a', 0o100644, a_sha),
+            TreeEntry(b'b', 0o100644, a_sha),
+            TreeEntry(b'c', 0o100644, b_sha),
+            ], t.items())
+        self.assertEqual(3, len(t))
+        self.assertTrue(t._text is None)
+
+    def test_raw_duplicate_subtree(self):
+        t = Tree.from_string(
+            b'100644 a\0' + hex_to_sha(a_sha) +
+            b'100644 a.c\0' + hex_to_sha(b_sha) +
+            b'40000 a\0' + hex_to_sha(tree_sha))
+        self.assertEqual((stat.S_IFDIR, tree_sha), t[b'a'])
+        self.assertEqual([b'a.c', b'a'], [entry.path for entry in t.items()])
+        self.assertTrue(t._text is None)
+
     def test_add(self):
         myhexsha = b'd80c186a03f423a81b39df39dc87fd269736ca86'
         x = Tree()
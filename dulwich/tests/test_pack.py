@@ -20,13 +20,17 @@
 """Tests for Dulwich packs."""
 
 
+import array
 from io import BytesIO
 from hashlib import sha1
 import os
 import shutil
+import struct
 import tempfile
+import types
 import zlib
 
+from dulwich import pack as pack_module
 from dulwich.errors import (
     ApplyDeltaError,
     ChecksumMismatch,
@@ -47,28 +51,44 @@ from dulwich.objects import (
 from dulwich.pack import (
     OFS_DELTA,
     REF_DELTA,
+    DeltaBaseCache,
+    DeltaIndex,
+    FilePackReverseIndex,
     MemoryPackIndex,
+    MemoryPackReverseIndex,
     Pack,
     PackData,
+    PackIndexEntries,
     apply_delta,
     create_delta,
     deltify_pack_objects,
     load_pack_index,
     UnpackedObject,
     read_zlib_chunks,
+    sort_names,
     write_pack_header,
     write_pack_index_v1,
     write_pack_index_v2,
     write_pack_object,
+    write_pack_objects,
+    write_pack_rev_index,
     write_pack,
     unpack_object,
+    unpack_object_from,
     compute_file_sha,
+    PackStreamCopier,
     PackStreamReader,
+    StreamingPackIndexer,
     DeltaChainIterator,
+    _DeltaIndex_py,
     _delta_encode_size,
+    _read_zlib_chunks_py,
+    _sort_names_py,
+    _unpack_object_py,
     _encode_copy_operation,
     )
 from dulwich.tests import (
+    SkipTest,
     TestCase,
     )
 from dulwich.tests.utils import (
@@ -123,6 +143,20 @@ class PackIndexTests(PackTests):
         self.assertEqual(p.object_index(tree_sha), 138)
         self.assertEqual(p.object_index(commit_sha), 12)
 
+    def test_object_index_many(self):
+        p = self.get_pack_index(pack1_sha)
+        self.assertEqual(
+            [12, None, 178, 138, 178],
+            p.object_index_many([commit_sha, pack1_sha, hex_to_sha(a_sha),
+                                 tree_sha, a_sha]))
+        self.assertEqual([], p.object_index_many([]))
+
+    def test_contains_many(self):
+        p = self.get_pack_index(pack1_sha)
+        self.assertEqual([False, True, True, False],
+                         p.contains_many([b'0' * 40, tree_sha, commit_sha,
+                                          b'f' * 40]))
+
     def test_index_len(self):
         p = self.get_pack_index(pack1_sha)
         self.assertEqual(3, len(p))
@@ -188,6 +222,45 @@ class TestPackDeltas(TestCase):
         self._test_roundtrip(self.test_string_huge + self.test_string1,
                              self.test_string_huge + self.test_string2)
 
+    def test_binary_insert(self):
+        base = bytes(bytearray(range(256))) * 4
+        target = base[:300] + b'\x00\xff' * 100 + base[300:]
+        self._test_roundtrip(base, target)
+        self.assertTrue(len(create_delta(base, target)) < 300)
+
+    def _do_test_delta_index(self, delta_index_cls):
+        base = b''.join(
+            ('line %d\n' % i).encode('ascii') for i in range(1000))
+        index = delta_index_cls(base)
+        self.assertEqual(len(base), len(index))
+        targets = [
+            base,
+            b'',
+            b'new first line\n' + base,
+            base[:4000] + b'changed\n' + base[4100:],
+            base[5000:] + base[:5000],
+            ]
+        for target in targets:
+            delta = index.create_delta(target)
+            self.assertEqual(target, b''.join(apply_delta(base, delta)))
+            self.assertEqual(delta, _DeltaIndex_py(base).create_delta(target))
+        # Unchanged data is copied rather than inserted.
+        self.assertTrue(len(index.create_delta(targets[3])) < 100)
+        # Only the first blocks with the same contents are indexed.
+        base = b'0123456789abcdef' * 100 + b'tail'
+        target = b'0123456789abcdef' * 3 + b'tail'
+        delta = delta_index_cls(base).create_delta(target)
+        self.assertEqual(target, b''.join(apply_delta(base, delta)))
+        self.assertEqual(delta, _DeltaIndex_py(base).create_delta(target))
+
+    def test_delta_index(self):
+        self._do_test_delta_index(_DeltaIndex_py)
+
+    def test_delta_index_extension(self):
+        if DeltaIndex is _DeltaIndex_py:
+            raise SkipTest('DeltaIndex extension not found')
+        self._do_test_delta_index(DeltaIndex)
+
     def test_dest_overflow(self):
         self.assertRaises(
             ApplyDeltaError,
@@ -261,6 +334,31 @@ class TestPackData(PackTests):
             idx2 = self.get_pack_index(pack1_sha)
             self.assertEqual(idx1, idx2)
 
+    def test_iterobjects_mmap(self):
+        with self.get_pack_data(pack1_sha) as p:
+            expected = list(p.iterobjects())
+        path = os.path.join(self.datadir, 'pack-%s.pack' % pack1_sha.decode('ascii'))
+        with PackData(path, use_mmap=True) as p:
+            self.assertEqual(expected, list(p.iterobjects()))
+
+    def test_iterentries_mmap(self):
+        with self.get_pack_data(pack1_sha) as p:
+            expected = set(p.iterentries())
+        path = os.path.join(self.datadir, 'pack-%s.pack' % pack1_sha.decode('ascii'))
+        with PackData(path, use_mmap=True) as p:
+            self.assertEqual(expected, set(p.iterentries()))
+
+    def test_check_mmap(self):
+        path = os.path.join(self.datadir, 'pack-%s.pack' % pack1_sha.decode('ascii'))
+        with PackData(path, use_mmap=True) as p:
+            self.assertSucceeds(p.check)
+            self.assertEqual(p.calculate_checksum(), p.get_stored_checksum())
+
+    def test_get_object_at_mmap(self):
+        path = os.path.join(self.datadir, 'pack-%s.pack' % pack1_sha.decode('ascii'))
+        with PackData(path, use_mmap=True) as p:
+            self.assertEqual((3, [b'test 1\n']), p.get_object_at(178))
+
     def test_compute_file_sha(self):
         f = BytesIO(b'abcd1234wxyz')
         self.assertEqual(sha1(b'abcd1234wxyz').hexdigest(),
@@ -314,6 +412,17 @@ class TestPack(PackTests):
             self.assertEqual(expected, set(list(tuples)))
             self.assertEqual(3, len(tuples))
 
+    def test_get_raw_many(self):
+        with self.get_pack(pack1_sha) as p:
+            results = list(p.get_raw_many([tree_sha, a_sha, commit_sha]))
+            self.assertEqual(
+                sorted([p.index.object_index(s)
+                        for s in [tree_sha, a_sha, commit_sha]]),
+                [p.index.object_index(s) for s, _, _ in results])
+            for sha, type_num, raw in results:
+                self.assertEqual((type_num, raw), p.get_raw(sha))
+            self.assertRaises(KeyError, list, p.get_raw_many([b'1' * 40]))
+
     def test_get_object_at(self):
         """Tests random access for non-delta objects"""
         with self.get_pack(pack1_sha) as p:
@@ -357,6 +466,50 @@ class TestPack(PackTests):
         write_pack(basename, origpack.pack_tuples())
         return Pack(basename)
 
+    def test_rev_index_generated(self):
+        with self.get_pack(pack1_sha) as p:
+            rev = p.rev_index
+            self.assertTrue(isinstance(rev, MemoryPackReverseIndex))
+            self.assertEqual(3, len(rev))
+            offsets = [rev.offset(i) for i in range(len(rev))]
+            self.assertEqual(sorted(offsets), offsets)
+            for i, offset in enumerate(offsets):
+                self.assertEqual(i, rev.pack_position(offset))
+                self.assertEqual(
+                    offset, p.index.object_index(rev.name_at_offset(offset)))
+            self.assertEqual(offsets[1], rev.next_offset(offsets[0]))
+            self.assertEqual(None, rev.next_offset(offsets[-1]))
+            self.assertRaises(KeyError, rev.pack_position, offsets[0] + 1)
+            self.assertEqual(
+                p.data._get_size() - 12 - 20,
+                sum(p.object_size_on_disk(sha) for sha in p))
+
+    def test_rev_index_file(self):
+        with self.get_pack(pack1_sha) as p:
+            p = self._copy_pack(p)
+        with p:
+            expected = list(p.rev_index.iterpositions())
+            with open(p._basename + '.rev', 'wb') as f:
+                write_pack_rev_index(f, list(p.index.iterentries()),
+                                     p.index.get_pack_checksum())
+        p = Pack(p._basename)
+        with p:
+            rev = p.rev_index
+            self.assertTrue(isinstance(rev, FilePackReverseIndex))
+            self.assertSucceeds(rev.check)
+            self.assertEqual(expected, list(rev.iterpositions()))
+            self.assertEqual(p.index.get_pack_checksum(),
+                             rev.get_pack_checksum())
+
+    def test_rev_index_file_stale(self):
+        with self.get_pack(pack1_sha) as p:
+            p = self._copy_pack(p)
+        with open(p._basename + '.rev', 'wb') as f:
+            write_pack_rev_index(f, [], b'\0' * 20)
+        with p:
+            self.assertTrue(isinstance(p.rev_index, MemoryPackReverseIndex))
+            self.assertEqual(3, len(p.rev_index))
+
     def test_keep_no_message(self):
         with self.get_pack(pack1_sha) as p:
             p = self._copy_pack(p)
@@ -486,6 +639,203 @@ class TestThinPack(PackTests):
                 sorted(o.id for o in p.iterobjects()))
 
 
+class DeltaReuseTests(TestCase):
+
+    def setUp(self):
+        super(DeltaReuseTests, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def make_pack(self, objects_spec):
+        basename = os.path.join(self.tempdir, 'delta')
+        with open(basename + '.pack', 'wb') as f:
+            entries = build_pack(f, objects_spec)
+        with PackData(basename + '.pack') as data:
+            data.create_index_v2(basename + '.idx')
+        pack = Pack(basename)
+        self.addCleanup(pack.close)
+        return pack, entries
+
+    def make_delta_pack(self):
+        return self.make_pack([
+            (Blob.type_num, b'blob' * 100),
+            (OFS_DELTA, (0, b'blob' * 100 + b'1')),
+            (REF_DELTA, (0, b'blob' * 100 + b'2')),
+            (Blob.type_num, b'other'),
+        ])
+
+    def read_pack(self, f):
+        data = PackData.from_file(BytesIO(f.getvalue()), len(f.getvalue()))
+        return dict((unpacked.sha(), unpacked)
+                    for unpacked in DeltaChainIterator.for_pack_data(data))
+
+    def test_get_unpacked_object(self):
+        pack, entries = self.make_delta_pack()
+        base_sha = entries[0][3]
+        unpacked = pack.get_unpacked_object(entries[1][3])
+        self.assertEqual(REF_DELTA, unpacked.pack_type_num)
+        self.assertEqual(base_sha, unpacked.delta_base)
+        self.assertEqual(None, unpacked.comp_chunks)
+        unpacked = pack.get_unpacked_object(entries[2][3], include_comp=True)
+        self.assertEqual(REF_DELTA, unpacked.pack_type_num)
+        self.assertEqual(base_sha, unpacked.delta_base)
+        self.assertEqual(entries[2][4], unpacked.crc32)
+        self.assertEqual(unpacked.decomp_chunks,
+                         [zlib.decompress(b''.join(unpacked.comp_chunks))])
+        unpacked = pack.get_unpacked_object(sha_to_hex(entries[3][3]))
+        self.assertEqual(Blob.type_num, unpacked.pack_type_num)
+        self.assertRaises(KeyError, pack.get_unpacked_object, b'\0' * 20)
+
+    def test_get_unpacked_object_crc32_mismatch(self):
+        pack, entries = self.make_delta_pack()
+        pack.index._unpack_crc32_checksum = lambda i: 0
+        pack.get_unpacked_object(entries[1][3])
+        self.assertRaises(ChecksumMismatch, pack.get_unpacked_object,
+                          entries[1][3], include_comp=True)
+
+    def test_get_compressed_object(self):
+        pack, entries = self.make_delta_pack()
+        for entry in entries:
+            expected = pack.get_unpacked_object(entry[3], include_comp=True)
+            unpacked = pack.get_compressed_object(entry[3])
+            self.assertEqual(expected.pack_type_num, unpacked.pack_type_num)
+            self.assertEqual(expected.delta_base, unpacked.delta_base)
+            self.assertEqual(expected.decomp_len, unpacked.decomp_len)
+            self.assertEqual(entry[4], unpacked.crc32)
+            self.assertEqual(b''.join(expected.comp_chunks),
+                             b''.join(unpacked.comp_chunks))
+            self.assertEqual([], unpacked.decomp_chunks)
+        self.assertRaises(KeyError, pack.get_compressed_object, b'\0' * 20)
+
+    def test_get_object_header(self):
+        pack, entries = self.make_delta_pack()
+        for entry in entries:
+            expected = pack.get_unpacked_object(entry[3])
+            unpacked = pack.get_object_header(entry[3])
+            self.assertEqual(expected.pack_type_num, unpacked.pack_type_num)
+            self.assertEqual(expected.delta_base, unpacked.delta_base)
+            self.assertEqual(expected.decomp_len, unpacked.decomp_len)
+            self.assertEqual([], unpacked.decomp_chunks)
+        self.assertRaises(KeyError, pack.get_object_header, b'\0' * 20)
+
+    def test_get_compressed_object_crc32_mismatch(self):
+        pack, entries = self.make_delta_pack()
+        pack.index._unpack_crc32_checksum = lambda i: 0
+        self.assertRaises(ChecksumMismatch, pack.get_compressed_object,
+                          entries[3][3])
+
+    def test_write_pack_objects_reuses_deltas(self):
+        pack, entries = self.make_delta_pack()
+        objects = [(pack[sha_to_hex(entry[3])], None) for entry in entries]
+        f = BytesIO()
+        write_pack_objects(f, objects, reuse_deltas_from=pack)
+        written = self.read_pack(f)
+        self.assertEqual(
+            sorted((entry[3], entry[2]) for entry in entries),
+            sorted((sha, b''.join(unpacked.obj_chunks))
+                   for (sha, unpacked) in written.items()))
+        for entry in entries[1:3]:
+            self.assertEqual(OFS_DELTA, written[entry[3]].pack_type_num)
+            self.assertEqual(
+                pack.get_unpacked_object(entry[3]).decomp_chunks,
+                written[entry[3]].decomp_chunks)
+        self.assertEqual(Blob.type_num, written[entries[0][3]].pack_type_num)
+
+    def test_write_pack_objects_inflates_only_reused(self):
+        pack, entries = self.make_delta_pack()
+        objects = [(pack[sha_to_hex(entry[3])], None) for entry in entries]
+        inflated = []
+        get_unpacked_object_at = pack.data.get_unpacked_object_at
+
+        def record(offset, include_comp=False):
+            inflated.append(offset)
+            return get_unpacked_object_at(offset, include_comp=include_comp)
+        pack.data.get_unpacked_object_at = record
+        write_pack_objects(BytesIO(), objects, reuse_deltas_from=pack)
+        self.assertEqual([], inflated)
+
+    def test_write_pack_objects_reused_max_depth(self):
+        spec = [(Blob.type_num, b'blob' * 100)]
+        for i in range(1, 6):
+            spec.append((OFS_DELTA, (i - 1, b'blob' * 100 + b'x' * i)))
+        pack, entries = self.make_pack(spec)
+        objects = [(pack[sha_to_hex(entry[3])], None) for entry in entries]
+        f = BytesIO()
+        write_pack_objects(f, objects, reuse_deltas_from=pack,
+                           delta_max_depth=2)
+        written = self.read_pack(f)
+        by_offset = dict((unpacked.offset, sha)
+                         for (sha, unpacked) in written.items())
+
+        def depth(sha):
+            unpacked = written[sha]
+            if unpacked.pack_type_num != OFS_DELTA:
+                return 0
+            return depth(by_offset[unpacked.offset - unpacked.delta_base]) + 1
+        self.assertEqual([0, 1, 2, 0, 1, 2],
+                         [depth(entry[3]) for entry in entries])
+        self.assertEqual(
+            sorted((entry[3], entry[2]) for entry in entries),
+            sorted((sha, b''.join(unpacked.obj_chunks))
+                   for (sha, unpacked) in written.items()))
+
+    def test_write_pack_objects_base_not_written(self):
+        pack, entries = self.make_delta_pack()
+        objects = [(pack[sha_to_hex(entry[3])], None)
+                   for entry in entries[1:]]
+        f = BytesIO()
+        write_pack_objects(f, objects, reuse_deltas_from=pack)
+        written = self.read_pack(f)
+        self.assertEqual(
+            [Blob.type_num] * 3,
+            [unpacked.pack_type_num for unpacked in written.values()])
+
+    def test_write_pack_objects_crc32_mismatch(self):
+        pack, entries = self.make_delta_pack()
+        pack.index._unpack_crc32_checksum = lambda i: 0
+        objects = [(pack[sha_to_hex(entry[3])], None) for entry in entries]
+        f = BytesIO()
+        write_pack_objects(f, objects, reuse_deltas_from=pack)
+        written = self.read_pack(f)
+        self.assertEqual(
+            [Blob.type_num] * 4,
+            [unpacked.pack_type_num for unpacked in written.values()])
+
+    def test_write_pack_objects_delta_cycle(self):
+        b1 = make_object(Blob, data=b'blob' * 100 + b'1')
+        b2 = make_object(Blob, data=b'blob' * 100 + b'2')
+
+        class DeltaStore(object):
+
+            def get_unpacked_object(self, sha, include_comp=False):
+                if sha == b1.sha().digest():
+                    target, base = b1, b2
+                else:
+                    target, base = b2, b1
+                delta = create_delta(base.as_raw_string(),
+                                     target.as_raw_string())
+                unpacked = UnpackedObject(
+                    REF_DELTA, base.sha().digest(), len(delta), None)
+                unpacked.decomp_chunks = [delta]
+                if include_comp:
+                    unpacked.comp_chunks = [zlib.compress(delta)]
+                return unpacked
+
+            def get_object_header(self, sha):
+                return self.get_unpacked_object(sha)
+
+            def get_compressed_object(self, sha):
+                return self.get_unpacked_object(sha, include_comp=True)
+
+        f = BytesIO()
+        write_pack_objects(f, [(b1, None), (b2, None)],
+                           reuse_deltas_from=DeltaStore())
+        written = self.read_pack(f)
+        self.assertEqual(
+            sorted([Blob.type_num, OFS_DELTA]),
+            sorted(unpacked.pack_type_num for unpacked in written.values()))
+
+
 class WritePackTests(TestCase):
 
     def test_write_pack_header(self):
@@ -510,6 +860,15 @@ class WritePackTests(TestCase):
         self.assertEqual(crc32, unpacked.crc32)
         self.assertEqual(b'x', unused)
 
+    def test_write_pack_object_compression_level(self):
+        data = b'blob' * 100
+        f = BytesIO()
+        write_pack_object(f, Blob.type_num, data, compression_level=0)
+        self.assertTrue(f.getvalue().endswith(zlib.compress(data, 0)))
+        f = BytesIO()
+        write_pack_object(f, Blob.type_num, data, compression_level=9)
+        self.assertTrue(f.getvalue().endswith(zlib.compress(data, 9)))
+
     def test_write_pack_object_sha(self):
         f = BytesIO()
         f.write(b'header')
@@ -521,6 +880,24 @@ class WritePackTests(TestCase):
         sha_b.update(f.getvalue()[offset:])
         self.assertEqual(sha_a.digest(), sha_b.digest())
 
+    def test_write_pack_objects_compression_threads(self):
+        objects = [
+            (make_object(Blob, data=b'blob' * i + ('%d' % i).encode('ascii')),
+             None) for i in range(40)]
+        f_serial = BytesIO()
+        serial = write_pack_objects(f_serial, objects, deltify=True)
+        f_threaded = BytesIO()
+        threaded = write_pack_objects(f_threaded, objects, deltify=True,
+                                      compression_threads=4)
+        self.assertEqual(serial, threaded)
+        self.assertEqual(f_serial.getvalue(), f_threaded.getvalue())
+        data = PackData.from_file(
+            BytesIO(f_threaded.getvalue()), len(f_threaded.getvalue()))
+        self.assertEqual(
+            sorted(o.sha().digest() for (o, path) in objects),
+            sorted(unpacked.sha() for unpacked in
+                   DeltaChainIterator.for_pack_data(data)))
+
 
 pack_checksum = hex_to_sha('721980e866af9a5f93ad674144e1459b8ba3e7b7')
 
@@ -649,6 +1026,297 @@ class TestPackIndexWritingv2(TestCase, BaseTestFilePackIndexWriting):
         TestCase.tearDown(self)
         BaseTestFilePackIndexWriting.tearDown(self)
 
+    def test_pack_index_entries(self):
+        entries = [
+            (hex_to_sha('4e6388232ec39792661e2e75db8fb117fc869ce6'), 12, 24),
+            (hex_to_sha('6f670c0fb53f9463760b7295fbb814e965fb20c8'),
+             0xf2972d0830529b87, 42),
+            (hex_to_sha('e98f071751bd77f59967bfa671cd2caebdccc9a2'), 178, 92),
+            ]
+        columns = PackIndexEntries()
+        for name, offset, crc32 in reversed(entries):
+            columns.add(name, offset, crc32)
+        f_list = BytesIO()
+        write_pack_index_v2(f_list, entries, pack_checksum)
+        f_columns = BytesIO()
+        write_pack_index_v2(f_columns, columns, pack_checksum)
+        self.assertEqual(f_list.getvalue(), f_columns.getvalue())
+
+    def test_object_index_many(self):
+        entries = [
+            (hex_to_sha('4e6388232ec39792661e2e75db8fb117fc869ce6'), 12, 24),
+            (hex_to_sha('6f670c0fb53f9463760b7295fbb814e965fb20c8'),
+             0xf2972d0830529b87, 42),
+            (hex_to_sha('6f670c0fb53f9463760b7295fbb814e965fb20c9'), 178, 92),
+            ]
+        idx = self.index('many.idx', entries, pack_checksum)
+        self.assertEqual(entries, list(idx.iterentries()))
+        self.assertEqual(
+            [178, None, 0xf2972d0830529b87, 12],
+            idx.object_index_many([
+                entries[2][0], hex_to_sha('6f' * 20), entries[1][0],
+                entries[0][0]]))
+
+    def test_object_index_many_large(self):
+        entries = sorted(
+            (sha1(('%d' % i).encode('ascii')).digest(), i * 10, i)
+            for i in range(600))
+        idx = self.index('many.idx', entries, pack_checksum)
+        missing = [sha1(('x%d' % i).encode('ascii')).digest()
+                   for i in range(600)]
+        offsets = dict((name, offset) for (name, offset, crc32) in entries)
+        # A few SHAs are looked up by bisection, many by a single pass.
+        for shas in [[entries[5][0], missing[0], entries[3][0]],
+                     [entry[0] for entry in entries] + missing]:
+            self.assertEqual([offsets.get(sha) for sha in shas],
+                             idx.object_index_many(shas))
+
+
+class PackIndexEntriesTests(TestCase):
+
+    def test_mapping(self):
+        entries = PackIndexEntries()
+        entries.add(b'b' * 20, 12, 2)
+        entries[b'a' * 20] = (40, 1)
+        self.assertEqual(2, len(entries))
+        self.assertTrue(b'a' * 20 in entries)
+        self.assertFalse(b'c' * 20 in entries)
+        self.assertEqual((12, 2), entries[b'b' * 20])
+        self.assertEqual(40, entries.offset(b'a' * 20))
+        self.assertRaises(KeyError, entries.offset, b'c' * 20)
+        self.assertEqual({b'a' * 20: (40, 1), b'b' * 20: (12, 2)},
+                         dict(entries.items()))
+        self.assertEqual({b'a' * 20: (40, 1), b'b' * 20: (12, 2)}, entries)
+        self.assertEqual([b'a' * 20, b'b' * 20], sorted(entries.keys()))
+        self.assertEqual([(12, 2), (40, 1)], sorted(entries.values()))
+        self.assertEqual((12, 2), entries.get(b'b' * 20))
+        self.assertEqual(None, entries.get(b'c' * 20))
+
+    def test_delete(self):
+        entries = PackIndexEntries()
+        entries.add(b'b' * 20, 12, 2)
+        entries.add(b'a' * 20, 40, 1)
+        del entries[b'b' * 20]
+        self.assertEqual([(b'a' * 20, 40, 1)], list(entries.iterentries()))
+        entries.add(b'b' * 20, 60, 3)
+        self.assertEqual([(b'a' * 20, 40, 1), (b'b' * 20, 60, 3)],
+                         list(entries.iterentries()))
+
+    def test_large_offset(self):
+        entries = PackIndexEntries()
+        entries.add(b'a' * 20, 1 << 33, 1)
+        self.assertEqual((1 << 33, 1), entries[b'a' * 20])
+        self.assertEqual([(b'a' * 20, 1 << 33, 1)],
+                         list(entries.iterentries()))
+
+    def test_replace(self):
+        entries = PackIndexEntries()
+        entries.add(b'a' * 20, 12, 2)
+        entries.add(b'a' * 20, 40, 1)
+        self.assertEqual(1, len(entries))
+        self.assertEqual((40, 1), entries[b'a' * 20])
+
+    def test_iterentries(self):
+        entries = PackIndexEntries()
+        entries.add(b'b' * 20, 12, 2)
+        entries.add(b'a' * 20, 40, 1)
+        self.assertEqual([(b'a' * 20, 40, 1), (b'b' * 20, 12, 2)],
+                         list(entries.iterentries()))
+
+
+    def test_grow_after_delete(self):
+        names = [sha1(str(i).encode('ascii')).digest() for i in range(200)]
+        entries = PackIndexEntries()
+        expected = {}
+        for i, name in enumerate(names[:100]):
+            entries.add(name, i, i)
+            expected[name] = (i, i)
+        for name in names[:100:3]:
+            del entries[name]
+            del expected[name]
+        self.assertRaises(KeyError, entries.__delitem__, names[0])
+        for i, name in enumerate(names[:110]):
+            entries.add(name, 1000 + i, 0)
+            expected[name] = (1000 + i, 0)
+        self.assertEqual(110, len(entries))
+        self.assertEqual(expected, dict(entries.items()))
+        self.assertEqual(sorted((name, offset, crc32) for (name, (offset, crc32))
+                                in expected.items()),
+                         list(entries.iterentries()))
+
+    def test_invalid_name(self):
+        entries = PackIndexEntries()
+        self.assertRaises(ValueError, entries.add, b'a' * 19, 12, 2)
+        self.assertFalse(b'a' * 19 in entries)
+
+
+class SortNamesTests(TestCase):
+
+    sort_names = staticmethod(_sort_names_py)
+
+    def test_sort(self):
+        names = [sha1(str(i).encode('ascii')).digest() for i in range(10)]
+        sorted_names, order = self.sort_names(b''.join(names))
+        order = array.array('I', order)
+        self.assertEqual(b''.join(sorted(names)), sorted_names)
+        self.assertEqual(sorted(names), [names[i] for i in order])
+
+    def test_bytearray(self):
+        sorted_names, order = self.sort_names(
+            bytearray(b'b' * 20 + b'a' * 20))
+        self.assertEqual(b'a' * 20 + b'b' * 20, sorted_names)
+        self.assertEqual([1, 0], list(array.array('I', order)))
+
+    def test_empty(self):
+        self.assertEqual((b'', b''), self.sort_names(b''))
+
+
+class SortNamesExtensionTests(SortNamesTests):
+
+    sort_names = staticmethod(sort_names)
+
+    def setUp(self):
+        super(SortNamesExtensionTests, self).setUp()
+        if not isinstance(self.sort_names, types.BuiltinFunctionType):
+            self.skipTest("sort_names extension not found")
+
+    def test_invalid_length(self):
+        self.assertRaises(ValueError, self.sort_names, b'a' * 19)
+
+
+class UnpackObjectFromTests(TestCase):
+
+    def test_matches_unpack_object(self):
+        f = BytesIO()
+        entries = build_pack(f, [
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+            (REF_DELTA, (0, b'blob2' * 1000)),
+        ])
+        contents = f.getvalue()
+        for offset, _, _, _, crc32 in entries:
+            f.seek(offset)
+            expected, unused = unpack_object(f.read, compute_crc32=True,
+                                             include_comp=True)
+            unpacked, end = unpack_object_from(
+                contents, offset, compute_crc32=True, include_comp=True)
+            self.assertEqual(crc32, unpacked.crc32)
+            self.assertEqual(expected.delta_base, unpacked.delta_base)
+            self.assertEqual(b''.join(expected.decomp_chunks),
+                             b''.join(unpacked.decomp_chunks))
+            self.assertEqual(b''.join(expected.comp_chunks),
+                             b''.join(unpacked.comp_chunks))
+            self.assertEqual(f.tell() - len(unused), end)
+
+    def test_truncated(self):
+        f = BytesIO()
+        entries = build_pack(f, [(Blob.type_num, b'blob' * 100)])
+        contents = f.getvalue()[:-30]
+        self.assertRaises(zlib.error, unpack_object_from, contents,
+                          entries[0][0])
+
+    def test_delta_chain_iterator(self):
+        f = BytesIO()
+        entries = build_pack(f, [
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+            (OFS_DELTA, (1, b'blob2')),
+        ])
+        data = PackData('test.pack', file=f, use_mmap=True)
+        pack_iter = TestPackIterator.for_pack_data(data)
+        self.assertEqual(entries, list(pack_iter._walk_all_chains()))
+
+
+class DeltaBaseCacheTests(TestCase):
+
+    def test_get_add(self):
+        cache = DeltaBaseCache()
+        self.assertEqual(None, cache.get(0, 12))
+        cache.add(0, 12, Blob.type_num, [b'blob'])
+        self.assertEqual((Blob.type_num, [b'blob']), cache.get(0, 12))
+        self.assertEqual(None, cache.get(1, 12))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, cache.misses)
+        self.assertEqual(4, cache.size)
+
+    def test_max_size(self):
+        cache = DeltaBaseCache(max_size=1000)
+        for offset in range(12, 22):
+            cache.add(0, offset, Blob.type_num, [b'x' * 300])
+        self.assertTrue(cache.size <= 1000)
+        self.assertEqual(None, cache.get(0, 12))
+        self.assertEqual((Blob.type_num, [b'x' * 300]), cache.get(0, 21))
+        cache.add(0, 30, Blob.type_num, [b'x' * 2000])
+        self.assertEqual(None, cache.get(0, 30))
+
+    def test_clear(self):
+        cache = DeltaBaseCache()
+        cache.add(0, 12, Blob.type_num, [b'blob'])
+        cache.get(0, 12)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+    def _resolve(self, data, offset):
+        type_num, obj = data.get_object_at(offset)
+        type_num, chunks = data.resolve_object(offset, type_num, obj)
+        return type_num, b''.join(chunks)
+
+    def _build_chain(self, cache=None):
+        f = BytesIO()
+        entries = build_pack(f, [
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+            (OFS_DELTA, (1, b'blob2')),
+            (OFS_DELTA, (2, b'blob3')),
+        ])
+        data = PackData('test.pack', file=f, delta_base_cache=cache)
+        reads = []
+        get_object_at = data._get_object_at
+
+        def counting_get_object_at(offset):
+            reads.append(offset)
+            return get_object_at(offset)
+        data._get_object_at = counting_get_object_at
+        return data, entries, reads
+
+    def test_resolve_caches_bases(self):
+        data, entries, reads = self._build_chain()
+        self.assertEqual((Blob.type_num, b'blob3'),
+                         self._resolve(data, entries[3][0]))
+        self.assertEqual([e[0] for e in reversed(entries)], reads)
+        cache = data.delta_base_cache
+        self.assertEqual(3, len(cache))
+        for offset, _, obj, _, _ in entries[:3]:
+            type_num, chunks = cache.get(data._cache_key, offset)
+            self.assertEqual(obj, b''.join(chunks))
+        self.assertEqual(None, cache.get(data._cache_key, entries[3][0]))
+
+    def test_resolve_reuses_nearest_base(self):
+        data, entries, reads = self._build_chain()
+        self._resolve(data, entries[3][0])
+        del reads[:]
+        hits = data.delta_base_cache.hits
+        self.assertEqual((Blob.type_num, b'blob3'),
+                         self._resolve(data, entries[3][0]))
+        self.assertEqual([entries[3][0]], reads)
+        self.assertEqual(hits + 1, data.delta_base_cache.hits)
+        del reads[:]
+        self.assertEqual((Blob.type_num, b'blob2'),
+                         self._resolve(data, entries[2][0]))
+        self.assertEqual([], reads)
+
+    def test_shared_between_packs(self):
+        cache = DeltaBaseCache()
+        data1, entries1, reads1 = self._build_chain(cache)
+        data2, entries2, reads2 = self._build_chain(cache)
+        self._resolve(data1, entries1[3][0])
+        self.assertEqual((Blob.type_num, b'blob3'),
+                         self._resolve(data2, entries2[3][0]))
+        self.assertEqual([e[0] for e in reversed(entries2)], reads2)
+        self.assertEqual(6, len(cache))
+
 
 class ReadZlibTests(TestCase):
 
@@ -662,6 +1330,8 @@ class ReadZlibTests(TestCase):
     comp = zlib.compress(decomp)
     extra = b'nextobject'
 
+    read_zlib_chunks = staticmethod(_read_zlib_chunks_py)
+
     def setUp(self):
         super(ReadZlibTests, self).setUp()
         self.read = BytesIO(self.comp + self.extra).read
@@ -670,38 +1340,54 @@ class ReadZlibTests(TestCase):
     def test_decompress_size(self):
         good_decomp_len = len(self.decomp)
         self.unpacked.decomp_len = -1
-        self.assertRaises(ValueError, read_zlib_chunks, self.read,
+        self.assertRaises(ValueError, self.read_zlib_chunks, self.read,
                           self.unpacked)
         self.unpacked.decomp_len = good_decomp_len - 1
-        self.assertRaises(zlib.error, read_zlib_chunks, self.read,
+        self.assertRaises(zlib.error, self.read_zlib_chunks, self.read,
                           self.unpacked)
         self.unpacked.decomp_len = good_decomp_len + 1
-        self.assertRaises(zlib.error, read_zlib_chunks, self.read,
+        self.assertRaises(zlib.error, self.read_zlib_chunks, self.read,
                           self.unpacked)
 
+    def test_decompress_size_corrupt(self):
+        # A size far beyond what the stream inflates to is not allocated.
+        self.unpacked.decomp_len = 1 << 60
+        self.assertRaises(zlib.error, self.read_zlib_chunks, self.read,
+                          self.unpacked)
+
+    def test_decompress_large(self):
+        decomp = b''.join(struct.pack('>L', i) for i in range(1 << 20))
+        comp = zlib.compress(decomp)
+        read = BytesIO(comp + self.extra).read
+        unpacked = UnpackedObject(Blob.type_num, None, len(decomp), 0)
+        unused = self.read_zlib_chunks(read, unpacked, buffer_size=1 << 16)
+        self.assertEqual(decomp, b''.join(unpacked.decomp_chunks))
+        self.assertEqual(zlib.crc32(comp), unpacked.crc32)
+        self.assertEqual(self.extra, unused + read())
+
     def test_decompress_truncated(self):
         read = BytesIO(self.comp[:10]).read
-        self.assertRaises(zlib.error, read_zlib_chunks, read, self.unpacked)
+        self.assertRaises(zlib.error, self.read_zlib_chunks, read, self.unpacked)
 
         read = BytesIO(self.comp).read
-        self.assertRaises(zlib.error, read_zlib_chunks, read, self.unpacked)
+        self.assertRaises(zlib.error, self.read_zlib_chunks, read, self.unpacked)
 
     def test_decompress_empty(self):
         unpacked = UnpackedObject(Tree.type_num, None, 0, None)
         comp = zlib.compress(b'')
         read = BytesIO(comp + self.extra).read
-        unused = read_zlib_chunks(read, unpacked)
+        unused = self.read_zlib_chunks(read, unpacked)
         self.assertEqual(b'', b''.join(unpacked.decomp_chunks))
         self.assertNotEqual(b'', unused)
         self.assertEqual(self.extra, unused + read())
 
     def test_decompress_no_crc32(self):
         self.unpacked.crc32 = None
-        read_zlib_chunks(self.read, self.unpacked)
+        self.read_zlib_chunks(self.read, self.unpacked)
         self.assertEqual(None, self.unpacked.crc32)
 
     def _do_decompress_test(self, buffer_size, **kwargs):
-        unused = read_zlib_chunks(self.read, self.unpacked,
+        unused = self.read_zlib_chunks(self.read, self.unpacked,
                                   buffer_size=buffer_size, **kwargs)
         self.assertEqual(self.decomp, b''.join(self.unpacked.decomp_chunks))
         self.assertEqual(zlib.crc32(self.comp), self.unpacked.crc32)
@@ -731,6 +1417,104 @@ class ReadZlibTests(TestCase):
         self.assertEqual(self.comp, b''.join(self.unpacked.comp_chunks))
 
 
+class ReadZlibExtensionTests(ReadZlibTests):
+
+    read_zlib_chunks = staticmethod(read_zlib_chunks)
+
+    def setUp(self):
+        super(ReadZlibExtensionTests, self).setUp()
+        if not isinstance(self.read_zlib_chunks, types.BuiltinFunctionType):
+            self.skipTest("read_zlib_chunks extension not found")
+
+    def test_decompress_stream_ends_at_buffer_end(self):
+        # The zlib stream ends exactly at the end of a read; the following
+        # read then only returns leftover data.
+        reads = [self.comp, self.extra]
+        unused = self.read_zlib_chunks(lambda size: reads.pop(0),
+                                       self.unpacked, include_comp=True)
+        self.assertEqual(self.extra, unused)
+        self.assertEqual(self.decomp, b''.join(self.unpacked.decomp_chunks))
+        self.assertEqual(self.comp, b''.join(self.unpacked.comp_chunks))
+        self.assertEqual(zlib.crc32(self.comp), self.unpacked.crc32)
+
+
+class UnpackObjectTests(TestCase):
+
+    unpack_object = staticmethod(_unpack_object_py)
+
+    def _unpack_all(self, f, entries, **kwargs):
+        ret = []
+        for offset, _, _, _, _ in entries:
+            f.seek(offset)
+            unpacked, unused = self.unpack_object(f.read, **kwargs)
+            ret.append((unpacked.pack_type_num, unpacked.delta_base,
+                        b''.join(unpacked.decomp_chunks), unpacked.crc32,
+                        f.tell() - len(unused)))
+        return ret
+
+    def test_unpack(self):
+        f = BytesIO()
+        entries = build_pack(f, [
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+            (REF_DELTA, (0, b'blob2' * 1000)),
+        ])
+        unpacked = self._unpack_all(f, entries, compute_crc32=True)
+        self.assertEqual([3, OFS_DELTA, REF_DELTA], [u[0] for u in unpacked])
+        self.assertEqual(b'blob', unpacked[0][2])
+        self.assertEqual(entries[1][0] - entries[0][0], unpacked[1][1])
+        self.assertEqual(entries[0][3], unpacked[2][1])
+        self.assertEqual([e[4] for e in entries], [u[3] for u in unpacked])
+        self.assertEqual([e[0] for e in entries[1:]],
+                         [u[4] for u in unpacked[:-1]])
+
+    def test_unpack_no_crc32(self):
+        f = BytesIO()
+        entries = build_pack(f, [(Blob.type_num, b'blob')])
+        self.assertEqual(
+            [None], [u[3] for u in self._unpack_all(f, entries)])
+
+    def test_unpack_include_comp(self):
+        f = BytesIO()
+        entries = build_pack(f, [(Blob.type_num, b'blob' * 100)])
+        f.seek(entries[0][0])
+        unpacked, _ = self.unpack_object(f.read, include_comp=True)
+        self.assertEqual(b'blob' * 100,
+                         zlib.decompress(b''.join(unpacked.comp_chunks)))
+
+    def test_unpack_matches_python(self):
+        f = BytesIO()
+        entries = build_pack(f, [
+            (Commit.type_num, b'commit'),
+            (OFS_DELTA, (0, b'commit2')),
+            (REF_DELTA, (1, b'commit3')),
+        ])
+        expected = []
+        for offset, _, _, _, _ in entries:
+            f.seek(offset)
+            expected.append(_unpack_object_py(f.read, compute_crc32=True)[0])
+        for offset, unpacked in zip([e[0] for e in entries], expected):
+            f.seek(offset)
+            actual, _ = self.unpack_object(f.read, compute_crc32=True)
+            self.assertEqual(unpacked.pack_type_num, actual.pack_type_num)
+            self.assertEqual(unpacked.delta_base, actual.delta_base)
+            self.assertEqual(type(unpacked.delta_base),
+                             type(actual.delta_base))
+            self.assertEqual(unpacked.decomp_len, actual.decomp_len)
+            self.assertEqual(unpacked.crc32, actual.crc32)
+            self.assertEqual(type(unpacked.crc32), type(actual.crc32))
+
+
+class UnpackObjectExtensionTests(UnpackObjectTests):
+
+    unpack_object = staticmethod(unpack_object)
+
+    def setUp(self):
+        super(UnpackObjectExtensionTests, self).setUp()
+        if not isinstance(self.unpack_object, types.BuiltinFunctionType):
+            self.skipTest("unpack_object extension not found")
+
+
 class DeltifyTests(TestCase):
 
     def test_empty(self):
@@ -752,6 +1536,74 @@ class DeltifyTests(TestCase):
             ],
             list(deltify_pack_objects([(b1, b""), (b2, b"")])))
 
+    def test_window_memory(self):
+        b1 = Blob.from_string(b"a" * 100)
+        b2 = Blob.from_string(b"b" * 99)
+        b3 = Blob.from_string(b"a" * 98)
+        objects = [(b1, b""), (b2, b""), (b3, b"")]
+        self.assertEqual(
+            [None, None, b1.sha().digest()],
+            [base for (type_num, sha, base, raw)
+             in deltify_pack_objects(objects)])
+        # b1 no longer fits in the window by the time b3 is considered.
+        self.assertEqual(
+            [None, None, None],
+            [base for (type_num, sha, base, raw)
+             in deltify_pack_objects(objects, window_memory=150)])
+
+    def test_window_size(self):
+        b1 = Blob.from_string(b"a" * 100)
+        b2 = Blob.from_string(b"b" * 99)
+        b3 = Blob.from_string(b"a" * 98)
+        objects = [(b1, b""), (b2, b""), (b3, b"")]
+        self.assertEqual(
+            [None, None, None],
+            [base for (type_num, sha, base, raw)
+             in deltify_pack_objects(objects, window_size=1)])
+
+    def _make_objects(self):
+        objects = []
+        for i in range(30):
+            b = Blob.from_string(
+                b"blob" * (i % 7 + 10) + ("%d" % i).encode("ascii"))
+            objects.append((b, ("path%d" % (i % 3)).encode("ascii")))
+        for i in range(5):
+            t = Tree()
+            t.add(("file%d" % i).encode("ascii"), 0o100644, objects[i][0].id)
+            objects.append((t, b""))
+        return objects
+
+    def test_parallel(self):
+        objects = self._make_objects()
+        self.assertEqual(
+            list(deltify_pack_objects(objects)),
+            list(deltify_pack_objects(objects, processes=2, segment_size=4)))
+
+    def _assert_max_depth(self, results, max_depth):
+        depths = {}
+        for type_num, sha, base, raw in results:
+            if base is None:
+                depths[sha] = 0
+            else:
+                depths[sha] = depths[base] + 1
+        self.assertEqual(max_depth, max(depths.values()))
+
+    def test_max_depth(self):
+        objects = [(Blob.from_string(b"blob" * (20 - i)), b"")
+                   for i in range(10)]
+        self._assert_max_depth(deltify_pack_objects(objects), 9)
+        self._assert_max_depth(
+            deltify_pack_objects(objects, max_depth=2), 2)
+        self._assert_max_depth(deltify_pack_objects(
+            objects, max_depth=2, processes=2, segment_size=3), 2)
+
+    def test_parallel_overlap(self):
+        objects = self._make_objects()
+        self.assertEqual(
+            [None] * len(objects),
+            [base for (type_num, sha, base, raw) in deltify_pack_objects(
+                objects, processes=2, segment_size=1, overlap=0)])
+
 
 class TestPackStreamReader(TestCase):
 
@@ -1035,6 +1887,208 @@ class DeltaChainIteratorTests(TestCase):
             self.assertEqual((sorted([b2.id, b3.id]),), (sorted(e.args[0]),))
 
 
+class ParallelDeltaChainIteratorTests(TestCase):
+
+    def setUp(self):
+        super(ParallelDeltaChainIteratorTests, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.store = MemoryObjectStore()
+
+    def make_pack_file(self, objects_spec):
+        f = BytesIO()
+        entries = build_pack(f, objects_spec, store=self.store)
+        path = os.path.join(self.tempdir, 'test.pack')
+        with open(path, 'wb') as pack_file:
+            pack_file.write(f.getvalue())
+        return path, entries
+
+    def make_parallel_iter(self, path, resolve_ext_ref=None):
+        data = PackData(path)
+        self.addCleanup(data.close)
+        return TestPackIterator.for_pack_data(
+            data, resolve_ext_ref=resolve_ext_ref)
+
+    def assertParallelEntriesMatch(self, expected_indexes, entries, pack_iter):
+        expected = [entries[i] for i in expected_indexes]
+        self.assertEqual(sorted(expected),
+                         sorted(pack_iter.iter_parallel(processes=2)))
+
+    def test_parallel_ofs_deltas(self):
+        objects_spec = [(Blob.type_num, b'blob'), (Blob.type_num, b'other')]
+        for i in range(20):
+            objects_spec.append(
+                (OFS_DELTA, (i % 2, b'blob' + str(i).encode('ascii'))))
+        path, entries = self.make_pack_file(objects_spec)
+        self.assertParallelEntriesMatch(
+            range(len(entries)), entries, self.make_parallel_iter(path))
+
+    def test_parallel_mixed_chain(self):
+        path, entries = self.make_pack_file([
+            (Blob.type_num, b'blob'),
+            (REF_DELTA, (2, b'blob2')),
+            (OFS_DELTA, (0, b'blob1')),
+            (OFS_DELTA, (1, b'blob3')),
+            (OFS_DELTA, (0, b'bob')),
+            (Blob.type_num, b'other'),
+            (REF_DELTA, (5, b'other1')),
+        ])
+        self.assertParallelEntriesMatch(
+            range(len(entries)), entries, self.make_parallel_iter(path))
+
+    def test_parallel_ext_ref_chain(self):
+        blob = make_object(Blob, data=b'blob')
+        self.store.add_object(blob)
+        path, entries = self.make_pack_file([
+            (REF_DELTA, (1, b'blob2')),
+            (REF_DELTA, (blob.id, b'blob1')),
+            (Blob.type_num, b'other'),
+            (OFS_DELTA, (2, b'other1')),
+        ])
+        ext_refs = {hex_to_sha(blob.id): (Blob.type_num, [b'blob'])}
+        pack_iter = self.make_parallel_iter(
+            path, resolve_ext_ref=ext_refs.__getitem__)
+        self.assertParallelEntriesMatch([0, 1, 2, 3], entries, pack_iter)
+        self.assertEqual([hex_to_sha(blob.id)], pack_iter.ext_refs())
+
+    def test_parallel_bad_ext_ref(self):
+        blob = make_object(Blob, data=b'blob')
+        self.store.add_object(blob)
+        path, entries = self.make_pack_file([
+            (Blob.type_num, b'other'),
+            (REF_DELTA, (blob.id, b'blob1')),
+        ])
+        pack_iter = self.make_parallel_iter(path)
+        self.assertRaises(
+            KeyError, list, pack_iter.iter_parallel(processes=2))
+
+    def test_parallel_not_a_file(self):
+        f = BytesIO()
+        entries = build_pack(f, [
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+        ])
+        pack_iter = TestPackIterator.for_pack_data(
+            PackData('test.pack', file=f))
+        self.assertEqual(entries, list(pack_iter.iter_parallel(processes=2)))
+
+    def test_parallel_no_mmap(self):
+        path, entries = self.make_pack_file([
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+        ])
+        pack_iter = self.make_parallel_iter(path)
+
+        def fail(filename, processes):
+            self.fail('chains walked in parallel without mmap')
+        pack_iter._walk_all_chains_parallel = fail
+        self.addCleanup(setattr, pack_module, 'has_mmap', pack_module.has_mmap)
+        pack_module.has_mmap = False
+        self.assertEqual(entries, list(pack_iter.iter_parallel(processes=2)))
+
+    def test_create_index(self):
+        objects_spec = [(Blob.type_num, b'blob'), (Blob.type_num, b'other')]
+        for i in range(10):
+            objects_spec.append(
+                (OFS_DELTA, (i % 2, b'blob' + str(i).encode('ascii'))))
+        path, entries = self.make_pack_file(objects_spec)
+        data = PackData(path)
+        self.addCleanup(data.close)
+        self.assertEqual(data.sorted_entries(),
+                         data.sorted_entries(processes=2))
+        serial_path = os.path.join(os.path.dirname(path), 'serial.idx')
+        parallel_path = os.path.join(os.path.dirname(path), 'parallel.idx')
+        data.create_index(serial_path)
+        data.create_index(parallel_path, processes=2)
+        with open(serial_path, 'rb') as f:
+            serial = f.read()
+        with open(parallel_path, 'rb') as f:
+            self.assertEqual(serial, f.read())
+
+
+class StreamingPackIndexerTests(TestCase):
+
+    def setUp(self):
+        super(StreamingPackIndexerTests, self).setUp()
+        self.store = MemoryObjectStore()
+        self.ext_refs = {}
+
+    def add_ext_ref(self, data):
+        blob = make_object(Blob, data=data)
+        self.store.add_object(blob)
+        self.ext_refs[hex_to_sha(blob.id)] = (Blob.type_num, [data])
+        return blob
+
+    def copy_pack(self, objects_spec, cache_size=1024*1024):
+        f = BytesIO()
+        entries = build_pack(f, objects_spec, store=self.store)
+        out = BytesIO()
+        indexer = StreamingPackIndexer(
+            out, resolve_ext_ref=self.ext_refs.__getitem__,
+            cache_size=cache_size)
+        copier = PackStreamCopier(BytesIO(f.getvalue()).read, None, out,
+                                  delta_iter=indexer)
+        copier.verify()
+        self.assertEqual(f.getvalue(), out.getvalue())
+        return indexer, entries
+
+    def assertIndexed(self, entries, indexer):
+        expected = sorted((sha, offset, crc32)
+                          for (offset, type_num, data, sha, crc32) in entries)
+        self.assertEqual(expected, sorted(indexer))
+
+    def test_resolved_while_streaming(self):
+        indexer, entries = self.copy_pack([
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+            (OFS_DELTA, (1, b'blob2')),
+            (REF_DELTA, (1, b'blob3')),
+        ])
+        self.assertEqual(4, len(indexer._entries))
+        self.assertIndexed(entries, indexer)
+        self.assertEqual([], indexer.ext_refs())
+
+    def test_ref_to_later_object(self):
+        indexer, entries = self.copy_pack([
+            (REF_DELTA, (2, b'blob1')),
+            (OFS_DELTA, (0, b'blob2')),
+            (Blob.type_num, b'blob'),
+        ])
+        self.assertEqual(1, len(indexer._entries))
+        self.assertIndexed(entries, indexer)
+
+    def test_evicted_bases(self):
+        indexer, entries = self.copy_pack([
+            (Blob.type_num, b'blob'),
+            (OFS_DELTA, (0, b'blob1')),
+            (OFS_DELTA, (1, b'blob2')),
+            (REF_DELTA, (1, b'blob3')),
+            (REF_DELTA, (5, b'blob4')),
+            (OFS_DELTA, (2, b'blob5')),
+        ], cache_size=0)
+        self.assertEqual(1, len(indexer._entries))
+        self.assertIndexed(entries, indexer)
+
+    def test_ext_ref(self):
+        blob = self.add_ext_ref(b'blob')
+        indexer, entries = self.copy_pack([
+            (REF_DELTA, (blob.id, b'blob1')),
+            (OFS_DELTA, (0, b'blob2')),
+            (Blob.type_num, b'other'),
+        ])
+        self.assertEqual(1, len(indexer._entries))
+        self.assertIndexed(entries, indexer)
+        self.assertEqual([hex_to_sha(blob.id)], indexer.ext_refs())
+
+    def test_missing_ext_ref(self):
+        blob = self.add_ext_ref(b'blob')
+        indexer, entries = self.copy_pack([
+            (REF_DELTA, (blob.id, b'blob1')),
+        ])
+        del self.ext_refs[hex_to_sha(blob.id)]
+        self.assertRaises(KeyError, list, indexer)
+
+
 class DeltaEncodeSizeTests(TestCase):
 
     def test_basic(self):
@@ -29,6 +29,7 @@ import shutil
 import tarfile
 import tempfile
 import time
+import zlib
 
 from dulwich import porcelain
 from dulwich.diff_tree import tree_changes
@@ -37,6 +38,7 @@ from dulwich.objects import (
     Tag,
     Tree,
     ZERO_SHA,
+    hex_to_sha,
     )
 from dulwich.repo import Repo
 from dulwich.tests import (
@@ -44,6 +46,7 @@ from dulwich.tests import (
     )
 from dulwich.tests.utils import (
     build_commit_graph,
+    make_commit,
     make_object,
     )
 
@@ -803,6 +806,39 @@ class RepackTests(PorcelainTestCase):
         porcelain.add(repo=self.repo.path, paths=filename)
         porcelain.repack(self.repo)
 
+    def test_config(self):
+        c = self.repo.get_config()
+        c.set((b'pack', ), b'window', b'0')
+        c.set((b'pack', ), b'compression', b'0')
+        c.write_to_path()
+        b1 = Blob.from_string(b'blob' * 100)
+        b2 = Blob.from_string(b'blob' * 100 + b'2')
+        self.repo.object_store.add_object(b1)
+        self.repo.object_store.add_object(b2)
+        porcelain.repack(self.repo)
+        for b in (b1, b2):
+            unpacked = self.repo.object_store.get_unpacked_object(
+                b.id, include_comp=True)
+            self.assertEqual(Blob.type_num, unpacked.pack_type_num)
+            self.assertEqual(zlib.compress(b.as_raw_string(), 0),
+                             b''.join(unpacked.comp_chunks))
+
+    def test_write_bitmaps(self):
+        c = self.repo.get_config()
+        c.set((b'repack', ), b'writeBitmaps', b'true')
+        c.write_to_path()
+        c1, c2 = build_commit_graph(self.repo.object_store, [[1], [2, 1]])
+        porcelain.repack(self.repo)
+        self.assertEqual([hex_to_sha(c2.id)],
+                         list(self.repo.object_store.packs[0].bitmap))
+        # The next pack misses the history of its commit.
+        c3 = make_commit(parents=[c2.id], tree=c2.tree)
+        self.repo.object_store.add_object(c3)
+        porcelain.repack(self.repo)
+        self.assertEqual(
+            [None], [p.bitmap for p in self.repo.object_store.packs
+                     if c3.id in p])
+
 
 class LsTreeTests(PorcelainTestCase):
 
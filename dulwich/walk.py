@@ -84,19 +84,27 @@ class WalkEntry(object):
 
 
 class _CommitTimeQueue(object):
-    """Priority queue of WalkEntry objects by commit time."""
+    """Priority queue of WalkEntry objects by commit time.
+
+    If the walker has a commit-graph, the commit times and parents of the
+    commits in it are read from the commit-graph, so that only the commits
+    that are returned have to be read and parsed.
+    """
 
     def __init__(self, walker):
         self._walker = walker
         self._store = walker.store
         self._get_parents = walker.get_parents
+        self._graph = walker.commit_graph
         self._excluded = walker.excluded
         self._pq = []
         self._pq_set = set()
+        # Commits in the queue that have already been parsed
+        self._commits = {}
         self._seen = set()
         self._done = set()
         self._min_time = walker.since
-        self._last = None
+        self._last_time = None
         self._extra_commits_left = _MAX_EXTRA_COMMITS
         self._is_finished = False
 
@@ -104,52 +112,65 @@ class _CommitTimeQueue(object):
             self._push(commit_id)
 
     def _push(self, commit_id):
-        try:
-            commit = self._store[commit_id]
-        except KeyError:
-            raise MissingCommitError(commit_id)
+        commit = None
+        if self._graph is not None and commit_id in self._graph:
+            commit_time = self._graph.get_commit_time(commit_id)
+        else:
+            try:
+                commit = self._store[commit_id]
+            except KeyError:
+                raise MissingCommitError(commit_id)
+            commit_time = commit.commit_time
         if commit_id not in self._pq_set and commit_id not in self._done:
-            heapq.heappush(self._pq, (-commit.commit_time, commit))
+            heapq.heappush(self._pq, (-commit_time, commit_id))
             self._pq_set.add(commit_id)
             self._seen.add(commit_id)
+            if commit is not None:
+                self._commits[commit_id] = commit
+
+    def _parent_ids(self, commit_id, commit=None):
+        if commit is None:
+            commit = self._commits.get(commit_id)
+        if commit is None:
+            if self._graph is not None and commit_id in self._graph:
+                return self._graph.get_parents(commit_id)
+            commit = self._store[commit_id]
+        return self._get_parents(commit)
 
-    def _exclude_parents(self, commit):
+    def _exclude_parents(self, commit_id):
         excluded = self._excluded
         seen = self._seen
-        todo = [commit]
+        todo = [commit_id]
         while todo:
-            commit = todo.pop()
-            for parent in self._get_parents(commit):
+            commit_id = todo.pop()
+            for parent in self._parent_ids(commit_id):
                 if parent not in excluded and parent in seen:
-                    # TODO: This is inefficient unless the object store does
-                    # some caching (which DiskObjectStore currently does not).
-                    # We could either add caching in this class or pass around
-                    # parsed queue entry objects instead of commits.
-                    todo.append(self._store[parent])
+                    todo.append(parent)
                 excluded.add(parent)
 
     def next(self):
         if self._is_finished:
             return None
         while self._pq:
-            _, commit = heapq.heappop(self._pq)
-            sha = commit.id
+            neg_time, sha = heapq.heappop(self._pq)
+            commit_time = -neg_time
             self._pq_set.remove(sha)
+            commit = self._commits.pop(sha, None)
             if sha in self._done:
                 continue
             self._done.add(sha)
 
-            for parent_id in self._get_parents(commit):
+            for parent_id in self._parent_ids(sha, commit):
                 self._push(parent_id)
 
             reset_extra_commits = True
             is_excluded = sha in self._excluded
             if is_excluded:
-                self._exclude_parents(commit)
-                if self._pq and all(c.id in self._excluded
+                self._exclude_parents(sha)
+                if self._pq and all(c in self._excluded
                                     for _, c in self._pq):
-                    _, n = self._pq[0]
-                    if self._last and n.commit_time >= self._last.commit_time:
+                    if (self._last_time is not None and
+                            -self._pq[0][0] >= self._last_time):
                         # If the next commit is newer than the last one, we need
                         # to keep walking in case its parents (which we may not
                         # have seen yet) are excluded. This gives the excluded
@@ -160,7 +181,7 @@ class _CommitTimeQueue(object):
                         reset_extra_commits = False
 
             if (self._min_time is not None and
-                commit.commit_time < self._min_time):
+                commit_time < self._min_time):
                 # We want to stop walking at min_time, but commits at the
                 # boundary may be out of order with respect to their parents. So
                 # we walk _MAX_EXTRA_COMMITS more commits once we hit this
@@ -176,7 +197,9 @@ class _CommitTimeQueue(object):
                     break
 
             if not is_excluded:
-                self._last = commit
+                if commit is None:
+                    commit = self._store[sha]
+                self._last_time = commit_time
                 return WalkEntry(self._walker, commit)
         self._is_finished = True
         return None
@@ -194,8 +217,7 @@ class Walker(object):
     def __init__(self, store, include, exclude=None, order=ORDER_DATE,
                  reverse=False, max_entries=None, paths=None,
                  rename_detector=None, follow=False, since=None, until=None,
-                 get_parents=lambda commit: commit.parents,
-                 queue_cls=_CommitTimeQueue):
+                 get_parents=None, queue_cls=_CommitTimeQueue):
         """Constructor.
 
         :param store: ObjectStore instance for looking up objects.
@@ -216,7 +238,9 @@ class Walker(object):
             default rename_detector.
         :param since: Timestamp to list commits after.
         :param until: Timestamp to list commits before.
-        :param get_parents: Method to retrieve the parents of a commit
+        :param get_parents: Method to retrieve the parents of a commit. By
+            default the parents recorded in the commits are used, and the
+            store's commit-graph (if any) is used to avoid reading commits.
         :param queue_cls: A class to use for a queue of commits, supporting the
             iterator protocol. The constructor takes a single argument, the
             Walker.
@@ -237,6 +261,11 @@ class Walker(object):
         if follow and not rename_detector:
             rename_detector = RenameDetector(store)
         self.rename_detector = rename_detector
+        self.commit_graph = None
+        if get_parents is None:
+            if store is not None:
+                self.commit_graph = store.get_commit_graph()
+            get_parents = lambda commit: commit.parents
         self.get_parents = get_parents
         self.follow = follow
         self.since = since
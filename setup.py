@@ -60,7 +60,7 @@ else:
         Extension('dulwich._objects', ['dulwich/_objects.c'],
                   include_dirs=include_dirs),
         Extension('dulwich._pack', ['dulwich/_pack.c'],
-                  include_dirs=include_dirs),
+                  include_dirs=include_dirs, libraries=['z']),
         Extension('dulwich._diff_tree', ['dulwich/_diff_tree.c'],
                   include_dirs=include_dirs),
     ]